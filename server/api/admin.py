@@ -0,0 +1,113 @@
+import os
+import secrets
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException
+
+from scheduler import jobs
+from services.publisher import snapshot_publisher
+
+admin_router = APIRouter()
+
+
+def _check_token(token: Optional[str]) -> None:
+    # 觸發與取消需附上與 ADMIN_TOKEN 環境變數相同的 X-Admin-Token；未設定 ADMIN_TOKEN 時一律停用
+    expected = os.environ.get("ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": "Admin endpoints disabled",
+                "message": "Set the ADMIN_TOKEN environment variable to enable triggering and cancelling runs.",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+    if not secrets.compare_digest(token or "", expected):
+        raise HTTPException(
+            status_code=403,
+            detail={
+                "error": "Forbidden",
+                "message": "A valid X-Admin-Token header is required.",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+
+
+def _require_run(name: str) -> None:
+    runs = jobs.RUN_COORDINATOR.state()
+    if name not in runs:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": "Run not found",
+                "message": f"Unknown run '{name}'. Runs: {', '.join(runs)}.",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+
+
+@admin_router.get("/runs", summary="Pipeline run state")
+async def get_runs():
+    """
+    State of every run known to the run coordinator: whether it is running and for how long,
+    whether a follow-up is pending (and how many requests were coalesced into it), and the
+    outcome of the last run; plus the last Storage publish (patch / baseline, bytes saved) and the
+    last alert-rule evaluation (firings per rule, time taken) and its FCM delivery.
+    Only the pipeline leader worker runs anything; followers report idle.
+    """
+    return {
+        "leader": jobs.scheduler.running,
+        "runs": jobs.RUN_COORDINATOR.state(),
+        "last_pipeline": jobs.PIPELINE_STATE,
+        "publisher": {"stats": snapshot_publisher.stats, "last": snapshot_publisher.last_report},
+        "alerts": {
+            "rules": [rule.describe() for rule in jobs.ALERT_ENGINE.rules],
+            "last": jobs.ALERT_ENGINE.last_evaluation,
+            "delivery": jobs.fcm_sender.batch_sender.last_report,
+        },
+    }
+
+
+@admin_router.post("/runs/{name}", summary="Request a run")
+async def trigger_run(name: str, x_admin_token: Optional[str] = Header(None)):
+    """Start the run now, or fold the request into its pending follow-up if it is busy."""
+    _check_token(x_admin_token)
+    _require_run(name)
+    if not jobs.scheduler.running:
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "error": "Not the leader",
+                "message": "This worker does not run the pipeline; send the request to the leader worker.",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+    result = await jobs.RUN_COORDINATOR.request(name)
+    return {"run": name, "result": result}
+
+
+@admin_router.post("/runs/{name}/cancel", summary="Cancel a stuck run")
+async def cancel_run(name: str, force: bool = False, x_admin_token: Optional[str] = Header(None)):
+    """Cancel the active run if it is past its deadline, or unconditionally with force=true."""
+    _check_token(x_admin_token)
+    _require_run(name)
+    if not jobs.RUN_COORDINATOR.is_running(name):
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "error": "Not running",
+                "message": f"Run '{name}' is not active.",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+    if not jobs.RUN_COORDINATOR.cancel(name, force=force):
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "error": "Within deadline",
+                "message": f"Run '{name}' has not reached its deadline; pass force=true to cancel it anyway.",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+    return {"run": name, "result": "cancelled"}
@@ -0,0 +1,14 @@
+from fastapi import APIRouter, Response
+
+from core import instrumentation
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics")
+async def metrics():
+    """
+    Prometheus text exposition of pipeline, upstream, cache and snapshot metrics.
+    Counters are per worker process; scrape each worker (or only the pipeline leader for stage metrics).
+    """
+    return Response(instrumentation.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,12 +1,25 @@
 import logging
-from datetime import datetime
-from typing import Optional, Dict, Any
-from fastapi import APIRouter, HTTPException
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+from fastapi import APIRouter, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 from core import calculation
 from scheduler import jobs
 from core import codes
-from services import discord_sender
+from core import history_store
+from core import payload_cache
+from core import entity_payloads
+from core import json_generator
+from core import spatial_index
+from core import projection
+from core import class_rasters
+from core import snapshot_binary
+import config
+from services.delivery_queue import discord_queue
+from services.snapshot_events import broadcaster, parse_filter, format_sse
 import asyncio
+import json
 
 logger = logging.getLogger(__name__)
 
@@ -17,15 +30,259 @@ async def ping():
 	return {"status": "ok"}
 
 
+def _encoded_response(request: Request, payload: Dict[str, Any], extra_headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Serve a precompressed payload from core.payload_cache: pick the encoding from Accept-Encoding,
+    answer If-None-Match with 304, and let clients cache it until the next scheduled run.
+    """
+    encoding = payload_cache.choose_encoding(request.headers.get("accept-encoding"), payload)
+    etag = payload["etags"][encoding]
+    max_age = max(0, int((jobs.next_scheduled_run() - datetime.now()).total_seconds()))
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}",
+        "Vary": "Accept-Encoding",
+        **(extra_headers or {}),
+    }
+    if payload_cache.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=payload["variants"][encoding], media_type=payload["media_type"], headers=headers)
+
+
+def _parse_fields_or_400(fields: str, valid: List[str]) -> Optional[List[str]]:
+    try:
+        return projection.parse_fields(fields, valid)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Unknown fields",
+                "message": f"Unknown field(s): {e}. Valid fields: {', '.join(valid)}",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+
+
+def _projected_unified_payload(fields: str, compact: bool) -> Dict[str, Any]:
+    """Encoded unified-JSON document for one (fields, compact) combination, cached per snapshot."""
+    selected = _parse_fields_or_400(fields, projection.FIELDS)
+    if not jobs.get_cached_weather_data():
+        raise HTTPException(status_code=503, detail="The final JSON data is not available yet. Please try again in a moment.")
+    name = f"unified:{','.join(selected or ['*'])}:{int(compact)}"
+
+    def build():
+        records = json_generator.get_unified_records()
+        return payload_cache.encode_json(projection.project_document(jobs.get_last_update_time(), records, selected, compact))
+
+    return payload_cache.get_encoded(name, jobs.snapshot_key(), build)
+
+
 @router.get("/all", summary="Get all weather data in the final JSON format")
-async def get_all_weather_data():
+async def get_all_weather_data(request: Request, fields: str = "", compact: bool = False):
     """
     Provides a combined JSON output of all weather data.
+    `fields` (comma-separated top-level keys: county_weather, township_weather, qpf_data, aqi_data,
+    update_time, stale) keeps only those keys; `compact=1` drops null values. The shape is otherwise
+    unchanged; for per-township field projection use /unified.
+    The encoded (identity/gzip/br) bodies are built once per snapshot.
     """
+    selected = _parse_fields_or_400(fields, projection.ALL_FIELDS)
     final_json = jobs.get_cached_weather_data()
     if not final_json:
         raise HTTPException(status_code=503, detail="The final JSON data is not available yet. Please try again in a moment.")
-    return final_json
+    name = f"all:{','.join(selected or ['*'])}:{int(compact)}" if selected or compact else "all"
+
+    def build():
+        if name == "all":
+            return payload_cache.encode_json(final_json)
+        return payload_cache.encode_json(projection.project_all(final_json, selected, compact))
+
+    payload = await asyncio.to_thread(payload_cache.get_encoded, name, jobs.snapshot_key(), build)
+    return _encoded_response(request, payload)
+
+
+@router.get("/unified", summary="Get the unified per-township JSON document")
+async def get_unified_weather_data(request: Request, fields: str = "", compact: bool = False):
+    """
+    {"update_time", "towns": {township_code: record}}, the same document the scheduled job uploads.
+    `fields` (comma-separated) keeps only those keys; `compact=1` uses short keys
+    (see core.projection.FIELD_SHORT_KEYS), omits nulls and sends nowcast frames as [min, max].
+    Each variant is built and compressed once per snapshot.
+    """
+    payload = await asyncio.to_thread(_projected_unified_payload, fields, compact)
+    return _encoded_response(request, payload)
+
+
+@router.get("/all.bin", summary="Get the unified document in the binary encoding")
+async def get_all_weather_binary(request: Request):
+    """
+    The /unified document encoded by core.snapshot_binary: a versioned msgpack message with
+    township codes sent once and each field as a packed column (see encode_snapshot for the
+    schema, decode_snapshot / decode_columns for the reference decoder).
+    Built and compressed once per snapshot; X-Snapshot-Format carries the format version.
+    """
+    if not jobs.get_cached_weather_data():
+        raise HTTPException(status_code=503, detail="The final JSON data is not available yet. Please try again in a moment.")
+
+    def build():
+        return snapshot_binary.encode_snapshot({
+            "update_time": jobs.get_last_update_time(),
+            "towns": json_generator.get_unified_records(),
+        })
+
+    payload = await asyncio.to_thread(
+        payload_cache.get_encoded, "unified_bin", jobs.snapshot_key(), build, snapshot_binary.MEDIA_TYPE
+    )
+    return _encoded_response(
+        request, payload, {"X-Snapshot-Format": f"{snapshot_binary.BINARY_FORMAT}/{snapshot_binary.BINARY_FORMAT_VERSION}"}
+    )
+
+
+@router.get("/raster/{product}/{frame}", summary="Classified rain raster for one product frame")
+async def get_raster(request: Request, product: str, frame: int, format: str = "png", scale: int = 1):
+    """
+    The classified image of `product` (qpf12, qpf6, daily_rain, nowcast) from the current snapshot.
+    `frame` is 1-based (nowcast 1-12 = f01h-f12h, other products only have frame 1).
+    `format=png` returns a palettized PNG with no-rain classes transparent; `format=raw` returns one
+    uint8 class index per pixel, row-major, described by the X-Raster-* headers.
+    `scale` (1, 2, 4, 8) shrinks the raster, keeping the heaviest class in each block.
+    Each variant is rendered once per snapshot.
+    """
+    if format not in ("png", "raw") or scale not in config.RASTER_SCALES:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Invalid parameters",
+                "message": f"format must be png or raw; scale must be one of {', '.join(map(str, config.RASTER_SCALES))}.",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+    raster_set = jobs.CACHED_RASTERS.get(product) if jobs.get_cached_weather_data() else None
+    frames = (raster_set or {}).get("frames") or []
+    if not 1 <= frame <= len(frames) or frames[frame - 1] is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": "Raster not found",
+                "message": f"No raster for product '{product}' frame {frame} in the current snapshot. Products: {', '.join(class_rasters.RASTER_PRODUCTS)}.",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+
+    height, width = (n // scale for n in frames[frame - 1].shape)
+
+    def build():
+        raster = class_rasters.downsample(frames[frame - 1], scale, raster_set["values"])
+        if format == "png":
+            return class_rasters.render_png(raster, raster_set["palette"], raster_set["values"])
+        return raster.tobytes()
+
+    payload = await asyncio.to_thread(
+        payload_cache.get_encoded, f"raster:{product}:{frame}:{scale}:{format}", jobs.snapshot_key(), build,
+        "image/png" if format == "png" else "application/octet-stream", format == "raw",
+    )
+    return _encoded_response(request, payload, {
+        "X-Raster-Width": str(width),
+        "X-Raster-Height": str(height),
+        "X-Raster-Values": ",".join(f"{v:g}" for v in raster_set["values"]),
+    })
+
+
+@router.get("/stream", summary="Stream every township as newline-delimited JSON")
+async def stream_townships(county_code: str = "", fields: str = ""):
+    """
+    Streams one JSON object per line (NDJSON) for each township in the current snapshot.
+    `county_code` (comma-separated) limits the counties, `fields` (comma-separated) the keys;
+    `township_code` is always included; unknown fields are rejected with 400 as on /unified.
+    Records are built one at a time, so memory per request does not grow with the number of townships.
+    """
+    selected = _parse_fields_or_400(fields, projection.FIELDS)
+    cached = jobs.get_cached_weather_data()
+    cwa_county_data = cached.get('county_weather')
+    cwa_township_data = cached.get('township_weather')
+    if not cwa_county_data or not cwa_township_data:
+        raise HTTPException(status_code=503, detail="The final JSON data is not available yet. Please try again in a moment.")
+
+    county_names = None
+    if county_code:
+        county_names = {codes.COUNTY_CODE_TO_NAME.get(c.strip(), c.strip()) for c in county_code.split(",") if c.strip()}
+    # Capture the current snapshot objects; a publish during streaming replaces them, it does not mutate them
+    township_metrics = jobs.CACHED_TOWNSHIP_METRICS
+
+    def generate():
+        for code, record in json_generator.iter_township_records(cwa_county_data, cwa_township_data, township_metrics, county_names):
+            if selected:
+                record = {key: record.get(key) for key in selected}
+            yield json.dumps({"township_code": code, **record}, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@router.get("/events", summary="Server-Sent Events: snapshot update notifications")
+async def snapshot_events(request: Request, county_code: str = "", township_code: str = ""):
+    """
+    Pushes a `snapshot` event (version, update_time and the per-county township delta) every time
+    a run publishes new data. `county_code` / `township_code` (comma-separated) limit the delta.
+    On connect the current version is sent without a delta so clients can tell whether to refresh.
+    """
+    sub = broadcaster.subscribe(
+        parse_filter(county_code, codes.COUNTY_CODE_TO_NAME),
+        parse_filter(township_code, codes.TOWNSHIP_CODE_TO_NAME),
+    )
+
+    async def generate():
+        try:
+            yield format_sse({"version": jobs.SNAPSHOT_STATE['version'], "update_time": jobs.get_last_update_time(), "counties": {}})
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=config.EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            broadcaster.unsubscribe(sub)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws")
+async def snapshot_events_ws(websocket: WebSocket, county_code: str = "", township_code: str = ""):
+    """WebSocket variant of /events: sends the same event objects as JSON text frames."""
+    await websocket.accept()
+    sub = broadcaster.subscribe(
+        parse_filter(county_code, codes.COUNTY_CODE_TO_NAME),
+        parse_filter(township_code, codes.TOWNSHIP_CODE_TO_NAME),
+    )
+    # 同時等待新事件與用戶端訊息；閒置的用戶端斷線時也能立即取消訂閱
+    receive = asyncio.ensure_future(websocket.receive())
+    get = asyncio.ensure_future(sub.queue.get())
+    try:
+        await websocket.send_json({"version": jobs.SNAPSHOT_STATE['version'], "update_time": jobs.get_last_update_time(), "counties": {}})
+        while True:
+            done, _ = await asyncio.wait({receive, get}, return_when=asyncio.FIRST_COMPLETED)
+            if receive in done:
+                if receive.result()["type"] == "websocket.disconnect":
+                    break
+                # 用戶端送來的訊息不需處理
+                receive = asyncio.ensure_future(websocket.receive())
+            if get in done:
+                await websocket.send_json(get.result())
+                get = asyncio.ensure_future(sub.queue.get())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receive.cancel()
+        get.cancel()
+        broadcaster.unsubscribe(sub)
 
 
 @router.get("/county/{county_name}", summary="Get CWA Forecast for a County")
@@ -94,11 +351,81 @@ async def get_county_forecast(county_name: str):
 @router.get("/metrics/images", summary="Get image-derived weather metrics")
 async def get_image_metrics():
     metrics = jobs.CACHED_IMAGE_METRICS
-    if not metrics:
+    if not metrics or jobs.is_snapshot_expired():
         raise HTTPException(status_code=503, detail="Image metrics are not available yet. Please try again in a moment.")
     return metrics
 
 
+@router.get("/history", summary="Get historical image metrics for a township or county")
+async def get_history(
+    township_name: str = "",
+    township_code: str = "",
+    county_code: str = "",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    step_hours: float = 0,
+    fields: str = "",
+):
+    """
+    Returns a columnar time series of per-run image metrics between `start` and `end`
+    (default: the last 30 days), optionally downsampled into `step_hours` buckets.
+    `run_times` are when each snapshot was built, not the upstream products' issue times.
+    `start`/`end` without a timezone are taken as server local time.
+    """
+    from urllib.parse import unquote
+    if county_code:
+        level = "county"
+        entity = codes.COUNTY_CODE_TO_NAME.get(county_code, "")
+    else:
+        level = "township"
+        if township_code:
+            entity = codes.TOWNSHIP_CODE_TO_NAME.get(township_code, "")
+        else:
+            entity = codes.lookup_township(unquote(township_name))
+    if not entity:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": "Location not found",
+                "message": "Please provide a valid township_code, township_name or county_code.",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+
+    # 沒有時區的時間視為伺服器本地時間，兩端都轉成帶時區的時間再比較
+    end_dt = (end or datetime.now()).astimezone()
+    start_dt = start.astimezone() if start else end_dt - timedelta(days=30)
+    if start_dt > end_dt or end_dt - start_dt > timedelta(days=config.HISTORY_MAX_RANGE_DAYS):
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Invalid range",
+                "message": f"start must be before end and the range may not exceed {config.HISTORY_MAX_RANGE_DAYS} days.",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+
+    columns = [f.strip() for f in fields.split(",") if f.strip()] or None
+    result = await asyncio.to_thread(
+        history_store.query_range,
+        config.HISTORY_DB_PATH,
+        entity,
+        start_dt.timestamp(),
+        end_dt.timestamp(),
+        level,
+        step_hours * 3600 if step_hours > 0 else None,
+        columns,
+    )
+    return {
+        level: entity,
+        "start": start_dt.isoformat(),
+        "end": end_dt.isoformat(),
+        "step_hours": step_hours or None,
+        "run_times": [datetime.fromtimestamp(t).isoformat() for t in result["run_times"]],
+        "series": result["series"],
+    }
+
+
 @router.get("/summary", summary="Get combined summary for a county")
 async def get_summary(county_name: str = "", county_code: str = "") -> Dict[str, Any]:
     """
@@ -111,7 +438,7 @@ async def get_summary(county_name: str = "", county_code: str = "") -> Dict[str,
         if county_code:
             decoded_county_name = codes.COUNTY_CODE_TO_NAME.get(county_code, county_code)
         else:
-            decoded_county_name = unquote(county_name)
+            decoded_county_name = codes.lookup_county(unquote(county_name)) or unquote(county_name)
         logger.info(f"Looking up county: {decoded_county_name}")
 
         # County weather from CWA
@@ -141,26 +468,8 @@ async def get_summary(county_name: str = "", county_code: str = "") -> Dict[str,
                 }
             )
 
-        elements = target
-
-        # Image metrics from the consolidated cache
-        image_metrics = jobs.CACHED_IMAGE_METRICS.get(decoded_county_name) or {}
-        # 兼容不同鍵名（作業程序可能存為 daily_rain/nowcast）
-        daily_rain = image_metrics.get("ncdr_daily_rain") or image_metrics.get("daily_rain")
-        nowcast = image_metrics.get("ncdr_nowcast") or image_metrics.get("nowcast")
-
-        resp = {
-            "county": decoded_county_name,
-            "temperature": elements.get("T"),
-            "weather_description": elements.get("Wx"),
-            "qpf12_max_mm_per_hr": image_metrics.get("qpf12_max_mm_per_hr"),
-            "qpf12_min_mm_per_hr": image_metrics.get("qpf12_min_mm_per_hr"),
-            "qpf6_max_mm_per_hr": image_metrics.get("qpf6_max_mm_per_hr"),
-            "qpf6_min_mm_per_hr": image_metrics.get("qpf6_min_mm_per_hr"),
-            "aqi_level": image_metrics.get("aqi_level"),
-            "ncdr_nowcast": nowcast,
-            "ncdr_daily_rain": daily_rain,
-        }
+        # CWA county forecast combined with the aggregated image metrics
+        resp = entity_payloads.build_county_payload(decoded_county_name)
         logger.info(f"Successfully fetched summary for county: {decoded_county_name}")
         return resp
 
@@ -195,6 +504,137 @@ async def list_codes():
     }
 
 
+class BatchQuery(BaseModel):
+    township_codes: List[str] = []
+    county_codes: List[str] = []
+
+
+@router.post("/batch", summary="Get forecasts for many townships and counties at once")
+async def get_batch(query: BatchQuery):
+    """
+    Returns the township (same body as GET /) and county (same body as /summary) payloads for every
+    requested code. Unknown codes get a per-item error marker instead of failing the request.
+    """
+    total = len(query.township_codes) + len(query.county_codes)
+    if total > config.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Batch too large",
+                "message": f"A batch may contain at most {config.BATCH_MAX_ITEMS} codes, got {total}.",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+    if not jobs.get_cached_weather_data().get('township_weather'):
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": "Data unavailable",
+                "message": "Forecast data is not available yet. Please try again in a moment.",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+
+    payloads = await asyncio.to_thread(entity_payloads.get_entity_payloads)
+    townships = {
+        code: payloads["townships"].get(code) or {"error": "Township not found", "township_code": code}
+        for code in query.township_codes
+    }
+    counties = {
+        code: payloads["counties"].get(code) or {"error": "County not found", "county_code": code}
+        for code in query.county_codes
+    }
+    return {
+        "update_time": jobs.get_last_update_time(),
+        "townships": townships,
+        "counties": counties,
+    }
+
+
+def _check_coordinates(lat: float, lon: float, label: str = "") -> None:
+    # NaN 也會落在這裡（任何比較皆為 False）
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Invalid coordinates",
+                "message": f"{label}lat must be within [-90, 90] and lon within [-180, 180], got ({lat}, {lon}).",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+
+
+def _within_max_distance(matches):
+    return [(name, d) for name, d in matches if d <= config.NEAREST_MAX_DISTANCE_KM]
+
+
+@router.get("/nearest", summary="Get the forecast of the township closest to a GPS position")
+async def get_nearest_township(lat: float, lon: float, k: int = Query(1, ge=1)):
+    """
+    Resolves (lat, lon) to the k closest townships (by great-circle distance to the township
+    centre in config.TOWNSHIP_COORDS) and returns each one's forecast payload. Townships further
+    than config.NEAREST_MAX_DISTANCE_KM are not returned; 404 if none is that close.
+    """
+    _check_coordinates(lat, lon)
+    matches = _within_max_distance(spatial_index.get_township_index().nearest(lat, lon, min(k, config.NEAREST_MAX_K)))
+    if not matches:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": "No township nearby",
+                "message": f"No township within {config.NEAREST_MAX_DISTANCE_KM} km of ({lat}, {lon}).",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+    payloads = (await asyncio.to_thread(entity_payloads.get_entity_payloads))["townships"] if jobs.get_cached_weather_data() else {}
+    results = []
+    for name, distance_km in matches:
+        code = codes.TOWNSHIP_NAME_TO_CODE.get(name)
+        results.append({
+            "township": name,
+            "township_code": code,
+            "distance_km": round(distance_km, 3),
+            "forecast": payloads.get(code),
+        })
+    return {"lat": lat, "lon": lon, "results": results}
+
+
+class NearestBatchQuery(BaseModel):
+    points: List[Tuple[float, float]]
+    k: int = 1
+
+
+@router.post("/nearest", summary="Resolve many GPS positions to their closest townships")
+async def get_nearest_townships_batch(query: NearestBatchQuery):
+    """
+    Batch variant of GET /nearest: `points` is a list of [lat, lon]. Returns township codes and
+    distances only (fetch forecasts with POST /batch); a point with no township within
+    config.NEAREST_MAX_DISTANCE_KM gets null.
+    """
+    if len(query.points) > config.NEAREST_BATCH_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Batch too large",
+                "message": f"At most {config.NEAREST_BATCH_MAX} points per request, got {len(query.points)}.",
+                "timestamp": datetime.now().isoformat()
+            }
+        )
+    for i, (lat, lon) in enumerate(query.points):
+        _check_coordinates(lat, lon, f"points[{i}]: ")
+    index = spatial_index.get_township_index()
+    lats = [p[0] for p in query.points]
+    lons = [p[1] for p in query.points]
+    matches = await asyncio.to_thread(index.nearest_many, lats, lons, max(1, min(query.k, config.NEAREST_MAX_K)))
+    results = []
+    for row in matches:
+        row = _within_max_distance(row)
+        results.append([
+            {"township_code": codes.TOWNSHIP_NAME_TO_CODE.get(name), "distance_km": round(d, 3)} for name, d in row
+        ] if row else None)
+    return {"results": results}
+
+
 @router.get("/", summary="Get CWA Forecast for a Township")
 async def get_township_forecast(township_name: str = "", township_code: str = ""):
     """
@@ -208,7 +648,7 @@ async def get_township_forecast(township_name: str = "", township_code: str = ""
             decoded_township_name = codes.TOWNSHIP_CODE_TO_NAME.get(township_code, township_code)
             logger.info(f"Looking up township by code: {township_code} -> {decoded_township_name}")
         else:
-            decoded_township_name = unquote(township_name)
+            decoded_township_name = codes.lookup_township(unquote(township_name)) or unquote(township_name)
             logger.info(f"Looking up township by name: {decoded_township_name}")
 
         township_map = jobs.get_cached_weather_data().get('township_weather')
@@ -223,7 +663,7 @@ async def get_township_forecast(township_name: str = "", township_code: str = ""
             # Fallback: try to parse directly from full records if map not ready
             logger.warning("Township map not available, falling back to full records")
             cwa_full = jobs.CACHED_CWA_TOWNSHIP_DATA
-            if cwa_full:
+            if cwa_full and not jobs.is_snapshot_expired():
                 forecast = calculation.get_forecast_for_township_from_records(
                     township_name=decoded_township_name,
                     all_cwa_data=cwa_full,
@@ -241,23 +681,8 @@ async def get_township_forecast(township_name: str = "", township_code: str = ""
                 }
             )
 
-        # Attach county-derived metrics from the consolidated image metrics cache
-        county_name = codes.resolve_county_from_township_name(decoded_township_name)
-        image_metrics = jobs.CACHED_IMAGE_METRICS.get(county_name) or {}
-        # 兼容不同鍵名（作業程序可能存為 daily_rain/nowcast）
-        daily_rain = image_metrics.get("ncdr_daily_rain") or image_metrics.get("daily_rain")
-        nowcast = image_metrics.get("ncdr_nowcast") or image_metrics.get("nowcast")
-
-        response = {
-            **forecast,
-            "qpf12_max_mm_per_hr": image_metrics.get("qpf12_max_mm_per_hr"),
-            "qpf12_min_mm_per_hr": image_metrics.get("qpf12_min_mm_per_hr"),
-            "qpf6_max_mm_per_hr": image_metrics.get("qpf6_max_mm_per_hr"),
-            "qpf6_min_mm_per_hr": image_metrics.get("qpf6_min_mm_per_hr"),
-            "aqi_level": image_metrics.get("aqi_level"),
-            "ncdr_nowcast": nowcast,
-            "ncdr_daily_rain": daily_rain,
-        }
+        # Attach this township's own image-derived metrics
+        response = entity_payloads.build_township_payload(decoded_township_name, forecast)
         
         # Format and send to Discord
         message = f"""
@@ -273,7 +698,7 @@ async def get_township_forecast(township_name: str = "", township_code: str = ""
         - QPF 6h (min/max): {response.get('qpf6_min_mm_per_hr', 'N/A')} / {response.get('qpf6_max_mm_per_hr', 'N/A')}
         - AQI Level: {response.get('aqi_level', 'N/A')}
         """
-        await asyncio.to_thread(discord_sender.send_to_discord, message)
+        discord_queue.enqueue(message)
 
         logger.info(f"Successfully fetched forecast for township: {decoded_township_name}")
         return response
@@ -331,33 +756,22 @@ async def notify_township(township_name: str):
                 }
             )
 
-        county_name = codes.resolve_county_from_township_name(decoded_township_name)
-        image_metrics = jobs.CACHED_IMAGE_METRICS.get(county_name) or {}
+        image_metrics = jobs.get_township_image_metrics(decoded_township_name) or {}
 
         msg = (
             f"天氣摘要 - {decoded_township_name}\n"
             f"溫度: {forecast['cwa_forecast'].get('temperature')}\n"
             f"天氣概況: {forecast['cwa_forecast'].get('weather_description')}\n"
             f"12小時降雨機率(鄉): {forecast['cwa_forecast'].get('chance_of_rain_12h')}\n"
-            f"12小時降雨強度(縣, mm/hr): {image_metrics.get('qpf12_min_mm_per_hr')} - {image_metrics.get('qpf12_max_mm_per_hr')}\n"
-            f"6小時降雨強度(縣, mm/hr): {image_metrics.get('qpf6_min_mm_per_hr')} - {image_metrics.get('qpf6_max_mm_per_hr')}\n"
-            f"AQI 等級(縣): {image_metrics.get('aqi_level')}\n"
+            f"12小時降雨強度(鄉, mm/hr): {image_metrics.get('qpf12_min_mm_per_hr')} - {image_metrics.get('qpf12_max_mm_per_hr')}\n"
+            f"6小時降雨強度(鄉, mm/hr): {image_metrics.get('qpf6_min_mm_per_hr')} - {image_metrics.get('qpf6_max_mm_per_hr')}\n"
+            f"AQI 等級(鄉): {image_metrics.get('aqi_level')}\n"
         )
 
-        try:
-            await asyncio.to_thread(discord_sender.send_to_discord, msg)
-            logger.info(f"Successfully sent Discord notification for township: {decoded_township_name}")
-            return {"ok": True}
-        except Exception as e:
-            logger.error(f"Failed to send Discord notification: {str(e)}", exc_info=True)
-            raise HTTPException(
-                status_code=503,
-                detail={
-                    "error": "Discord notification failed",
-                    "message": "Failed to send notification to Discord. Please try again later.",
-                    "timestamp": datetime.now().isoformat()
-                }
-            )
+        # Delivery happens in the background; an identical pending message is coalesced
+        queued = discord_queue.enqueue(msg)
+        logger.info(f"Queued Discord notification for township: {decoded_township_name} (queued={queued})")
+        return {"ok": True, "queued": queued}
 
     except HTTPException:
         raise
@@ -0,0 +1,116 @@
+"""
+Benchmark: the binary snapshot encoding (core.snapshot_binary, served as /api/weather/all.bin)
+against the unified JSON document it replaces: body size (raw, gzip, brotli when installed)
+and client decode time.
+
+The document is synthetic but shaped like a real one: every township, CWA numbers as text,
+weather descriptions from a small vocabulary, rain values from the QPF color map and twelve
+nowcast frames. The script also checks that decode_snapshot returns the same document.
+
+Run from the server directory:
+    python benchmarks/bench_binary_snapshot.py [--repeat 50]
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import config  # noqa: E402
+from core import codes, payload_cache, snapshot_binary  # noqa: E402
+from core.township_metrics import AQI_LEVELS, NOWCAST_FRAMES  # noqa: E402
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+WEATHER = ["晴", "多雲", "陰", "多雲時陰短暫雨", "陰短暫陣雨", "午後短暫雷陣雨", "陰時多雲短暫陣雨或雷雨"]
+
+
+def make_document(seed: int = 7):
+    rng = random.Random(seed)
+    rain = sorted(set(config.QPF_COLOR_MAP.values()))
+    towns = {}
+    for name, code in codes.TOWNSHIP_NAME_TO_CODE.items():
+        lo, hi = sorted(rng.sample(rain, 2))
+        frames = [sorted(rng.choices(rain, k=2)) for _ in range(NOWCAST_FRAMES)]
+        pop = str(rng.randrange(0, 101, 10))
+        towns[code] = {
+            "township_name": name,
+            "county_name": codes.resolve_county_from_township_name(name),
+            "temperature": str(rng.randint(12, 34)),
+            "weather_description": rng.choice(WEATHER),
+            "pop6h": pop,
+            "pop12h": pop,
+            "aqi_level": rng.choice(AQI_LEVELS),
+            "cwa_qpf_6h_min": lo,
+            "cwa_qpf_6h_max": hi,
+            "cwa_qpf_12h_min": lo,
+            "cwa_qpf_12h_max": hi,
+            "ncdr_daily_rain_min": lo,
+            "ncdr_daily_rain_max": hi,
+            "ncdr_nowcast": [{"min": a, "max": b} for a, b in frames],
+        }
+    return {"update_time": "2026-10-19T08:00:00", "towns": towns}
+
+
+def _as_numbers(doc):
+    """The JSON document with text numbers parsed, i.e. what decode_snapshot should return."""
+    towns = {}
+    for code, record in doc["towns"].items():
+        record = dict(record)
+        record["temperature"] = float(record["temperature"])
+        record["pop6h"], record["pop12h"] = int(record["pop6h"]), int(record["pop12h"])
+        towns[code] = record
+    return {"update_time": doc["update_time"], "towns": towns}
+
+
+def _sizes(body: bytes):
+    out = {"raw": len(body), "gzip": len(gzip.compress(body, compresslevel=9))}
+    if brotli is not None:
+        out["br"] = len(brotli.compress(body, quality=9))
+    return out
+
+
+def _best(func, repeat: int) -> float:
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    doc = make_document()
+    json_body = payload_cache.encode_json(doc)
+    bin_body = snapshot_binary.encode_snapshot(doc)
+
+    print(f"{len(doc['towns'])} townships\n")
+    json_sizes, bin_sizes = _sizes(json_body), _sizes(bin_body)
+    print(f"{'bytes':<28}" + "".join(f"{enc:>10}" for enc in json_sizes))
+    print(f"{'unified JSON':<28}" + "".join(f"{v:>10}" for v in json_sizes.values()))
+    print(f"{'binary (all.bin)':<28}" + "".join(f"{v:>10}" for v in bin_sizes.values()))
+    print(f"{'ratio':<28}" + "".join(f"{bin_sizes[k] / json_sizes[k]:>10.2f}" for k in json_sizes) + "\n")
+
+    print(f"{'decode (best of ' + str(args.repeat) + ')':<28}{'ms':>10}")
+    json_ms = _best(lambda: json.loads(json_body), args.repeat)
+    doc_ms = _best(lambda: snapshot_binary.decode_snapshot(bin_body), args.repeat)
+    col_ms = _best(lambda: snapshot_binary.decode_columns(bin_body), args.repeat)
+    print(f"{'json.loads':<28}{json_ms:>10.3f}")
+    print(f"{'decode_snapshot (records)':<28}{doc_ms:>10.3f}  {json_ms / doc_ms:.1f}x")
+    print(f"{'decode_columns (arrays)':<28}{col_ms:>10.3f}  {json_ms / col_ms:.1f}x")
+    enc_ms = _best(lambda: snapshot_binary.encode_snapshot(doc), args.repeat)
+    json_enc_ms = _best(lambda: payload_cache.encode_json(doc), args.repeat)
+    print(f"\n{'encode: JSON / binary (ms)':<28}{json_enc_ms:>10.3f}{enc_ms:>10.3f}")
+
+    print(f"\nround trip matches the JSON document: {snapshot_binary.decode_snapshot(bin_body) == _as_numbers(doc)}")
+
+
+if __name__ == "__main__":
+    main()
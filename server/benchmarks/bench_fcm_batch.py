@@ -0,0 +1,116 @@
+"""
+Benchmark: FCM delivery through fcm_sender.BatchSender against the previous one-message-per-call
+loop (messaging.send for each message, in order), offline against services.fake_messaging.
+
+Two workloads:
+  - alerts: one topic message per township per alert rule, i.e. every rule firing everywhere
+  - tokens: a direct send to N device tokens, some of them unregistered
+
+Each FCM call costs --latency seconds (one round trip) plus --per-message seconds per message.
+The serial token run is timed on the first --legacy-sample messages and projected to all of
+them. The batched run also checks that every valid message was delivered exactly once and that
+exactly the unregistered tokens were reported.
+
+Run from the server directory:
+    python benchmarks/bench_fcm_batch.py [--latency 0.05] [--per-message 0.0002] [--tokens 20000]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import config  # noqa: E402
+from core import codes  # noqa: E402
+from services import fcm_sender  # noqa: E402
+from services.fake_messaging import FakeMessaging  # noqa: E402
+
+
+def alert_messages():
+    return [
+        fcm_sender.topic_message(f"{rule['id']} {name}", "body", f"weather_{code}", {"rule": rule["id"]})
+        for rule in config.ALERT_RULES
+        for name, code in codes.TOWNSHIP_NAME_TO_CODE.items()
+    ]
+
+
+# --- Previous implementation, kept for comparison ---
+
+def legacy_send_all(backend, messages):
+    sent = 0
+    for message in messages:
+        try:
+            backend.send(message)
+            sent += 1
+        except Exception:
+            pass
+    return sent
+
+
+def _legacy(messages, latency, per_message, invalid=()):
+    backend = FakeMessaging(latency=latency, per_message=per_message, invalid_tokens=invalid)
+    started = time.perf_counter()
+    sent = legacy_send_all(backend, messages)
+    return time.perf_counter() - started, sent, backend
+
+
+def _batched(messages, latency, per_message, invalid=()):
+    backend = FakeMessaging(latency=latency, per_message=per_message, invalid_tokens=invalid)
+    dropped = []
+    sender = fcm_sender.BatchSender(backend, batch_size=config.FCM_BATCH_SIZE, concurrency=config.FCM_BATCH_CONCURRENCY,
+                                    on_invalid_tokens=dropped.extend)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = asyncio.run(sender.send(messages))
+    return time.perf_counter() - started, report, backend, dropped
+
+
+def _row(label, seconds, sent, calls, total):
+    print(f"{label:<28}{seconds:>9.2f}s{sent:>9}/{total:<7}{calls:>7} calls{total / seconds:>12,.0f} msg/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated seconds per FCM call")
+    parser.add_argument("--per-message", type=float, default=0.0002, help="simulated seconds per message in a call")
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--invalid", type=float, default=0.02, help="fraction of unregistered tokens")
+    parser.add_argument("--legacy-sample", type=int, default=500, help="messages timed in the serial token run")
+    args = parser.parse_args()
+
+    print(f"{args.latency * 1000:.0f} ms per FCM call + {args.per_message * 1000:.2f} ms per message, "
+          f"batch size {config.FCM_BATCH_SIZE}, concurrency {config.FCM_BATCH_CONCURRENCY}\n")
+
+    messages = alert_messages()
+    print(f"alerts: {len(config.ALERT_RULES)} rules x {len(codes.TOWNSHIP_NAME_TO_CODE)} townships = {len(messages)} topic messages")
+    old_s, old_sent, old_backend = _legacy(messages, args.latency, args.per_message)
+    _row("one send per message", old_s, old_sent, old_backend.calls, len(messages))
+    new_s, report, backend, _ = _batched(messages, args.latency, args.per_message)
+    _row("BatchSender", new_s, report["sent"], backend.calls, len(messages))
+    print(f"{'speedup':<28}{old_s / new_s:>9.1f}x")
+    topics = sorted(m.topic for m in backend.delivered)
+    print(f"every topic message delivered once: {topics == sorted(m.topic for m in messages)}\n")
+
+    tokens = [f"token-{i:06d}" for i in range(args.tokens)]
+    invalid = set(tokens[::max(1, round(1 / args.invalid))]) if args.invalid else set()
+    messages = fcm_sender.token_messages(tokens, "title", "body")
+    print(f"tokens: {len(tokens)} device tokens, {len(invalid)} unregistered")
+    sample = messages[:args.legacy_sample]
+    old_s, old_sent, old_backend = _legacy(sample, args.latency, args.per_message, invalid)
+    _row(f"one send per message ({len(sample)})", old_s, old_sent, old_backend.calls, len(sample))
+    projected = old_s * len(messages) / len(sample)
+    print(f"{'  projected to all tokens':<28}{projected:>9.2f}s")
+    new_s, report, backend, dropped = _batched(messages, args.latency, args.per_message, invalid)
+    _row("BatchSender", new_s, report["sent"], backend.calls, len(messages))
+    print(f"{'speedup':<28}{projected / new_s:>9.1f}x")
+    print(f"max concurrent calls: {backend.max_in_flight}")
+    print(f"unregistered tokens reported for dropping: {set(dropped) == invalid} ({len(dropped)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark: the township image stage (jobs._stage_township_metrics) against the previous
+serial loop (county by county, one asyncio.to_thread per township per image).
+
+Inputs are replayed: one synthetic rain map per product frame (palette colors in blobs,
+fixed seed) is served in place of the upstream download, after a fixed delay that stands
+in for network latency. The decoded-image cache is cleared before each run, so both
+versions download every image once. The script also checks both produce identical arrays.
+
+Run from the server directory:
+    python benchmarks/bench_image_stage.py [--latency 0.3]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import config  # noqa: E402
+from core import codes, image_analyzer  # noqa: E402
+from core.township_metrics import TownshipMetrics  # noqa: E402
+from scheduler import jobs  # noqa: E402
+
+IMAGE_URLS = {
+    "qpf12": "https://replay/qpf12.png",
+    "qpf6": "https://replay/qpf6.png",
+    "daily_rain": "https://replay/daily_rain.png",
+    "nowcast": "https://replay/nowcast/",
+    "nowcast_frames": [f"https://replay/nowcast/{i:02d}.png" for i in range(12)],
+    "aqi": "https://replay/aqi.png",
+}
+
+
+def _synthetic_map(seed: int, size=(450, 810)) -> Image.Image:
+    """White map with random circular blobs of palette colors."""
+    rng = np.random.default_rng(seed)
+    palette = np.array(list(config.QPF_COLOR_MAP.keys()), dtype=np.uint8)
+    width, height = size
+    img = np.full((height, width, 3), 255, dtype=np.uint8)
+    yy, xx = np.mgrid[0:height, 0:width]
+    for _ in range(60):
+        cx, cy, r = rng.integers(0, width), rng.integers(0, height), rng.integers(10, 80)
+        img[(xx - cx) ** 2 + (yy - cy) ** 2 <= r * r] = palette[rng.integers(0, len(palette))]
+    return Image.fromarray(img)
+
+
+def make_replay(latency: float):
+    urls = [u for k, u in IMAGE_URLS.items() if k not in ("nowcast", "nowcast_frames")] + IMAGE_URLS["nowcast_frames"]
+    images = {url: _synthetic_map(i) for i, url in enumerate(urls)}
+    downloads = []
+
+    def download(url):
+        downloads.append(url)
+        time.sleep(latency)
+        return images[url].copy()
+
+    return download, downloads
+
+
+# --- Previous implementation, kept for comparison ---
+
+async def legacy_stage_township_metrics(image_urls, pixel_maps):
+    pop12_url, pop6_url, daily_rain_url = image_urls['qpf12'], image_urls['qpf6'], image_urls['daily_rain']
+    nowcast_base_url, nowcast_urls, aqi_url = image_urls['nowcast'], image_urls['nowcast_frames'], image_urls['aqi']
+    active_px_map = pixel_maps['active']
+    township_metrics = TownshipMetrics(products=["qpf12", "qpf6", "daily_rain", "nowcast", "aqi"])
+    for county in codes.COUNTY_NAME_TO_CODE:
+        town_names = [t for t, c in codes.TOWNSHIP_TO_COUNTY.items() if c == county]
+        towns = [(t, active_px_map[t]) for t in town_names if active_px_map.get(t)]
+        if not towns:
+            continue
+        for tname, _ in towns:
+            township_metrics.mark_sampled(tname)
+        if pop12_url:
+            for tname, xy in towns:
+                r = await asyncio.to_thread(image_analyzer.analyze_qpf_from_image, pop12_url, xy)
+                township_metrics.set_range("qpf12", tname, r)
+        if pop6_url:
+            for tname, xy in towns:
+                r = await asyncio.to_thread(image_analyzer.analyze_qpf_from_image, pop6_url, xy)
+                township_metrics.set_range("qpf6", tname, r)
+        if daily_rain_url:
+            for tname, xy in towns:
+                r = await asyncio.to_thread(image_analyzer.analyze_ncdr_rain_from_image, daily_rain_url, xy)
+                township_metrics.set_range("daily_rain", tname, r)
+        if nowcast_base_url:
+            for frame, url in enumerate(nowcast_urls):
+                for tname, xy in towns:
+                    r = await asyncio.to_thread(image_analyzer.analyze_ncdr_rain_from_image, url, xy)
+                    township_metrics.set_range("nowcast", tname, r, frame=frame)
+        if aqi_url:
+            box_size = 10
+            for tname, (x, y) in towns:
+                sample_box = (x - box_size // 2, y - box_size // 2, x + box_size // 2, y + box_size // 2)
+                level = await asyncio.to_thread(image_analyzer.analyze_aqi_from_image, aqi_url, sample_box)
+                township_metrics.set_aqi(tname, level)
+    return township_metrics
+
+
+def _run(stage, pixel_maps, downloads):
+    image_analyzer.clear_image_cache()
+    downloads.clear()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(stage(IMAGE_URLS, pixel_maps))
+    return time.perf_counter() - started, result, len(downloads)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.3, help="simulated seconds per image download")
+    args = parser.parse_args()
+
+    download, downloads = make_replay(args.latency)
+    image_analyzer._download_image = download
+    jobs.OVERLAYS.enabled = False
+    pixel_maps = {"active": image_analyzer.build_pixel_maps_from_township_coords(config.TOWNSHIP_COORDS)["450x810"]}
+
+    print(f"{len(IMAGE_URLS['nowcast_frames']) + 4} images, {args.latency:.2f}s simulated latency each, "
+          f"concurrency {config.IMAGE_STAGE_CONCURRENCY}\n")
+    old_s, old, old_dl = _run(legacy_stage_township_metrics, pixel_maps, downloads)
+    print(f"{'serial loop (previous)':<32} {old_s:8.2f}s  downloads={old_dl}")
+    new_s, new, new_dl = _run(jobs._stage_township_metrics, pixel_maps, downloads)
+    print(f"{'fan-out (_stage_township_metrics)':<32} {new_s:8.2f}s  downloads={new_dl}")
+    print(f"{'speedup':<32} {old_s / new_s:8.1f}x\n")
+
+    same = all(np.array_equal(old.arrays[k], new.arrays[k], equal_nan=k not in ("aqi", "sampled")) for k in old.arrays)
+    print(f"identical township arrays: {same}")
+
+
+if __name__ == "__main__":
+    main()
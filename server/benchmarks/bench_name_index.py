@@ -0,0 +1,80 @@
+"""
+Micro-benchmark: precomputed alias index in core.codes vs the previous per-call scans.
+
+Run from the server directory:
+    python benchmarks/bench_name_index.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import codes  # noqa: E402
+
+
+# --- Previous implementations, kept verbatim for comparison ---
+
+def legacy_normalize_name(name: str) -> str:
+    if not isinstance(name, str):
+        return ""
+    return name.replace("台", "臺").strip()
+
+
+def legacy_resolve_county_from_township_name(township_name: str) -> str:
+    if not isinstance(township_name, str):
+        return ""
+    name = legacy_normalize_name(township_name)
+    for county in sorted(codes.COUNTY_NAME_TO_CODE.keys(), key=len, reverse=True):
+        if name.startswith(county):
+            return county
+    return ""
+
+
+def legacy_resolve_township_name(township_name: str) -> str:
+    if not isinstance(township_name, str):
+        return ""
+    normalized = legacy_normalize_name(township_name)
+    if normalized in codes.TOWNSHIP_NAME_TO_CODE:
+        return normalized
+    county = legacy_resolve_county_from_township_name(normalized)
+    if not county:
+        return ""
+    district = normalized[len(county):].strip()
+    for suffix in ["區", "鎮", "市", "鄉"]:
+        if district.endswith(suffix):
+            break
+        full_name = f"{county}{district}{suffix}"
+        if full_name in codes.TOWNSHIP_NAME_TO_CODE:
+            return full_name
+    return ""
+
+
+QUERIES = list(codes.TOWNSHIP_NAME_TO_CODE.keys()) + [
+    "台北市中正區", "臺北中正", "台中市 西屯區", "TPE-100", "100", "太麻里", "不存在的地方",
+]
+
+
+def _bench(label, fn, number):
+    seconds = timeit.timeit(lambda: [fn(q) for q in QUERIES], number=number)
+    per_call = seconds / (number * len(QUERIES)) * 1e9
+    print(f"{label:<48} {per_call:8.0f} ns/call")
+    return per_call
+
+
+def main(number: int = 200):
+    print(f"{len(QUERIES)} queries x {number} rounds\n")
+    old = _bench("legacy resolve_county_from_township_name", legacy_resolve_county_from_township_name, number)
+    new = _bench("codes.resolve_county_from_township_name", codes.resolve_county_from_township_name, number)
+    print(f"{'speedup':<48} {old / new:8.1f}x\n")
+    old = _bench("legacy resolve_township_name", legacy_resolve_township_name, number)
+    new = _bench("codes.resolve_township_name", codes.resolve_township_name, number)
+    print(f"{'speedup':<48} {old / new:8.1f}x\n")
+
+    resolved_old = sum(1 for q in QUERIES if legacy_resolve_township_name(q))
+    resolved_new = sum(1 for q in QUERIES if codes.resolve_township_name(q))
+    print(f"resolved queries: legacy {resolved_old}/{len(QUERIES)}, index {resolved_new}/{len(QUERIES)}")
+
+
+if __name__ == "__main__":
+    main()
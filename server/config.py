@@ -23,6 +23,11 @@ NCDR_API_KEY = "YOUR_NCDR_API_KEY_HERE"
 # Discord Webhook URL (edit directly if used)
 DISCORD_WEBHOOK_URL = "https://discord.com/api/webhooks/1424684753357111369/Cgo20EKHKCZd3eO9wJUDQmLtsTlupgTgTiA1fJyFR667cAqWAo8HeHCRyjpYKcyYLXVt"
 
+# Discord 訊息改由背景佇列送出：工作者數量、佇列上限、同一 webhook 兩次送出的最小間隔（秒）
+DISCORD_QUEUE_WORKERS = 2
+DISCORD_QUEUE_MAX_SIZE = 1000
+DISCORD_MIN_INTERVAL_SECONDS = 0.5
+
 # --- Image Analysis Settings (edit directly) ---
 # URLs for rain probability and AQI images to analyze
 RAIN_PROBABILITY_IMAGE_URL = ""
@@ -147,6 +152,12 @@ CWA_ANCHORS_450x810 = {
 DEBUG_SAVE_SAMPLES = True
 DEBUG_SAVE_DIR = os.path.join(BASE_DIR, "samples")
 DEBUG_SAVE_PER_TOWNSHIP = True
+# 每張圖一次畫上所有鄉鎮的取樣圓並存一張全圖；PER_TOWNSHIP 時另外裁出各鄉鎮周邊的小圖。
+# 每次執行最多寫 DEBUG_SAVE_MAX_PER_RUN 個檔案（None 為不限制），鄉鎮小圖隨機抽樣；
+# 檔案由背景執行緒寫出，不阻塞取樣
+DEBUG_SAVE_MAX_PER_RUN = 40
+DEBUG_SAVE_WRITERS = 2
+DEBUG_SAVE_CROP_RADIUS = 60       # 鄉鎮小圖的半邊長（像素）
 
 CWA_ANCHORS_315x642 = {
     "臺北市": (241, 42),
@@ -526,4 +537,127 @@ TOWNSHIP_COORDS = {
     "花蓮縣玉里鎮": {'lat': 23.3898217, 'lon': 121.3770336},
     "花蓮縣卓溪鄉": {'lat': 23.404007, 'lon': 121.2168466},
     "花蓮縣富里鄉": {'lat': 23.154416, 'lon': 121.2855249},
-}
\ No newline at end of file
+}
+
+
+# --- Decoded image cache ---
+# 同一期圖片只下載、解碼一次，供所有鄉鎮取樣、分類 raster 與除錯疊圖共用
+IMAGE_CACHE_MAX_ENTRIES = 32      # 一次完整執行約 16 張圖
+IMAGE_CACHE_TTL_SECONDS = 600
+
+# 影像取樣階段同時處理的「縣市 × 圖片」工作數（全域上限，完整執行與各 refresh 共用）
+IMAGE_STAGE_CONCURRENCY = 8
+
+# --- Snapshot persistence ---
+# 每次成功執行後把快取寫入磁碟，重啟時先載入舊資料（標記為 stale）再背景更新
+SNAPSHOT_PATH = os.path.join(BASE_DIR, "temp", "snapshot.msgpack")
+# 超過此時數的舊快照不再提供（啟動時不載入，服務中也會回 503）
+SNAPSHOT_MAX_AGE_HOURS = 24
+
+# --- fetch_data_job pipeline ---
+# 各階段逾時（秒）；逾時的階段視為失敗，只影響依賴它的階段
+PIPELINE_DEFAULT_STAGE_TIMEOUT = 300
+PIPELINE_STAGE_TIMEOUTS = {
+    "rasters": 600,
+    "township_metrics": 3600,
+}
+
+# --- Per-product refresh ---
+# 各資料切片的排程（APScheduler cron 參數）。每次先做低成本的變更偵測
+#（影像：最新一期的圖片 URL；CWA：縣市預報與一個探測鄉鎮的內容雜湊），沒有新資料就不重新抓取與分析
+PRODUCT_REFRESH_SCHEDULES = {
+    "cwa": {"hour": "5,8,11,14,17,20,23", "minute": 20},   # CWA 鄉鎮預報約每 3~6 小時更新
+    "qpf": {"minute": 25},                                  # QPF 發布時間不固定，每小時偵測一次
+    "nowcast": {"minute": 10},                              # NCDR 12 小時 nowcast 每小時更新
+    "aqi": {"minute": 40},                                  # AQI 模擬圖每小時更新
+}
+# 22 個鄉鎮資料集（F-D0047-*）同時發布；只抓這個鄉鎮的單一天氣因子，內容改變才重新抓取全部
+CWA_PROBE_TOWNSHIP = ("臺北市", "中正區")
+CWA_PROBE_ELEMENT = "溫度"
+
+# --- Run coordination ---
+# 每個 run（完整 fetch_data_job 或單一資料切片的 refresh）同時只執行一個；執行中收到的請求
+# 合併為一次後續執行。超過期限（秒）的 run 會被取消，也可透過 /api/admin/runs 手動取消
+RUN_DEADLINES = {
+    "full": 5400,      # 各階段逾時加總後仍有餘裕
+    "cwa": 900,
+    "qpf": 3600,
+    "nowcast": 3600,
+    "aqi": 1800,
+}
+
+# --- Publishing to Storage ---
+# 統一 JSON 以緊湊格式直接壓縮成 gzip 上傳（Content-Encoding: gzip），由背景工作執行。
+# 設定 LOCAL_STORAGE_DIR 環境變數時改寫入該目錄（services.local_storage），可離線測試
+PUBLISH_GZIP_LEVEL = 6
+# 每次只上傳與上次發布相比的差異（patch）；每 PUBLISH_BASELINE_EVERY 個 patch，或 patch 大於
+# 完整檔 PUBLISH_BASELINE_RATIO 倍時，改上傳完整基準檔。forecasts/manifest.json 列出基準檔與其後的 patch
+PUBLISH_BASELINE_EVERY = 24
+PUBLISH_BASELINE_RATIO = 0.5
+# 另外依縣市代碼輸出分片（forecasts/shards/<縣市>_<hash>.json）與索引 forecasts/shards/index.json；
+# 分片平行上傳，內容雜湊未變的分片略過
+PUBLISH_SHARD_WORKERS = 8
+
+# --- Alert rules ---
+# 每次產生新快照時，對所有鄉鎮以陣列運算評估下列規則；觸發的 (鄉鎮, 規則) 推播到 FCM topic
+# weather_<鄉鎮代碼>。field 可用 temperature、pop6h、pop12h、aqi_level、cwa_qpf_*、ncdr_daily_rain_*、
+# nowcast_min、nowcast_max（nowcast 以 frames 指定前 N 個影格，reduce 取 max 或 min）
+ALERT_RULES = [
+    {
+        "id": "nowcast_heavy_rain",
+        "field": "nowcast_max", "frames": 3, "reduce": "max", "op": ">=", "value": 15,
+        "title": "{township_name} 強降雨警示",
+        "body": "未來 3 小時預估最大時雨量 {value:g} mm/hr，請留意安全。",
+    },
+    {
+        "id": "pop12_high",
+        "field": "pop12h", "op": ">", "value": 70,
+        "title": "{township_name} 降雨機率偏高",
+        "body": "未來 12 小時降雨機率 {value:g}%，出門記得帶傘。",
+    },
+]
+# 同一鄉鎮的同一規則在冷卻時間內只推播一次（秒）
+ALERT_COOLDOWN_SECONDS = 3 * 3600
+
+# --- FCM delivery ---
+# 推播以 send_each 批次送出（每批最多 500 則），同時最多 FCM_BATCH_CONCURRENCY 個批次；
+# 暫時性錯誤以指數退避重送，失效的 token 會從 Firestore fcmTokens 移除。
+# 設定 FAKE_FCM=1 環境變數時改用 services.fake_messaging，不連線 FCM
+FCM_BATCH_SIZE = 500
+FCM_BATCH_CONCURRENCY = 4
+FCM_MAX_ATTEMPTS = 3
+FCM_RETRY_BACKOFF_SECONDS = 1.0
+
+# --- Multi-worker serving ---
+# 多個 uvicorn worker 時，取得此檔案鎖的行程（leader）才執行排程與資料管線；
+# 其他 worker 每隔 SNAPSHOT_POLL_SECONDS 檢查快照檔是否更新，並嘗試接手 leader
+LEADER_LOCK_PATH = os.path.join(BASE_DIR, "temp", "pipeline.lock")
+SNAPSHOT_POLL_SECONDS = 5
+
+# --- Historical metrics ---
+# 每次執行的鄉鎮/縣市影像指標都追加到此 SQLite 檔（只增不改）
+HISTORY_DB_PATH = os.path.join(BASE_DIR, "temp", "history.sqlite3")
+# /api/weather/history 單次查詢最長範圍（天）
+HISTORY_MAX_RANGE_DAYS = 90
+
+# --- Precompressed payloads ---
+# /api/weather/all 等大型回應每個快照只壓縮一次（brotli 為選用套件）
+PAYLOAD_GZIP_LEVEL = 9
+PAYLOAD_BROTLI_QUALITY = 9
+# 同一快照最多保留幾種已編碼回應（含 fields= / compact=1 的各種投影與 raster 圖層）
+PAYLOAD_CACHE_MAX_ENTRIES = 160
+
+# /api/weather/raster 允許的縮小倍數
+RASTER_SCALES = (1, 2, 4, 8)
+
+# POST /api/weather/batch 單次最多可查詢的代碼數（鄉鎮 + 縣市）
+BATCH_MAX_ITEMS = 100
+
+# /api/weather/events (SSE) 閒置時送出 keepalive 註解的間隔（秒）
+EVENTS_KEEPALIVE_SECONDS = 25
+
+# /api/weather/nearest：單次最多回傳的鄉鎮數，以及 POST 批次查詢的點數上限
+NEAREST_MAX_K = 10
+NEAREST_BATCH_MAX = 10000
+# 距離超過此值（公里）的鄉鎮不算「最近」：離島以外的海上或境外座標回傳找不到
+NEAREST_MAX_DISTANCE_KM = 50
\ No newline at end of file
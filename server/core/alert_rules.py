@@ -0,0 +1,216 @@
+import operator
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import codes
+from .township_metrics import AQI_LEVELS, COUNTY_NAMES, NOWCAST_FRAMES, TOWNSHIP_COUNTY_INDEX, TOWNSHIP_NAMES, TownshipMetrics
+
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+}
+
+# 規則可用的欄位（與統一 JSON 的欄位同名）-> TownshipMetrics 的陣列；None 表示取自 CWA 預報
+FIELDS: Dict[str, Optional[str]] = {
+    "temperature": None,
+    "pop6h": None,
+    "pop12h": None,
+    "aqi_level": "aqi",
+    "cwa_qpf_6h_min": "qpf6_min",
+    "cwa_qpf_6h_max": "qpf6_max",
+    "cwa_qpf_12h_min": "qpf12_min",
+    "cwa_qpf_12h_max": "qpf12_max",
+    "ncdr_daily_rain_min": "daily_rain_min",
+    "ncdr_daily_rain_max": "daily_rain_max",
+    "nowcast_min": "nowcast_min",
+    "nowcast_max": "nowcast_max",
+}
+# 逐影格的欄位，規則需以 frames / reduce 收斂成每個鄉鎮一個值
+FRAME_FIELDS = ("nowcast_min", "nowcast_max")
+
+REDUCERS = {"max": np.fmax.reduce, "min": np.fmin.reduce}
+
+# 各鄉鎮的代碼，順序與 TownshipMetrics 的列相同
+TOWNSHIP_CODES: List[str] = [codes.TOWNSHIP_NAME_TO_CODE[name] for name in TOWNSHIP_NAMES]
+
+
+def _number(value) -> float:
+    """CWA sends numbers as text ("27", "30"); anything not numeric is NaN."""
+    if value is None or isinstance(value, bool):
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def build_columns(metrics: TownshipMetrics, records: Dict[str, Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """
+    {rule field: array with one row per township, in TOWNSHIP_NAMES order}. Image-derived fields
+    are the float32 TownshipMetrics arrays themselves (NaN where the township was not sampled);
+    temperature and PoP are parsed from the CWA values in `records` ({township_code: unified record}).
+    """
+    arrays = metrics.arrays
+    unsampled = ~arrays["sampled"]
+    columns: Dict[str, np.ndarray] = {}
+    for field, key in FIELDS.items():
+        if key is None:
+            columns[field] = np.array([_number((records.get(code) or {}).get(field)) for code in TOWNSHIP_CODES])
+            continue
+        if key == "aqi":
+            values = np.where(arrays["aqi"] < 0, np.nan, arrays["aqi"]).astype(np.float32)
+        else:
+            values = arrays[key]
+        if key in FRAME_FIELDS and "nowcast" not in metrics.products:
+            # 與統一 JSON 相同：沒有 nowcast 來源時視為沒有資料
+            values = np.full_like(values, np.nan)
+        columns[field] = np.where(unsampled.reshape((-1,) + (1,) * (values.ndim - 1)), np.nan, values).astype(values.dtype)
+    return columns
+
+
+class AlertRule:
+    """
+    One declarative rule: `field op value`, evaluated for every township at once.
+
+    Nowcast fields are per frame; `frames` picks a window (N = the next N frames, or [start, stop))
+    and `reduce` ("max" / "min") collapses it to one value per township. aqi_level thresholds may
+    be given as level names ("Unhealthy"); they compare by severity. A township with no value
+    (NaN) never fires. `title` and `body` are format strings over township_name, county_name,
+    township_code and value.
+    """
+
+    def __init__(self, rule_id: str, field: str, op: str, value: Any, frames: Any = None, reduce: str = "max",
+                 title: str = "", body: str = ""):
+        if field not in FIELDS:
+            raise ValueError(f"rule {rule_id}: unknown field '{field}' (valid: {', '.join(FIELDS)})")
+        if op not in OPERATORS:
+            raise ValueError(f"rule {rule_id}: unknown operator '{op}' (valid: {', '.join(OPERATORS)})")
+        if reduce not in REDUCERS:
+            raise ValueError(f"rule {rule_id}: unknown reduce '{reduce}' (valid: {', '.join(REDUCERS)})")
+        if field == "aqi_level" and isinstance(value, str):
+            if value not in AQI_LEVELS:
+                raise ValueError(f"rule {rule_id}: unknown AQI level '{value}'")
+            value = AQI_LEVELS.index(value)
+        if field not in FRAME_FIELDS:
+            window = None
+        elif frames is None:
+            window = (0, NOWCAST_FRAMES)
+        elif isinstance(frames, int):
+            window = (0, frames)
+        else:
+            window = tuple(frames)
+        if window is not None and not 0 <= window[0] < window[1] <= NOWCAST_FRAMES:
+            raise ValueError(f"rule {rule_id}: frames must lie within 0..{NOWCAST_FRAMES}")
+        self.rule_id = rule_id
+        self.field = field
+        self.op = op
+        self.value = float(value)
+        self.window = window
+        self.reduce = reduce
+        self.title = title or rule_id
+        self.body = body
+
+    @classmethod
+    def from_dict(cls, spec: Dict[str, Any]) -> "AlertRule":
+        spec = dict(spec)
+        return cls(spec.pop("id"), **spec)
+
+    def series(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """The value this rule tests, one float per township (NaN = no data)."""
+        values = columns[self.field]
+        if self.window is None:
+            return values
+        start, stop = self.window
+        return REDUCERS[self.reduce](values[:, start:stop], axis=1)
+
+    def evaluate(self, columns: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """(indices of the townships that fire, the tested value of each township)."""
+        values = self.series(columns)
+        with np.errstate(invalid="ignore"):
+            mask = OPERATORS[self.op](values, self.value)
+        return np.flatnonzero(mask), values
+
+    def describe(self) -> Dict[str, Any]:
+        return {"id": self.rule_id, "field": self.field, "op": self.op, "value": self.value,
+                "frames": list(self.window) if self.window else None, "reduce": self.reduce}
+
+
+class AlertEngine:
+    """
+    Evaluates a list of rules against one snapshot and decides which firings to deliver.
+
+    `evaluate` builds the rule columns once (build_columns, straight from the float32
+    TownshipMetrics arrays) and runs every rule as an array predicate, returning all
+    (township, rule) firings. `select` keeps the ones not delivered within `cooldown_seconds`, and
+    `mark_sent` records the ones actually delivered, so a condition that persists across
+    snapshots notifies once per cooldown rather than on every refresh, and a failed send is
+    retried on the next evaluation.
+    """
+
+    def __init__(self, rules: Sequence[AlertRule], cooldown_seconds: float = 3 * 3600):
+        self.rules = list(rules)
+        self.cooldown_seconds = cooldown_seconds
+        # (rule_id, township_code) -> 上次送出的時間
+        self._last_sent: Dict[Tuple[str, str], float] = {}
+        self.last_evaluation: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_config(cls, config) -> "AlertEngine":
+        return cls(
+            [AlertRule.from_dict(spec) for spec in getattr(config, "ALERT_RULES", [])],
+            cooldown_seconds=getattr(config, "ALERT_COOLDOWN_SECONDS", 3 * 3600),
+        )
+
+    def evaluate(self, metrics: TownshipMetrics, records: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Every (township, rule) firing for the snapshot's image metrics and its unified records
+        ({township_code: record}, for the CWA fields), in rule order.
+        """
+        started = time.perf_counter()
+        columns = build_columns(metrics, records)
+        columns_ms = (time.perf_counter() - started) * 1000
+
+        firings = []
+        counts = {}
+        for rule in self.rules:
+            hits, values = rule.evaluate(columns)
+            counts[rule.rule_id] = len(hits)
+            for i in hits.tolist():
+                fields = {
+                    "township_code": TOWNSHIP_CODES[i],
+                    "township_name": TOWNSHIP_NAMES[i],
+                    "county_name": COUNTY_NAMES[TOWNSHIP_COUNTY_INDEX[i]],
+                    "value": float(values[i]),
+                }
+                firings.append({
+                    "rule": rule.rule_id,
+                    **fields,
+                    "topic": f"weather_{TOWNSHIP_CODES[i]}",
+                    "title": rule.title.format(**fields),
+                    "body": rule.body.format(**fields),
+                })
+        self.last_evaluation = {
+            "townships": len(TOWNSHIP_CODES),
+            "firings": counts,
+            "columns_ms": round(columns_ms, 3),
+            "total_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+        return firings
+
+    def select(self, firings: List[Dict[str, Any]], now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """The firings not delivered within the cooldown (nothing is recorded; see mark_sent)."""
+        now = time.time() if now is None else now
+        # 清掉已過冷卻期的紀錄，避免無限增長
+        self._last_sent = {k: t for k, t in self._last_sent.items() if now - t < self.cooldown_seconds}
+        return [firing for firing in firings if (firing["rule"], firing["township_code"]) not in self._last_sent]
+
+    def mark_sent(self, firings: List[Dict[str, Any]], now: Optional[float] = None) -> None:
+        """Start the cooldown of firings whose notification was delivered."""
+        now = time.time() if now is None else now
+        for firing in firings:
+            self._last_sent[(firing["rule"], firing["township_code"])] = now
@@ -1,10 +1,6 @@
 import json
 
-def _normalize_name(name: str) -> str:
-    if not isinstance(name, str):
-        return ""
-    # Normalize common variants and whitespace
-    return name.replace("台", "臺").replace(" ", "").strip()
+from .codes import normalize_name
 
 
 def get_forecast_for_township(township_name: str, township_map: dict):
@@ -21,7 +17,7 @@ def get_forecast_for_township(township_name: str, township_map: dict):
     if not township_map:
         return None
 
-    normalized_name = _normalize_name(township_name)
+    normalized_name = normalize_name(township_name)
     cwa_location_data = township_map.get(normalized_name)
 
     if not cwa_location_data:
@@ -83,7 +79,7 @@ def get_forecast_for_township_from_records(township_name: str, all_cwa_data: dic
                     if isinstance(towns, list):
                         for town in towns:
                             nm = town.get('locationName') or town.get('LocationName')
-                            if _normalize_name(nm) == _normalize_name(township_name):
+                            if normalize_name(nm) == normalize_name(township_name):
                                 target = town
                                 break
                         if target:
@@ -96,7 +92,7 @@ def get_forecast_for_township_from_records(township_name: str, all_cwa_data: dic
         if isinstance(locs, list):
             for loc in locs:
                 nm = loc.get('locationName') or loc.get('LocationName') if isinstance(loc, dict) else None
-                if _normalize_name(nm) == _normalize_name(township_name):
+                if normalize_name(nm) == normalize_name(township_name):
                     target = loc
                     break
     if target is None:
@@ -0,0 +1,59 @@
+import io
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# 每次執行保存的分類影像（uint8 類別索引）；nowcast 為 12 張，其餘產品 1 張
+RASTER_PRODUCTS = ("qpf12", "qpf6", "daily_rain", "nowcast")
+
+
+def make_raster_set(color_map: Dict[Tuple[int, int, int], float], frames: List[Optional[np.ndarray]]) -> Dict[str, Any]:
+    """
+    One product's rasters plus the palette they index into, so they can be rendered later even
+    if the color map in config changes. Frames that failed to download are None.
+    """
+    return {
+        "palette": [list(rgb) for rgb in color_map.keys()],
+        "values": [float(v) for v in color_map.values()],
+        "frames": frames,
+    }
+
+
+def downsample(raster: np.ndarray, factor: int, values: List[float]) -> np.ndarray:
+    """
+    Shrink by an integer factor keeping, for every block, the class with the highest value
+    (so isolated heavy-rain pixels stay visible). Edge rows/columns that do not fill a block are dropped.
+    """
+    if factor <= 1:
+        return raster
+    h, w = raster.shape[0] // factor * factor, raster.shape[1] // factor * factor
+    # 以「數值排名」做 max pooling，再換回類別索引
+    order = np.argsort(np.asarray(values), kind="stable").astype(np.uint8)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order), dtype=np.uint8)
+    blocks = rank[raster[:h, :w]].reshape(h // factor, factor, w // factor, factor)
+    return order[blocks.max(axis=(1, 3))]
+
+
+def render_png(raster: np.ndarray, palette: List[List[int]], values: List[float]) -> bytes:
+    """Palettized PNG; classes whose value is 0 (background / no rain) are fully transparent."""
+    image = Image.fromarray(raster, mode="P")
+    image.putpalette([c for rgb in palette for c in rgb])
+    buf = io.BytesIO()
+    image.save(buf, format="PNG", optimize=True, transparency=bytes(0 if v == 0 else 255 for v in values))
+    return buf.getvalue()
+
+
+def pack_raster_sets(rasters: Dict[str, Dict[str, Any]], pack_array) -> Dict[str, Any]:
+    return {
+        product: {**raster_set, "frames": [None if f is None else pack_array(f) for f in raster_set["frames"]]}
+        for product, raster_set in rasters.items()
+    }
+
+
+def unpack_raster_sets(doc: Dict[str, Any], unpack_array) -> Dict[str, Dict[str, Any]]:
+    return {
+        product: {**raster_set, "frames": [None if f is None else unpack_array(f) for f in raster_set["frames"]]}
+        for product, raster_set in (doc or {}).items()
+    }
@@ -485,23 +485,100 @@ TOWNSHIP_CODE_TO_NAME: Dict[str, str] = {code: name for name, code in TOWNSHIP_N
 
 def normalize_name(name: str) -> str:
     """
-    Normalize the name by replacing common variants.
-    Example: "台北" -> "臺北".
+    Normalize the name by replacing common variants and removing whitespace.
+    Example: "台北市 中正區" -> "臺北市中正區".
     """
     if not isinstance(name, str):
         return ""
-    return name.replace("台", "臺").strip()
+    return "".join(name.split()).replace("台", "臺")
+
+# --- Alias index ---
+# 所有可接受的寫法（台/臺、有無行政區後綴、有無縣市、郵遞區號、代碼）都在載入時展開成
+# 一個 dict，查詢時只需正規化一次再做 O(1) 查表。對應到多個地點的寫法（例如「中正區」）
+# 不收錄，以免猜錯。
+
+_TOWNSHIP_SUFFIXES = ("區", "鎮", "市", "鄉")
+_COUNTY_SUFFIXES = ("市", "縣")
+
+def _alias_key(name: str) -> str:
+    return normalize_name(name).upper()
+
+def _strip_suffix(name: str, suffixes) -> str:
+    # 只在剩下至少兩個字時去掉後綴，避免「東區」變成「東」這種過短的別名
+    if len(name) > 2 and name.endswith(suffixes):
+        return name[:-1]
+    return name
+
+TOWNSHIP_TO_COUNTY: Dict[str, str] = {}
+
+def _build_alias_index():
+    county_aliases: Dict[str, set] = {}
+    township_aliases: Dict[str, set] = {}
+
+    def add(index, alias, target):
+        index.setdefault(_alias_key(alias), set()).add(target)
+
+    for county, code in COUNTY_NAME_TO_CODE.items():
+        for alias in {county, _strip_suffix(county, _COUNTY_SUFFIXES), code}:
+            add(county_aliases, alias, county)
+
+    for township in TOWNSHIP_NAME_TO_CODE:
+        county = max((c for c in COUNTY_NAME_TO_CODE if township.startswith(c)), key=len, default="")
+        TOWNSHIP_TO_COUNTY[township] = county
+        district = township[len(county):]
+        county_forms = {county, _strip_suffix(county, _COUNTY_SUFFIXES), ""}
+        district_forms = {district, _strip_suffix(district, _TOWNSHIP_SUFFIXES)}
+        for county_form in county_forms:
+            for district_form in district_forms:
+                add(township_aliases, county_form + district_form, township)
+
+    # 代碼與郵遞區號沿用 TOWNSHIP_CODE_TO_NAME 的對應（重複代碼以最後一筆為準）
+    code_aliases = {}
+    for code, township in TOWNSHIP_CODE_TO_NAME.items():
+        code_aliases[_alias_key(code)] = township
+        code_aliases[_alias_key(code.split("-", 1)[-1])] = township
+
+    counties = {alias: next(iter(t)) for alias, t in county_aliases.items() if len(t) == 1}
+    townships = {alias: next(iter(t)) for alias, t in township_aliases.items() if len(t) == 1}
+    townships.update(code_aliases)
+    return counties, townships
+
+COUNTY_ALIASES, TOWNSHIP_ALIASES = _build_alias_index()
+_COUNTIES_BY_LENGTH = sorted(COUNTY_NAME_TO_CODE.keys(), key=len, reverse=True)
+
+def lookup_county(name: str) -> str:
+    """
+    Resolve any accepted county spelling or code to the canonical county name, or "".
+    Example: "台北" / "TPE" -> "臺北市".
+    """
+    if not isinstance(name, str):
+        return ""
+    # 已是標準寫法時不必正規化
+    return COUNTY_ALIASES.get(name) or COUNTY_ALIASES.get(_alias_key(name), "")
+
+def lookup_township(name: str) -> str:
+    """
+    Resolve any accepted township spelling, code or postal code to the canonical township name, or "".
+    Example: "台北中正" / "TPE-100" / "100" -> "臺北市中正區".
+    """
+    if not isinstance(name, str):
+        return ""
+    # 已是標準寫法時不必正規化
+    return TOWNSHIP_ALIASES.get(name) or TOWNSHIP_ALIASES.get(_alias_key(name), "")
 
 def resolve_county_from_township_name(township_name: str) -> str:
     """
-    Best-effort derive county name from a full township name by prefix match on known counties.
+    Best-effort derive county name from a full township name.
     Example: "臺北市中正區" -> "臺北市".
     """
+    township = lookup_township(township_name)
+    if township:
+        return TOWNSHIP_TO_COUNTY[township]
     if not isinstance(township_name, str):
         return ""
+    # 不在索引中的名稱：退回以縣市名稱做前綴比對（較長者優先）
     normalized = normalize_name(township_name)
-    # Prefer longer names first to avoid partial collisions
-    for county in sorted(COUNTY_NAME_TO_CODE.keys(), key=len, reverse=True):
+    for county in _COUNTIES_BY_LENGTH:
         if normalized.startswith(county):
             return county
     return ""
@@ -511,34 +588,4 @@ def resolve_township_name(township_name: str) -> str:
     Get the standardized township name.
     Example: "臺北中正" -> "臺北市中正區".
     """
-    if not isinstance(township_name, str):
-        return ""
-    
-    normalized = normalize_name(township_name)
-    
-    # 如果已經是標準格式，直接返回
-    if normalized in TOWNSHIP_NAME_TO_CODE:
-        return normalized
-    
-    # 嘗試匹配縣市
-    county = resolve_county_from_township_name(normalized)
-    if not county:
-        return ""
-    
-    # 移除縣市名稱，只保留地區名稱
-    district = normalized[len(county):].strip()
-    
-    # 嘗試不同的後綴（區、鎮、市、鄉）
-    suffixes = ["區", "鎮", "市", "鄉"]
-    for suffix in suffixes:
-        if district.endswith(suffix):
-            break
-        if not district.endswith(suffix):
-            full_name = f"{county}{district}{suffix}"
-            if full_name in TOWNSHIP_NAME_TO_CODE:
-                return full_name
-    
-    # 如果沒有找到匹配的格式，返回空字符串
-    return ""
-
-
+    return lookup_township(township_name)
@@ -4,6 +4,7 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import config
 import json
+from . import instrumentation
 
 CWA_API_URL = "https://opendata.cwa.gov.tw/api/v1/rest/datastore/"
 
@@ -45,11 +46,12 @@ def create_session():
     )
     session.mount('http://', HTTPAdapter(max_retries=retry))
     session.mount('https://', HTTPAdapter(max_retries=retry))
-    return session
+    return instrumentation.instrument_session(session)
 
-def get_cwa_township_forecast_data(city: str):
+def get_cwa_township_forecast_data(city: str, filters: dict = None):
     """
     Fetches township weather forecast data for a specific city.
+    `filters` adds CWA query parameters (e.g. LocationName / ElementName) to fetch only part of it.
     """
     session = create_session()
     dataset_id = CWA_TOWNSHIP_CODES.get(city)
@@ -65,6 +67,7 @@ def get_cwa_township_forecast_data(city: str):
     }
     params = {
         "Authorization": config.CWA_API_KEY,
+        **(filters or {}),
     }
 
     try:
@@ -76,6 +79,7 @@ def get_cwa_township_forecast_data(city: str):
             verify=certifi.where() if getattr(config, "REQUESTS_VERIFY_SSL", True) else False
         )
         response.raise_for_status()
+        instrumentation.record_upstream_bytes(url, len(response.content))
 
         try:
             data = response.json()
@@ -98,6 +102,8 @@ def get_cwa_township_forecast_data(city: str):
             return None
 
     except requests.exceptions.RequestException as e:
+        if e.response is None:
+            instrumentation.record_upstream_error(url, "GET")
         print(f"CRITICAL: Error fetching CWA township data for {city}. Error: {e}")
         return None
 
@@ -124,8 +130,11 @@ def get_cwa_county_forecast_data():
         print("Fetching CWA county forecast data...")
         response = session.get(url, params=params, verify=verify)
         response.raise_for_status()
+        instrumentation.record_upstream_bytes(url, len(response.content))
         print("Successfully fetched CWA county data.")
         return response.json()
     except requests.exceptions.RequestException as e:
+        if e.response is None:
+            instrumentation.record_upstream_error(url, "GET")
         print(f"Error fetching CWA county data: {e}")
         return None
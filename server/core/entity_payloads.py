@@ -0,0 +1,87 @@
+import threading
+from typing import Any, Dict, Optional
+
+from scheduler import jobs
+from . import calculation
+from . import codes
+from . import instrumentation
+
+# (snapshot key, {"townships": {code: payload}, "counties": {code: payload}})
+_CACHE: Dict[str, Any] = {"key": None, "payloads": None}
+_LOCK = threading.Lock()
+
+
+def build_township_payload(township_name: str, forecast: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    The response body of GET /api/weather/?township_code=: CWA forecast plus the township's image metrics.
+    """
+    if forecast is None:
+        township_map = jobs.get_cached_weather_data().get('township_weather')
+        forecast = calculation.get_forecast_for_township(township_name, township_map)
+    if not forecast:
+        return None
+
+    image_metrics = jobs.get_township_image_metrics(township_name) or {}
+    return {
+        **forecast,
+        "qpf12_max_mm_per_hr": image_metrics.get("qpf12_max_mm_per_hr"),
+        "qpf12_min_mm_per_hr": image_metrics.get("qpf12_min_mm_per_hr"),
+        "qpf6_max_mm_per_hr": image_metrics.get("qpf6_max_mm_per_hr"),
+        "qpf6_min_mm_per_hr": image_metrics.get("qpf6_min_mm_per_hr"),
+        "aqi_level": image_metrics.get("aqi_level"),
+        "ncdr_nowcast": image_metrics.get("nowcast"),
+        "ncdr_daily_rain": image_metrics.get("daily_rain"),
+    }
+
+
+def build_county_payload(county_name: str) -> Optional[Dict[str, Any]]:
+    """
+    The response body of GET /api/weather/summary: CWA county forecast plus aggregated image metrics.
+    """
+    cwa_county_data = jobs.get_cached_weather_data().get('county_weather') or {}
+    elements = cwa_county_data.get(county_name)
+    if not elements:
+        return None
+
+    image_metrics = jobs.CACHED_IMAGE_METRICS.get(county_name) or {}
+    return {
+        "county": county_name,
+        "temperature": elements.get("T"),
+        "weather_description": elements.get("Wx"),
+        "qpf12_max_mm_per_hr": image_metrics.get("qpf12_max_mm_per_hr"),
+        "qpf12_min_mm_per_hr": image_metrics.get("qpf12_min_mm_per_hr"),
+        "qpf6_max_mm_per_hr": image_metrics.get("qpf6_max_mm_per_hr"),
+        "qpf6_min_mm_per_hr": image_metrics.get("qpf6_min_mm_per_hr"),
+        "aqi_level": image_metrics.get("aqi_level"),
+        "ncdr_nowcast": image_metrics.get("nowcast"),
+        "ncdr_daily_rain": image_metrics.get("daily_rain"),
+    }
+
+
+def get_entity_payloads() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Township and county payloads for every known code, built once per snapshot.
+    Codes without data are absent from the result.
+    """
+    key = jobs.snapshot_key()
+    if _CACHE["key"] == key:
+        instrumentation.record_cache("entity_payloads", True)
+        return _CACHE["payloads"]
+    with _LOCK:
+        if _CACHE["key"] == key:
+            instrumentation.record_cache("entity_payloads", True)
+            return _CACHE["payloads"]
+        instrumentation.record_cache("entity_payloads", False)
+        townships = {}
+        for code, name in codes.TOWNSHIP_CODE_TO_NAME.items():
+            payload = build_township_payload(name)
+            if payload:
+                townships[code] = payload
+        counties = {}
+        for code, name in codes.COUNTY_CODE_TO_NAME.items():
+            payload = build_county_payload(name)
+            if payload:
+                counties[code] = payload
+        payloads = {"townships": townships, "counties": counties}
+        _CACHE.update({"key": key, "payloads": payloads})
+        return payloads
@@ -0,0 +1,134 @@
+import os
+import sqlite3
+from contextlib import closing
+from typing import Dict, List, Optional, Any
+
+import numpy as np
+
+from .township_metrics import TownshipMetrics, TOWNSHIP_NAMES, COUNTY_NAMES, NOWCAST_FRAMES, RANGE_FIELDS, AQI_LEVELS
+
+# 每列 blob 內的欄位順序（float32 向量）；新增欄位只能加在最後
+COLUMNS: List[str] = (
+    [f"{field}_{bound}" for field in RANGE_FIELDS for bound in ("min", "max")]
+    + [f"nowcast_min_f{i + 1:02d}" for i in range(NOWCAST_FRAMES)]
+    + [f"nowcast_max_f{i + 1:02d}" for i in range(NOWCAST_FRAMES)]
+    + ["aqi"]
+)
+COLUMN_INDEX: Dict[str, int] = {name: i for i, name in enumerate(COLUMNS)}
+
+# 每列以產生該次快照的時間（run_time，epoch 秒）為鍵；這是我們執行的時間，不是上游產品的發布時間
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_time REAL PRIMARY KEY,
+    version INTEGER
+);
+CREATE TABLE IF NOT EXISTS township_metrics (
+    township TEXT NOT NULL,
+    run_time REAL NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (township, run_time)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS county_metrics (
+    county TEXT NOT NULL,
+    run_time REAL NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (county, run_time)
+) WITHOUT ROWID;
+"""
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _to_matrix(arrays: Dict[str, np.ndarray]) -> np.ndarray:
+    """Flatten metric arrays (one row per entity) into an (N, len(COLUMNS)) float32 matrix."""
+    n = len(arrays["aqi"])
+    aqi = arrays["aqi"].astype(np.float32)
+    aqi[aqi < 0] = np.nan
+    parts = [arrays[f"{field}_{bound}"].reshape(n, 1) for field in RANGE_FIELDS for bound in ("min", "max")]
+    parts += [arrays["nowcast_min"], arrays["nowcast_max"], aqi.reshape(n, 1)]
+    return np.ascontiguousarray(np.hstack(parts), dtype=np.float32)
+
+
+def append_run(db_path: str, run_time: float, version: int, metrics: TownshipMetrics) -> bool:
+    """
+    Append one run's township and county metrics. Existing (entity, run_time) rows are never rewritten.
+    """
+    township_rows = _to_matrix(metrics.arrays)
+    county_rows = _to_matrix(metrics.county_arrays())
+    try:
+        with closing(_connect(db_path)) as conn, conn:
+            conn.execute("INSERT OR IGNORE INTO runs (run_time, version) VALUES (?, ?)", (run_time, version))
+            conn.executemany(
+                "INSERT OR IGNORE INTO township_metrics (township, run_time, data) VALUES (?, ?, ?)",
+                [(name, run_time, township_rows[i].tobytes()) for i, name in enumerate(TOWNSHIP_NAMES)],
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO county_metrics (county, run_time, data) VALUES (?, ?, ?)",
+                [(name, run_time, county_rows[i].tobytes()) for i, name in enumerate(COUNTY_NAMES)],
+            )
+        return True
+    except sqlite3.Error as e:
+        print(f"[HISTORY] Failed to append run {run_time}: {e}")
+        return False
+
+
+def _downsample(times: np.ndarray, values: np.ndarray, step_seconds: float):
+    """
+    Bucket rows into fixed `step_seconds` windows: *_min columns take the minimum,
+    everything else (maxima, AQI) the maximum. Returns (bucket_start_times, values).
+    """
+    buckets = np.floor(times / step_seconds).astype(np.int64)
+    unique, inverse = np.unique(buckets, return_inverse=True)
+    is_min = np.array(["_min" in name for name in COLUMNS])
+
+    out = np.full((len(unique), values.shape[1]), np.nan, dtype=np.float32)
+    out_min = out.copy()
+    np.fmax.at(out, inverse, values)
+    np.fmin.at(out_min, inverse, values)
+    out[:, is_min] = out_min[:, is_min]
+    return unique.astype(np.float64) * step_seconds, out
+
+
+def query_range(
+    db_path: str,
+    entity: str,
+    start: float,
+    end: float,
+    level: str = "township",
+    step_seconds: Optional[float] = None,
+    columns: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Return a columnar time series for one township or county between `start` and `end` (epoch seconds).
+    """
+    table, key = ("county_metrics", "county") if level == "county" else ("township_metrics", "township")
+    with closing(_connect(db_path)) as conn:
+        rows = conn.execute(
+            f"SELECT run_time, data FROM {table} WHERE {key} = ? AND run_time BETWEEN ? AND ? ORDER BY run_time",
+            (entity, start, end),
+        ).fetchall()
+
+    width = len(COLUMNS)
+    times = np.array([r[0] for r in rows], dtype=np.float64)
+    values = np.frombuffer(b"".join(r[1] for r in rows), dtype=np.float32).reshape(len(rows), width) if rows else np.empty((0, width), dtype=np.float32)
+    if step_seconds and len(rows):
+        times, values = _downsample(times, values, step_seconds)
+
+    selected = [c for c in (columns or COLUMNS) if c in COLUMN_INDEX]
+    series = {}
+    for name in selected:
+        col = values[:, COLUMN_INDEX[name]]
+        missing = np.isnan(col)
+        if name == "aqi":
+            series[name] = [None if m else AQI_LEVELS[int(v)] for v, m in zip(col.tolist(), missing.tolist())]
+        else:
+            out = col.astype(np.float64).astype(object)
+            out[missing] = None
+            series[name] = out.tolist()
+    return {"run_times": times.tolist(), "series": series}
@@ -5,6 +5,12 @@ import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from PIL import Image, ImageFilter, ImageOps
+import numpy as np
+import threading
+import time
+from collections import OrderedDict
+
+from . import instrumentation
 
 try:
     import pytesseract
@@ -18,11 +24,58 @@ def _download_image(image_url: str) -> Image.Image:
     retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
     session.mount("http://", HTTPAdapter(max_retries=retries))
     session.mount("https://", HTTPAdapter(max_retries=retries))
-    response = session.get(image_url, timeout=20, verify=getattr(config, "REQUESTS_VERIFY_SSL", True))
+    instrumentation.instrument_session(session)
+    try:
+        response = session.get(image_url, timeout=20, verify=getattr(config, "REQUESTS_VERIFY_SSL", True))
+    except requests.exceptions.RequestException:
+        instrumentation.record_upstream_error(image_url, "GET")
+        raise
     response.raise_for_status()
+    instrumentation.record_upstream_bytes(image_url, len(response.content))
     return Image.open(io.BytesIO(response.content)).convert("RGB")
 
 
+# 已解碼影像快取：同一期圖片在一次執行中被每個鄉鎮、分類 raster 與除錯疊圖重複使用。
+# 回傳的 Image 是共用物件，呼叫端只能讀取（crop/convert/copy 會產生新物件，可安全使用）
+_IMAGE_CACHE: "OrderedDict[str, Tuple[float, Image.Image]]" = OrderedDict()
+_IMAGE_CACHE_LOCK = threading.Lock()
+_IMAGE_URL_LOCKS: Dict[str, threading.Lock] = {}
+
+
+def load_image(image_url: str) -> Image.Image:
+    """
+    Decoded RGB image for a URL, downloaded at most once per IMAGE_CACHE_TTL_SECONDS.
+    Concurrent callers for the same URL wait for a single download.
+    """
+    from server import config
+    ttl = getattr(config, "IMAGE_CACHE_TTL_SECONDS", 600)
+    with _IMAGE_CACHE_LOCK:
+        url_lock = _IMAGE_URL_LOCKS.setdefault(image_url, threading.Lock())
+    with url_lock:
+        with _IMAGE_CACHE_LOCK:
+            entry = _IMAGE_CACHE.get(image_url)
+            if entry is not None and time.monotonic() - entry[0] < ttl:
+                _IMAGE_CACHE.move_to_end(image_url)
+                instrumentation.record_cache("image", True)
+                return entry[1]
+        instrumentation.record_cache("image", False)
+        image = _download_image(image_url)
+        image.load()
+        with _IMAGE_CACHE_LOCK:
+            _IMAGE_CACHE[image_url] = (time.monotonic(), image)
+            _IMAGE_CACHE.move_to_end(image_url)
+            while len(_IMAGE_CACHE) > getattr(config, "IMAGE_CACHE_MAX_ENTRIES", 32):
+                evicted, _ = _IMAGE_CACHE.popitem(last=False)
+                _IMAGE_URL_LOCKS.pop(evicted, None)
+        return image
+
+
+def clear_image_cache() -> None:
+    with _IMAGE_CACHE_LOCK:
+        _IMAGE_CACHE.clear()
+        _IMAGE_URL_LOCKS.clear()
+
+
 def _ensure_tesseract_is_available() -> None:
     if pytesseract is None:
         raise RuntimeError(
@@ -51,7 +104,7 @@ def extract_rain_probability_from_image(image_url: str, crop_box: Optional[Tuple
     """
     _ensure_tesseract_is_available()
 
-    image = _download_image(image_url)
+    image = load_image(image_url)
     if crop_box:
         image = image.crop(crop_box)
 
@@ -93,7 +146,17 @@ def analyze_aqi_from_image(image_url: str, sample_box: Optional[Tuple[int, int,
     Returns:
         One of: "Good", "Moderate", "Unhealthy for Sensitive", "Unhealthy", "Very Unhealthy", "Hazardous"; or None if unknown.
     """
-    image = _download_image(image_url)
+    return _aqi_level(load_image(image_url), sample_box)
+
+
+def analyze_aqi_many(image_url: str, centers: Dict[str, Tuple[int, int]], box_size: int = 10) -> Dict[str, Optional[str]]:
+    """AQI level for every {name: (x, y)} center, each from a box_size square around it."""
+    image = load_image(image_url)
+    half = box_size // 2
+    return {name: _aqi_level(image, (x - half, y - half, x + half, y + half)) for name, (x, y) in centers.items()}
+
+
+def _aqi_level(image: Image.Image, sample_box: Optional[Tuple[int, int, int, int]]) -> Optional[str]:
     if sample_box:
         image = image.crop(sample_box)
 
@@ -156,6 +219,8 @@ def _sample_circle_min_max(image: Image.Image, center_xy: Tuple[int, int], radiu
     Sample pixels in a filled circle around center_xy with given radius.
     Return min/max mapped values (excluding 0 unless only zeros present).
     """
+    started = time.perf_counter()
+    visited = 0
     cx, cy = center_xy
     r2 = radius * radius
     qpf_values: List[float] = []
@@ -169,23 +234,79 @@ def _sample_circle_min_max(image: Image.Image, center_xy: Tuple[int, int], radiu
             dx = x - cx
             if dx * dx + dy2 > r2:
                 continue
+            visited += 1
             rgb = image.getpixel((x, y))[:3]
             nearest = _closest_color(rgb, palette)
             v = value_map.get(nearest)
             if v is not None and v > 0:
                 qpf_values.append(v)
+    instrumentation.record_analysis("sample", visited, time.perf_counter() - started)
     if not qpf_values:
         return {"min": 0.0, "max": 0.0}
     return {"min": min(qpf_values), "max": max(qpf_values)}
 
 
+def sample_circles_min_max(image: Image.Image, centers: Dict[str, Tuple[int, int]], radius: int, palette: List[Tuple[int, int, int]], value_map: Dict[Tuple[int, int, int], float]) -> Dict[str, Dict[str, float]]:
+    """
+    _sample_circle_min_max for many centers at once: {name: (x, y)} -> {name: {min, max}}.
+    Same pixels, nearest-color rule and zero handling, but each circle is classified with numpy.
+    """
+    started = time.perf_counter()
+    visited = 0
+    rgb = np.asarray(image.convert("RGB") if image.mode != "RGB" else image)
+    height, width = rgb.shape[:2]
+    colors = np.asarray(palette, dtype=np.int32)
+    values = np.array([np.nan if value_map.get(c) is None else value_map[c] for c in palette], dtype=np.float64)
+    offsets = np.arange(-radius, radius + 1)
+    disk = offsets[:, None] ** 2 + offsets[None, :] ** 2 <= radius * radius
+
+    results: Dict[str, Dict[str, float]] = {}
+    for name, (cx, cy) in centers.items():
+        x0, x1 = max(0, cx - radius), min(width, cx + radius + 1)
+        y0, y1 = max(0, cy - radius), min(height, cy + radius + 1)
+        if x0 >= x1 or y0 >= y1:
+            results[name] = {"min": 0.0, "max": 0.0}
+            continue
+        mask = disk[y0 - (cy - radius):y1 - (cy - radius), x0 - (cx - radius):x1 - (cx - radius)]
+        pixels = rgb[y0:y1, x0:x1][mask].astype(np.int32)
+        visited += len(pixels)
+        nearest = ((pixels[:, None, :] - colors[None, :, :]) ** 2).sum(axis=-1).argmin(axis=1)
+        v = values[nearest]
+        v = v[v > 0]
+        results[name] = {"min": float(v.min()), "max": float(v.max())} if v.size else {"min": 0.0, "max": 0.0}
+    instrumentation.record_analysis("sample", visited, time.perf_counter() - started)
+    return results
+
+
+def classify_image(image: Image.Image, palette: List[Tuple[int, int, int]], chunk_rows: int = 64) -> np.ndarray:
+    """
+    Map every pixel to the index of its nearest palette color (same rule as _closest_color).
+    Returns a (height, width) uint8 array; processed in row chunks to bound memory.
+    """
+    started = time.perf_counter()
+    rgb = np.asarray(image.convert("RGB"), dtype=np.int32)
+    colors = np.asarray(palette, dtype=np.int32)
+    out = np.empty(rgb.shape[:2], dtype=np.uint8)
+    for start in range(0, rgb.shape[0], chunk_rows):
+        block = rgb[start:start + chunk_rows, :, None, :]
+        dist = ((block - colors[None, None, :, :]) ** 2).sum(axis=-1)
+        out[start:start + chunk_rows] = dist.argmin(axis=-1)
+    instrumentation.record_analysis("classify", out.size, time.perf_counter() - started)
+    return out
+
+
+def classify_image_url(image_url: str, color_map: Dict[Tuple[int, int, int], float]) -> np.ndarray:
+    """Download an image and classify it against the palette of `color_map` (keys in dict order)."""
+    return classify_image(load_image(image_url), list(color_map.keys()))
+
+
 def save_overlay(image_url: str, centers: List[Tuple[int, int]], radius: int, out_path: str) -> None:
     """
     下載圖片並在指定座標畫上取樣圓，存檔以便檢視。
     """
     try:
         from PIL import ImageDraw
-        base = _download_image(image_url).convert("RGBA")
+        base = load_image(image_url).convert("RGBA")
         overlay = Image.new("RGBA", base.size, (0, 0, 0, 0))
         draw = ImageDraw.Draw(overlay)
         # 畫法：半透明紅色實心 + 黑色外框 + 十字準星
@@ -350,17 +471,21 @@ def analyze_qpf_from_image(image_url: str, sample_xy: Tuple[int, int]) -> Option
     Estimate rainfall intensity (mm/hr) by analyzing a square region and returning the min and max QPF values.
     """
     from server import config
-    image = _download_image(image_url)
+    image = load_image(image_url)
     palette = list(config.QPF_COLOR_MAP.keys())
     return _sample_circle_min_max(image, sample_xy, radius=12, palette=palette, value_map=config.QPF_COLOR_MAP)
 
+def analyze_rain_many(image_url: str, centers: Dict[str, Tuple[int, int]], color_map: Dict[Tuple[int, int, int], float]) -> Dict[str, Dict[str, float]]:
+    """Rain {min, max} for every {name: (x, y)} center on one image (QPF or NCDR color map)."""
+    return sample_circles_min_max(load_image(image_url), centers, radius=12, palette=list(color_map.keys()), value_map=color_map)
+
 def analyze_ncdr_rain_from_image(image_url: str, sample_xy: Tuple[int, int]) -> Optional[Dict[str, float]]:
     """
     Estimate rainfall intensity (mm/hr) from NCDR images by analyzing a square region 
     and returning the min and max QPF values.
     """
     from server import config
-    image = _download_image(image_url)
+    image = load_image(image_url)
     palette = list(config.NCDR_NOWCAST_COLOR_MAP.keys())
     return _sample_circle_min_max(image, sample_xy, radius=12, palette=palette, value_map=config.NCDR_NOWCAST_COLOR_MAP)
 
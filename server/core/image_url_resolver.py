@@ -5,6 +5,8 @@ import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+from . import instrumentation
+
 
 def _is_image_url(url: str, timeout_seconds: int = 10) -> bool:
     from server import config
@@ -13,6 +15,7 @@ def _is_image_url(url: str, timeout_seconds: int = 10) -> bool:
         retries = Retry(total=2, backoff_factor=0.4, status_forcelist=[429, 500, 502, 503, 504])
         session.mount("http://", HTTPAdapter(max_retries=retries))
         session.mount("https://", HTTPAdapter(max_retries=retries))
+        instrumentation.instrument_session(session)
         resp = session.head(
             url,
             timeout=timeout_seconds,
@@ -20,6 +23,7 @@ def _is_image_url(url: str, timeout_seconds: int = 10) -> bool:
             verify=getattr(config, "REQUESTS_VERIFY_SSL", True),
         )
         if resp.status_code == 200 and 'image' in (resp.headers.get('Content-Type') or '').lower():
+            instrumentation.RESOLVER_PROBES.inc(host=instrumentation.host_of(url), result="hit")
             return True
         # Some servers do not support HEAD properly; try GET with small timeout
         resp = session.get(
@@ -29,8 +33,11 @@ def _is_image_url(url: str, timeout_seconds: int = 10) -> bool:
             verify=getattr(config, "REQUESTS_VERIFY_SSL", True),
         )
         content_type = (resp.headers.get('Content-Type') or '').lower()
-        return resp.status_code == 200 and 'image' in content_type
+        found = resp.status_code == 200 and 'image' in content_type
+        instrumentation.RESOLVER_PROBES.inc(host=instrumentation.host_of(url), result="hit" if found else "miss")
+        return found
     except Exception:
+        instrumentation.RESOLVER_PROBES.inc(host=instrumentation.host_of(url), result="error")
         return False
 
 
@@ -0,0 +1,234 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+# 輕量的 Prometheus 相容指標；每個 worker 行程各自計數。
+# 記錄只是在鎖內做一次 dict 加法，比起每次上游請求或影像分析的成本可以忽略。
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), function: Optional[Callable[[], Optional[float]]] = None):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        # 無標籤的 gauge 可以在輸出時才計算（例如快照年齡）
+        self._function = function
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels) -> Optional[float]:
+        return self._values.get(self._key(labels))
+
+    def samples(self) -> Iterable[str]:
+        if self._function is not None:
+            value = self._function()
+            if value is not None:
+                yield f"{self.name} {_format_value(value)}"
+            return
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(bound)))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "weather_pipeline_stage_duration_seconds", "Duration of fetch pipeline stages and refresh jobs.", ["stage", "status"]))
+PIPELINE_RUNS = REGISTRY.register(Counter(
+    "weather_pipeline_runs_total", "Pipeline and refresh job runs by outcome.", ["job", "result"]))
+UPSTREAM_REQUESTS = REGISTRY.register(Counter(
+    "weather_upstream_requests_total", "HTTP requests to upstream data sources.", ["host", "method", "status"]))
+UPSTREAM_BYTES = REGISTRY.register(Counter(
+    "weather_upstream_bytes_total", "Response body bytes downloaded from upstream data sources.", ["host"]))
+UPSTREAM_DURATION = REGISTRY.register(Histogram(
+    "weather_upstream_request_duration_seconds", "Latency of upstream HTTP requests.", ["host"]))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "weather_cache_requests_total", "Lookups in per-snapshot response caches.", ["cache", "result"]))
+RESOLVER_PROBES = REGISTRY.register(Counter(
+    "weather_resolver_probes_total", "Image URL existence probes issued by the URL resolver.", ["host", "result"]))
+ANALYSIS_PIXELS = REGISTRY.register(Counter(
+    "weather_analysis_pixels_total", "Pixels processed by image analysis.", ["op"]))
+ANALYSIS_SECONDS = REGISTRY.register(Counter(
+    "weather_analysis_seconds_total", "Time spent in image analysis.", ["op"]))
+ANALYSIS_RATE = REGISTRY.register(Gauge(
+    "weather_analysis_pixels_per_second", "Throughput of the most recent image analysis call.", ["op"]))
+PUBLISH_BYTES = REGISTRY.register(Counter(
+    "weather_publish_bytes_total", "Bytes uploaded to Storage by the snapshot publisher.", ["kind"]))
+PUBLISH_BYTES_SAVED = REGISTRY.register(Counter(
+    "weather_publish_bytes_saved_total", "Bytes not uploaded because a patch was published instead of a full document."))
+NOTIFICATIONS = REGISTRY.register(Counter(
+    "weather_notifications_total", "FCM messages by outcome (sent, failed, invalid_token, retried).", ["result"]))
+NOTIFICATION_BATCH_DURATION = REGISTRY.register(Histogram(
+    "weather_notification_batch_duration_seconds", "Latency of one FCM send_each batch call."))
+SNAPSHOT_BYTES = REGISTRY.register(Gauge(
+    "weather_snapshot_bytes", "Size of the last snapshot file written or read."))
+SNAPSHOT_VERSION = REGISTRY.register(Gauge(
+    "weather_snapshot_version", "Version of the snapshot currently served."))
+
+
+def register_snapshot_age(created_at: Callable[[], Optional[float]]) -> None:
+    """Expose the age of the served snapshot; computed at scrape time from `created_at()` (epoch)."""
+    def age():
+        ts = created_at()
+        return None if ts is None else max(0.0, time.time() - ts)
+    REGISTRY.register(Gauge("weather_snapshot_age_seconds", "Seconds since the served snapshot was created.", function=age))
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).hostname or "unknown"
+
+
+def _record_response(response, *args, **kwargs):
+    host = host_of(response.url)
+    UPSTREAM_REQUESTS.inc(host=host, method=response.request.method, status=response.status_code)
+    UPSTREAM_DURATION.observe(response.elapsed.total_seconds(), host=host)
+
+
+def instrument_session(session):
+    """Count every response of a requests.Session (host, method, status, latency) via a response hook."""
+    session.hooks.setdefault("response", []).append(_record_response)
+    return session
+
+
+def record_upstream_error(url: str, method: str) -> None:
+    UPSTREAM_REQUESTS.inc(host=host_of(url), method=method, status="error")
+
+
+def record_upstream_bytes(url: str, nbytes: int) -> None:
+    """Body bytes actually downloaded (recorded where the body is read, so HEAD/streamed probes count 0)."""
+    UPSTREAM_BYTES.inc(nbytes, host=host_of(url))
+
+
+def record_analysis(op: str, pixels: int, seconds: float) -> None:
+    ANALYSIS_PIXELS.inc(pixels, op=op)
+    ANALYSIS_SECONDS.inc(seconds, op=op)
+    if seconds > 0:
+        ANALYSIS_RATE.set(pixels / seconds, op=op)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
@@ -1,8 +1,14 @@
 import datetime
+import threading
 from scheduler import jobs
 from . import codes
+from . import instrumentation
 import json
 
+# (snapshot key, {township_code: record}) — 每個快照只組裝一次
+_RECORDS_CACHE = {"key": None, "records": None}
+_RECORDS_LOCK = threading.Lock()
+
 def generate_unified_json():
     """
     Generates a single, unified JSON object containing all forecast data for every township in Taiwan.
@@ -14,7 +20,7 @@ def generate_unified_json():
     update_time = datetime.datetime.now().isoformat()
     cwa_county_data = jobs.get_cached_weather_data().get('county_weather')
     cwa_township_data = jobs.get_cached_weather_data().get('township_weather')
-    image_metrics = jobs.CACHED_IMAGE_METRICS
+    township_metrics = jobs.CACHED_TOWNSHIP_METRICS
 
     if not cwa_county_data or not cwa_township_data:
         print("Error: CWA data caches are not available. Cannot generate unified JSON.")
@@ -26,70 +32,107 @@ def generate_unified_json():
     }
 
     # 2. Iterate through every known township
-    for township_full_name, township_code in codes.TOWNSHIP_NAME_TO_CODE.items():
-        
-        # 3. For each township, find its data from all sources
-        county_name = codes.resolve_county_from_township_name(township_full_name)
-        
-        # Normalize names for cache lookups
-        normalized_town_name = codes.normalize_name(township_full_name)
-        normalized_county_name = codes.normalize_name(county_name)
-
-        # Get data from CWA caches
-        town_cwa = cwa_township_data.get(normalized_town_name)
-        county_cwa = cwa_county_data.get(normalized_county_name)
-
-        # Get data from image analysis cache
-        county_image_metrics = image_metrics.get(county_name) or {}
-
-        # --- Start assembling the data for one township ---
-        
-        # From county-level CWA data
-        temperature = county_cwa.get('temperature') if county_cwa else None
-        
-        # From township-level CWA data
-        pop6h = None
-        pop12h = None
-        weather_description = None
-        if town_cwa and town_cwa.get('weatherElement'):
-            for element in town_cwa['weatherElement']:
-                element_name = element.get('elementName')
-                time_data = element.get('time', [{}])[0]
-                
-                if element_name == '天氣現象':
-                    weather_description = time_data.get('elementValue', [{}])[0].get('value')
-                # The CWA township data provides PoP in 3-hour intervals.
-                elif element_name == '3小時降雨機率':
-                    pop_value = time_data.get('elementValue', [{}])[0].get('value')
-                    # Use the first 3-hour value for both 6h and 12h for now.
-                    if pop6h is None: # Only assign once
-                        pop6h = pop_value
-                    if pop12h is None: # Only assign once
-                        pop12h = pop_value
-
-        # Assemble all data into a single object
-        township_data_object = {
-            "township_name": township_full_name,
-            "county_name": county_name,
-            "temperature": temperature,
-            "weather_description": weather_description,
-            "pop6h": pop6h,
-            "pop12h": pop12h,
-            "aqi_level": county_image_metrics.get("aqi_level"),
-            "cwa_qpf_6h_min": county_image_metrics.get("qpf6_min_mm_per_hr"),
-            "cwa_qpf_6h_max": county_image_metrics.get("qpf6_max_mm_per_hr"),
-            "cwa_qpf_12h_min": county_image_metrics.get("qpf12_min_mm_per_hr"),
-            "cwa_qpf_12h_max": county_image_metrics.get("qpf12_max_mm_per_hr"),
-            "ncdr_daily_rain_min": (county_image_metrics.get("ncdr_daily_rain") or {}).get("min"),
-            "ncdr_daily_rain_max": (county_image_metrics.get("ncdr_daily_rain") or {}).get("max"),
-            "ncdr_nowcast": county_image_metrics.get("ncdr_nowcast"),
-        }
-        
+    for township_code, township_data_object in iter_township_records(cwa_county_data, cwa_township_data, township_metrics):
         final_data["towns"][township_code] = township_data_object
 
     print(f"Successfully generated unified JSON for {len(final_data['towns'])} townships.")
     return final_data
 
+def get_unified_records():
+    """
+    {township_code: unified-JSON record} for the current snapshot, built once per snapshot and shared
+    by every projected variant. Empty while the CWA caches are unavailable.
+    """
+    key = jobs.snapshot_key()
+    if _RECORDS_CACHE["key"] == key:
+        instrumentation.record_cache("unified_records", True)
+        return _RECORDS_CACHE["records"]
+    with _RECORDS_LOCK:
+        if _RECORDS_CACHE["key"] == key:
+            instrumentation.record_cache("unified_records", True)
+            return _RECORDS_CACHE["records"]
+        instrumentation.record_cache("unified_records", False)
+        cached = jobs.get_cached_weather_data()
+        cwa_county_data = cached.get('county_weather')
+        cwa_township_data = cached.get('township_weather')
+        records = {}
+        if cwa_county_data and cwa_township_data:
+            records = dict(iter_township_records(cwa_county_data, cwa_township_data, jobs.CACHED_TOWNSHIP_METRICS))
+        _RECORDS_CACHE.update({"key": key, "records": records})
+        return records
+
+def iter_township_records(cwa_county_data, cwa_township_data, township_metrics, county_names=None):
+    """
+    Lazily yields (township_code, record) for every known township, optionally limited to `county_names`.
+    Callers pass in the cache objects so one iteration sees a single consistent snapshot.
+    """
+    for township_full_name, township_code in codes.TOWNSHIP_NAME_TO_CODE.items():
+        # For each township, find its data from all sources
+        county_name = codes.resolve_county_from_township_name(township_full_name)
+        if county_names is not None and county_name not in county_names:
+            continue
+        yield township_code, build_township_record(
+            township_full_name, county_name, cwa_county_data, cwa_township_data, township_metrics
+        )
+
+def build_township_record(township_full_name, county_name, cwa_county_data, cwa_township_data, township_metrics):
+    """
+    Assembles the unified-JSON object for one township from the CWA caches and its image metrics.
+    """
+    # Normalize names for cache lookups
+    normalized_town_name = codes.normalize_name(township_full_name)
+    normalized_county_name = codes.normalize_name(county_name)
+
+    # Get data from CWA caches
+    town_cwa = cwa_township_data.get(normalized_town_name)
+    county_cwa = cwa_county_data.get(normalized_county_name)
+
+    # Get this township's own image-analysis values
+    town_image_metrics = township_metrics.township_record(township_full_name) or {}
+
+    # --- Start assembling the data for one township ---
+
+    # From county-level CWA data
+    temperature = county_cwa.get('temperature') if county_cwa else None
+
+    # From township-level CWA data
+    pop6h = None
+    pop12h = None
+    weather_description = None
+    if town_cwa and town_cwa.get('weatherElement'):
+        for element in town_cwa['weatherElement']:
+            element_name = element.get('elementName')
+            time_data = element.get('time', [{}])[0]
+
+            if element_name == '天氣現象':
+                weather_description = time_data.get('elementValue', [{}])[0].get('value')
+            # The CWA township data provides PoP in 3-hour intervals.
+            elif element_name == '3小時降雨機率':
+                pop_value = time_data.get('elementValue', [{}])[0].get('value')
+                # Use the first 3-hour value for both 6h and 12h for now.
+                if pop6h is None: # Only assign once
+                    pop6h = pop_value
+                if pop12h is None: # Only assign once
+                    pop12h = pop_value
+
+    # Assemble all data into a single object
+    return {
+        "township_name": township_full_name,
+        "county_name": county_name,
+        "temperature": temperature,
+        "weather_description": weather_description,
+        "pop6h": pop6h,
+        "pop12h": pop12h,
+        "aqi_level": town_image_metrics.get("aqi_level"),
+        "cwa_qpf_6h_min": town_image_metrics.get("qpf6_min_mm_per_hr"),
+        "cwa_qpf_6h_max": town_image_metrics.get("qpf6_max_mm_per_hr"),
+        "cwa_qpf_12h_min": town_image_metrics.get("qpf12_min_mm_per_hr"),
+        "cwa_qpf_12h_max": town_image_metrics.get("qpf12_max_mm_per_hr"),
+        "ncdr_daily_rain_min": (town_image_metrics.get("daily_rain") or {}).get("min"),
+        "ncdr_daily_rain_max": (town_image_metrics.get("daily_rain") or {}).get("max"),
+        "ncdr_nowcast": town_image_metrics.get("nowcast"),
+    }
+
 # This function is kept for compatibility with older parts of the code if needed,
 # but generate_unified_json is the new primary function.
 def generate_json_output():
@@ -0,0 +1,119 @@
+import os
+import random
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageDraw
+
+
+def draw_overlay(image: Image.Image, centers: Iterable[Tuple[int, int]], radius: int) -> Image.Image:
+    """Copy of `image` with a solid red sampling circle at every center (off-image centers are skipped)."""
+    out = image.convert("RGB")  # 同模式時也會回傳複本，不會改到快取中的影像
+    draw = ImageDraw.Draw(out)
+    for cx, cy in centers:
+        if cx is None or cy is None or not (0 <= cx < out.width and 0 <= cy < out.height):
+            continue
+        draw.ellipse((cx - radius, cy - radius, cx + radius, cy + radius), fill=(255, 0, 0))
+    return out
+
+
+class OverlayRenderer:
+    """
+    Debug overlays of sampling circles.
+
+    `render` takes an already decoded image and all township centers of one frame; the circles
+    are drawn once onto a single copy, from which the full-frame file and (optionally) small
+    per-township crops are cut. Drawing, PNG encoding and disk writes run on a small background
+    pool so sampling never waits on them. At most `max_per_run` files are written per run: one
+    full frame each, and crops for a random sample of townships (the same ones on every frame,
+    so they can be compared) sized to fit the remaining budget.
+
+    A disabled renderer does nothing: `render` returns before touching the image and the pool
+    is never created.
+    """
+
+    def __init__(self, out_dir: str, enabled: bool = True, per_township: bool = False, radius: int = 12,
+                 crop_radius: int = 60, max_per_run: Optional[int] = None, workers: int = 2):
+        self.out_dir = out_dir
+        self.enabled = enabled
+        self.per_township = per_township
+        self.radius = radius
+        self.crop_radius = crop_radius
+        self.max_per_run = max_per_run
+        self.workers = workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._budget: Optional[int] = max_per_run
+        self._sampled: Optional[set] = None
+        self._pending: List[Future] = []
+
+    @classmethod
+    def from_config(cls, config) -> "OverlayRenderer":
+        return cls(
+            out_dir=config.DEBUG_SAVE_DIR,
+            enabled=getattr(config, "DEBUG_SAVE_SAMPLES", False),
+            per_township=getattr(config, "DEBUG_SAVE_PER_TOWNSHIP", False),
+            crop_radius=getattr(config, "DEBUG_SAVE_CROP_RADIUS", 60),
+            max_per_run=getattr(config, "DEBUG_SAVE_MAX_PER_RUN", None),
+            workers=getattr(config, "DEBUG_SAVE_WRITERS", 2),
+        )
+
+    def begin_run(self, townships: Iterable[str] = (), frames: int = 1) -> None:
+        """Reset the per-run file budget and choose which townships get crops on each of `frames` frames."""
+        if not self.enabled:
+            return
+        townships = list(townships)
+        with self._lock:
+            self._budget = self.max_per_run
+            if self.max_per_run is None:
+                self._sampled = None
+            else:
+                per_frame = max(0, self.max_per_run - frames) // max(1, frames)
+                self._sampled = set(random.sample(townships, min(per_frame, len(townships))))
+
+    def _take(self, n: int) -> int:
+        with self._lock:
+            if self._budget is None:
+                return n
+            n = min(n, self._budget)
+            self._budget -= n
+            return n
+
+    def render(self, image: Image.Image, centers: Dict[str, Tuple[int, int]], label: str) -> None:
+        """
+        Queue the overlay of one frame: `{label}.png` with every center drawn, plus
+        `{township}_{label}.png` crops when per-township output is on.
+        """
+        if not self.enabled or not centers:
+            return
+        if not self._take(1):
+            return
+        crops = []
+        if self.per_township:
+            picked = [name for name in centers if self._sampled is None or name in self._sampled]
+            crops = picked[:self._take(len(picked))]
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="overlay")
+        future = self._pool.submit(self._write, image, dict(centers), label, crops)
+        with self._lock:
+            self._pending = [f for f in self._pending if not f.done()] + [future]
+
+    def _write(self, image: Image.Image, centers: Dict[str, Tuple[int, int]], label: str, crops: List[str]) -> None:
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            frame = draw_overlay(image, centers.values(), self.radius)
+            frame.save(os.path.join(self.out_dir, f"{label}.png"))
+            r = self.crop_radius
+            for name in crops:
+                cx, cy = centers[name]
+                frame.crop((cx - r, cy - r, cx + r, cy + r)).save(os.path.join(self.out_dir, f"{name}_{label}.png"))
+        except Exception as e:
+            print(f"[OVERLAY] Failed to write {label}: {e}")
+
+    def flush(self) -> None:
+        """Wait for queued overlays to be written."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
@@ -0,0 +1,108 @@
+import gzip
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # Optional; without it only gzip/identity are offered
+    brotli = None  # type: ignore
+
+import config
+from . import instrumentation
+
+# name -> (snapshot key, encoded payload)
+_CACHE: Dict[str, Tuple[Hashable, Dict[str, Any]]] = {}
+# 只在查表、寫入時短暫持有；建構與壓縮改用各 name 自己的鎖，大型回應不會擋住其他端點
+_LOCK = threading.Lock()
+# name -> 建構鎖；同一 name 同時只建構一次
+_BUILD_LOCKS: Dict[str, threading.Lock] = {}
+
+
+def encode_json(data: Any) -> bytes:
+    """Compact UTF-8 JSON, the same bytes FastAPI's JSONResponse would produce."""
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def _encode(body: bytes, media_type: str, compress: bool = True) -> Dict[str, Any]:
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    variants = {"identity": body}
+    if compress:
+        variants["gzip"] = gzip.compress(body, compresslevel=getattr(config, "PAYLOAD_GZIP_LEVEL", 9))
+    if compress and brotli is not None:
+        variants["br"] = brotli.compress(body, quality=getattr(config, "PAYLOAD_BROTLI_QUALITY", 9))
+    return {
+        "media_type": media_type,
+        "digest": digest,
+        "variants": variants,
+        # Strong ETag per representation: the compressed bytes differ, so do the tags
+        "etags": {enc: f'"{digest}"' if enc == "identity" else f'"{digest}-{enc}"' for enc in variants},
+    }
+
+
+def get_encoded(name: str, key: Hashable, build: Callable[[], bytes], media_type: str = "application/json",
+                compress: bool = True) -> Dict[str, Any]:
+    """
+    Return the encoded payload `name` for snapshot `key`, building and compressing it only
+    when the key changed since the last call. Payloads built for an older key are evicted.
+    `compress=False` skips gzip/br for bodies that are already compressed (e.g. PNG).
+    Concurrent misses for the same name build once; misses for different names build in parallel.
+    """
+    cache = name.split(":", 1)[0]
+    cached = _CACHE.get(name)
+    if cached and cached[0] == key:
+        instrumentation.record_cache(cache, True)
+        return cached[1]
+    with _LOCK:
+        build_lock = _BUILD_LOCKS.setdefault(name, threading.Lock())
+    with build_lock:
+        cached = _CACHE.get(name)
+        if cached and cached[0] == key:
+            instrumentation.record_cache(cache, True)
+            return cached[1]
+        instrumentation.record_cache(cache, False)
+        payload = _encode(build(), media_type, compress)
+        with _LOCK:
+            # 舊快照的內容不會再被使用；另外限制項目數，避免各種投影組合無限累積
+            for stale in [n for n, (k, _) in _CACHE.items() if k != key]:
+                del _CACHE[stale]
+            _CACHE.pop(name, None)
+            _CACHE[name] = (key, payload)
+            while len(_CACHE) > getattr(config, "PAYLOAD_CACHE_MAX_ENTRIES", 64):
+                del _CACHE[next(iter(_CACHE))]
+            # 只保留仍有快取或正在建構的鎖
+            for n in [n for n, lock in _BUILD_LOCKS.items() if n not in _CACHE and n != name and not lock.locked()]:
+                del _BUILD_LOCKS[n]
+        return payload
+
+
+def choose_encoding(accept_encoding: Optional[str], payload: Dict[str, Any]) -> str:
+    """Pick br > gzip > identity according to the client's Accept-Encoding q-values."""
+    accepted: Dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+
+    for enc in ("br", "gzip"):
+        if enc in payload["variants"] and accepted.get(enc, accepted.get("*", 0.0)) > 0:
+            return enc
+    return "identity"
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [t.strip() for t in if_none_match.split(",")]
+    # If-None-Match uses weak comparison, so a W/ prefix added by a proxy still matches
+    return "*" in candidates or any(c.removeprefix("W/") == etag for c in candidates)
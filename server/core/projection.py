@@ -0,0 +1,85 @@
+from typing import Any, Dict, List, Optional
+
+# Unified-JSON 鄉鎮欄位（順序即輸出順序）與 compact 模式使用的短鍵
+FIELD_SHORT_KEYS: Dict[str, str] = {
+    "township_name": "n",
+    "county_name": "c",
+    "temperature": "t",
+    "weather_description": "wx",
+    "pop6h": "p6",
+    "pop12h": "p12",
+    "aqi_level": "aqi",
+    "cwa_qpf_6h_min": "q6n",
+    "cwa_qpf_6h_max": "q6x",
+    "cwa_qpf_12h_min": "q12n",
+    "cwa_qpf_12h_max": "q12x",
+    "ncdr_daily_rain_min": "drn",
+    "ncdr_daily_rain_max": "drx",
+    "ncdr_nowcast": "nc",
+}
+FIELDS: List[str] = list(FIELD_SHORT_KEYS)
+
+
+# /api/weather/all 文件的頂層欄位（jobs.CACHED_WEATHER_DATA）
+ALL_FIELDS: List[str] = ["county_weather", "township_weather", "qpf_data", "aqi_data", "update_time", "stale"]
+
+
+def parse_fields(value: str, valid: Optional[List[str]] = None) -> Optional[List[str]]:
+    """
+    Comma-separated field names -> list in canonical order (so equivalent requests share one cache
+    entry), or None for "all fields". `valid` defaults to the unified-JSON FIELDS.
+    Raises ValueError listing any unknown names.
+    """
+    valid = valid or FIELDS
+    requested = {f.strip() for f in (value or "").split(",") if f.strip()}
+    if not requested:
+        return None
+    unknown = requested - set(valid)
+    if unknown:
+        raise ValueError(", ".join(sorted(unknown)))
+    return [f for f in valid if f in requested]
+
+
+def _drop_nulls(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _drop_nulls(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_drop_nulls(v) for v in value]
+    return value
+
+
+def project_all(doc: Dict[str, Any], fields: Optional[List[str]] = None, compact: bool = False) -> Dict[str, Any]:
+    """
+    The /all document in its own shape, keeping only the top-level `fields`
+    (see ALL_FIELDS). Compact mode drops null values at every level; keys are left as they are.
+    """
+    out = {key: doc.get(key) for key in (fields or ALL_FIELDS) if key in doc}
+    return _drop_nulls(out) if compact else out
+
+
+def project_record(record: Dict[str, Any], fields: Optional[List[str]] = None, compact: bool = False) -> Dict[str, Any]:
+    """
+    Keep only `fields` of a unified-JSON township record. In compact mode keys are shortened,
+    null values are dropped and nowcast frames become [min, max] pairs.
+    """
+    keys = fields or FIELDS
+    if not compact:
+        return {key: record.get(key) for key in keys}
+    out = {}
+    for key in keys:
+        value = record.get(key)
+        if value is None:
+            continue
+        if key == "ncdr_nowcast":
+            value = [[frame.get("min"), frame.get("max")] for frame in value]
+        out[FIELD_SHORT_KEYS[key]] = value
+    return out
+
+
+def project_document(update_time: Optional[str], records: Dict[str, Dict[str, Any]],
+                     fields: Optional[List[str]] = None, compact: bool = False) -> Dict[str, Any]:
+    """The unified-JSON document ({"update_time", "towns": {code: record}}) with every record projected."""
+    return {
+        "update_time": update_time,
+        "towns": {code: project_record(record, fields, compact) for code, record in records.items()},
+    }
@@ -0,0 +1,180 @@
+from typing import Any, Dict, List, Optional
+
+import msgpack
+import numpy as np
+
+from .township_metrics import AQI_LEVELS, NOWCAST_FRAMES
+
+# 二進位格式版本；欄位或編碼方式變動時遞增，解碼端遇到不認得的版本直接拒絕
+BINARY_FORMAT = "weather-snapshot"
+BINARY_FORMAT_VERSION = 1
+MEDIA_TYPE = "application/x-msgpack"
+
+# 各欄位的缺值標記
+_MISSING_INT16 = np.iinfo(np.int16).min
+_MISSING_UINT8 = 0xFF
+_MISSING_UINT16 = 0xFFFF
+
+# 降雨欄位以 float16 儲存（色階值 0.5、1、3 … 60 都能精確表示），NaN 表示缺值
+RAIN_FIELDS = (
+    "cwa_qpf_6h_min",
+    "cwa_qpf_6h_max",
+    "cwa_qpf_12h_min",
+    "cwa_qpf_12h_max",
+    "ncdr_daily_rain_min",
+    "ncdr_daily_rain_max",
+)
+
+
+def _number(value) -> Optional[float]:
+    """CWA sends numbers as text ("27", "30"); anything not numeric is treated as missing."""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(number) else number
+
+
+def _column(arr: np.ndarray) -> Dict[str, Any]:
+    return {"dtype": arr.dtype.str, "shape": list(arr.shape), "data": np.ascontiguousarray(arr).tobytes()}
+
+
+def _string_column(values: List[Optional[str]]):
+    """Strings -> (uint16 index per row, table of distinct strings in first-seen order)."""
+    table: Dict[str, int] = {}
+    ids = np.full(len(values), _MISSING_UINT16, dtype=np.uint16)
+    for i, value in enumerate(values):
+        if value is not None:
+            ids[i] = table.setdefault(value, len(table))
+    return ids, list(table)
+
+
+def encode_snapshot(doc: Dict[str, Any]) -> bytes:
+    """
+    Encode the unified document ({"update_time", "towns": {township_code: record}}) as one
+    msgpack map with a fixed schema:
+
+        {"format": "weather-snapshot", "version": 1, "update_time": ..., "count": n,
+         "townships": [code, ...], "names": [...], "counties": [...],
+         "tables": {"weather_description": [...], "aqi_level": [...]},
+         "columns": {field: {"dtype", "shape", "data": raw little-endian bytes}}}
+
+    Township codes, names and county names are sent once; every record field is a column
+    indexed by township position. temperature is int16 tenths of a degree, PoP uint8 percent,
+    rain values float16 (NaN = null), aqi_level and weather_description uint8/uint16 indices into
+    their tables (all-ones = null), and ncdr_nowcast an (n, 12, 2) float16 [min, max] block
+    (NaN = null bound or missing frame, a row of NaN = no nowcast).
+    """
+    towns = doc.get("towns") or {}
+    records = list(towns.values())
+    n = len(records)
+
+    counties: Dict[str, int] = {}
+    county_ids = np.array([counties.setdefault(r.get("county_name"), len(counties)) for r in records], dtype=np.uint8)
+
+    temperature = np.full(n, _MISSING_INT16, dtype=np.int16)
+    pop = {key: np.full(n, _MISSING_UINT8, dtype=np.uint8) for key in ("pop6h", "pop12h")}
+    rain = {key: np.full(n, np.nan, dtype=np.float16) for key in RAIN_FIELDS}
+    aqi = np.full(n, _MISSING_UINT8, dtype=np.uint8)
+    nowcast = np.full((n, NOWCAST_FRAMES, 2), np.nan, dtype=np.float16)
+
+    for i, record in enumerate(records):
+        value = _number(record.get("temperature"))
+        if value is not None:
+            temperature[i] = round(value * 10)
+        for key, column in pop.items():
+            value = _number(record.get(key))
+            if value is not None:
+                column[i] = min(100, max(0, round(value)))
+        for key, column in rain.items():
+            value = _number(record.get(key))
+            if value is not None:
+                column[i] = value
+        if record.get("aqi_level") in AQI_LEVELS:
+            aqi[i] = AQI_LEVELS.index(record["aqi_level"])
+        frames = record.get("ncdr_nowcast") or []
+        if frames:
+            # 缺少的上下限保留為 NaN，不可當成 0（0 是有效的降雨量）
+            nowcast[i, :len(frames)] = [
+                [np.nan if bound is None else bound for bound in (_number(frame.get("min")), _number(frame.get("max")))]
+                for frame in frames[:NOWCAST_FRAMES]
+            ]
+
+    weather, weather_table = _string_column([r.get("weather_description") for r in records])
+
+    columns = {
+        "county": county_ids,
+        "temperature": temperature,
+        "weather_description": weather,
+        **pop,
+        "aqi_level": aqi,
+        **rain,
+        "ncdr_nowcast": nowcast,
+    }
+    return msgpack.packb({
+        "format": BINARY_FORMAT,
+        "version": BINARY_FORMAT_VERSION,
+        "update_time": doc.get("update_time"),
+        "count": n,
+        "townships": list(towns),
+        "names": [r.get("township_name") for r in records],
+        "counties": list(counties),
+        "tables": {"weather_description": weather_table, "aqi_level": list(AQI_LEVELS)},
+        "columns": {key: _column(arr) for key, arr in columns.items()},
+    }, use_bin_type=True)
+
+
+def decode_columns(data: bytes) -> Dict[str, Any]:
+    """
+    Reference decoder, columnar form: the header fields plus `columns` as read-only numpy arrays
+    viewing the message bytes (no per-township work). Raises ValueError for another format or version.
+    """
+    doc = msgpack.unpackb(data, raw=False)
+    if doc.get("format") != BINARY_FORMAT or doc.get("version") != BINARY_FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot encoding {doc.get('format')!r} version {doc.get('version')!r}")
+    doc["columns"] = {
+        key: np.frombuffer(col["data"], dtype=np.dtype(col["dtype"])).reshape(col["shape"])
+        for key, col in doc["columns"].items()
+    }
+    return doc
+
+
+def decode_snapshot(data: bytes) -> Dict[str, Any]:
+    """
+    Reference decoder, document form: rebuilds {"update_time", "towns": {code: record}} with the
+    unified-JSON field names. Numbers come back as numbers (temperature and PoP are no longer text).
+    """
+    doc = decode_columns(data)
+    cols = doc["columns"]
+    weather_table = doc["tables"]["weather_description"]
+    aqi_table = doc["tables"]["aqi_level"]
+
+    # 先整欄轉成 Python 值（NaN / 缺值標記 -> None），再逐列組合
+    def floats(arr):
+        return [None if v != v else v for v in arr.astype(np.float64).tolist()]
+
+    temperature = [None if v == _MISSING_INT16 else v / 10 for v in cols["temperature"].tolist()]
+    pops = {key: [None if v == _MISSING_UINT8 else v for v in cols[key].tolist()] for key in ("pop6h", "pop12h")}
+    weather = [None if v == _MISSING_UINT16 else weather_table[v] for v in cols["weather_description"].tolist()]
+    aqi = [None if v == _MISSING_UINT8 else aqi_table[v] for v in cols["aqi_level"].tolist()]
+    rain = {key: floats(cols[key]) for key in RAIN_FIELDS}
+    nowcast_cols = cols["ncdr_nowcast"]
+    has_nowcast = ~np.isnan(nowcast_cols).all(axis=(1, 2))
+    nowcast = [[[None if v != v else v for v in frame] for frame in row] for row in nowcast_cols.astype(np.float64).tolist()]
+
+    towns = {}
+    for i, code in enumerate(doc["townships"]):
+        towns[code] = {
+            "township_name": doc["names"][i],
+            "county_name": doc["counties"][cols["county"][i]],
+            "temperature": temperature[i],
+            "weather_description": weather[i],
+            "pop6h": pops["pop6h"][i],
+            "pop12h": pops["pop12h"][i],
+            "aqi_level": aqi[i],
+            **{key: rain[key][i] for key in RAIN_FIELDS},
+            "ncdr_nowcast": [{"min": lo, "max": hi} for lo, hi in nowcast[i]] if has_nowcast[i] else [],
+        }
+    return {"update_time": doc.get("update_time"), "towns": towns}
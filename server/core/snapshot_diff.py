@@ -0,0 +1,25 @@
+from typing import Any, Dict
+
+
+def diff_records(old: Dict[str, Dict[str, Any]], new: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Field-level difference between two {code: record} mappings.
+
+    Returns {code: {field: new_value}} for every record whose fields changed. A record that is new
+    appears with all of its fields; a removed record maps to None.
+    """
+    changes: Dict[str, Any] = {}
+    for code, record in new.items():
+        previous = old.get(code)
+        if previous is None:
+            changes[code] = dict(record)
+            continue
+        if previous == record:
+            continue
+        changed = {field: value for field, value in record.items() if previous.get(field) != value}
+        changed.update({field: None for field in previous.keys() - record.keys()})
+        if changed:
+            changes[code] = changed
+    for code in old.keys() - new.keys():
+        changes[code] = None
+    return changes
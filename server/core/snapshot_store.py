@@ -0,0 +1,83 @@
+import mmap
+import os
+import time
+from typing import Any, Dict, Optional
+
+import msgpack
+import numpy as np
+
+from .class_rasters import pack_raster_sets, unpack_raster_sets
+from . import instrumentation
+
+# 檔案格式版本；結構變動時遞增，舊檔案會被忽略
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+def _pack_array(arr: np.ndarray) -> Dict[str, Any]:
+    return {"dtype": arr.dtype.str, "shape": list(arr.shape), "data": np.ascontiguousarray(arr).tobytes()}
+
+
+def _unpack_array(obj: Dict[str, Any]) -> np.ndarray:
+    # copy() 讓陣列脫離 mmap 的緩衝區，檔案可以安全關閉
+    return np.frombuffer(obj["data"], dtype=np.dtype(obj["dtype"])).reshape(obj["shape"]).copy()
+
+
+def save_snapshot(path: str, snapshot: Dict[str, Any]) -> bool:
+    """
+    Persist a snapshot as a single msgpack document.
+
+    `snapshot["arrays"]` may hold numpy arrays and `snapshot["rasters"]` the per-product class
+    rasters (see core.class_rasters); both are stored as raw bytes. The file is
+    written to a temporary name and renamed, so readers never see a partial snapshot.
+    """
+    doc = dict(snapshot)
+    doc["format"] = SNAPSHOT_FORMAT_VERSION
+    doc["saved_at"] = time.time()
+    doc["arrays"] = {k: _pack_array(v) for k, v in (snapshot.get("arrays") or {}).items()}
+    doc["rasters"] = pack_raster_sets(snapshot.get("rasters") or {}, _pack_array)
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        packed = msgpack.packb(doc, use_bin_type=True)
+        with open(tmp_path, "wb") as f:
+            f.write(packed)
+        os.replace(tmp_path, path)
+        instrumentation.SNAPSHOT_BYTES.set(len(packed))
+        return True
+    except Exception as e:
+        print(f"[SNAPSHOT] Failed to save snapshot to {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+
+def load_snapshot(path: str, max_age_seconds: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    Load a snapshot written by save_snapshot via a read-only memory map.
+
+    Returns None if the file is missing, unreadable, from another format version,
+    or older than `max_age_seconds`.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            doc = msgpack.unpackb(mm, raw=False)
+            instrumentation.SNAPSHOT_BYTES.set(len(mm))
+    except Exception as e:
+        print(f"[SNAPSHOT] Failed to read snapshot {path}: {e}")
+        return None
+
+    if doc.get("format") != SNAPSHOT_FORMAT_VERSION:
+        print(f"[SNAPSHOT] Ignoring snapshot with format {doc.get('format')}")
+        return None
+
+    age = time.time() - (doc.get("created_at") or 0)
+    if max_age_seconds is not None and age > max_age_seconds:
+        print(f"[SNAPSHOT] Snapshot too old ({age / 3600:.1f}h), refusing to load")
+        return None
+
+    doc["arrays"] = {k: _unpack_array(v) for k, v in (doc.get("arrays") or {}).items()}
+    doc["rasters"] = unpack_raster_sets(doc.get("rasters"), _unpack_array)
+    return doc
@@ -0,0 +1,120 @@
+import math
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km; works on scalars or numpy arrays."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _unit_vectors(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    lat = np.radians(lats)
+    lon = np.radians(lons)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+class TownshipIndex:
+    """
+    Nearest-township lookup over {name: {"lat", "lon"}} (config.TOWNSHIP_COORDS).
+
+    Single lookups use a uniform lat/lon grid and search outward ring by ring, stopping once no
+    unvisited cell can hold a closer township. Batches compare every query against all townships
+    at once using 3D unit vectors (a larger dot product means a shorter great-circle distance),
+    processed in chunks to bound memory.
+    """
+
+    def __init__(self, coords: Dict[str, Dict[str, float]], cell_deg: float = 0.1, chunk_size: int = 2048):
+        items = [(name, float(c["lat"]), float(c["lon"])) for name, c in coords.items()
+                 if c.get("lat") is not None and c.get("lon") is not None]
+        self.names: List[str] = [name for name, _, _ in items]
+        self.lats = np.array([lat for _, lat, _ in items], dtype=np.float64)
+        self.lons = np.array([lon for _, _, lon in items], dtype=np.float64)
+        self._vectors = _unit_vectors(self.lats, self.lons)
+        self._chunk_size = chunk_size
+
+        self.cell_deg = cell_deg
+        self._lat0 = float(self.lats.min()) if items else 0.0
+        self._lon0 = float(self.lons.min()) if items else 0.0
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        for i, (lat, lon) in enumerate(zip(self.lats, self.lons)):
+            self._grid.setdefault(self._cell(lat, lon), []).append(i)
+        rows = [r for r, _ in self._grid] or [0]
+        cols = [c for _, c in self._grid] or [0]
+        self._max_ring = max(max(rows) - min(rows), max(cols) - min(cols)) + 1
+        self._max_abs_lat = float(np.abs(self.lats).max()) if items else 0.0
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor((lat - self._lat0) / self.cell_deg)), int(math.floor((lon - self._lon0) / self.cell_deg))
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> List[Tuple[str, float]]:
+        """Return up to k (township_name, distance_km) pairs, closest first."""
+        k = max(1, min(k, len(self.names)))
+        if not self.names:
+            return []
+        row, col = self._cell(lat, lon)
+        # 一格經度在最高緯度處的長度，用來保守估計未走訪格子的最小距離
+        max_lat = min(89.0, max(self._max_abs_lat, abs(lat)) + self.cell_deg)
+        km_per_cell = self.cell_deg * KM_PER_DEG_LAT * math.cos(math.radians(max_lat))
+        seen: List[int] = []
+        for ring in range(self._max_ring + 1):
+            for r in range(row - ring, row + ring + 1):
+                for c in range(col - ring, col + ring + 1):
+                    if max(abs(r - row), abs(c - col)) == ring:
+                        seen.extend(self._grid.get((r, c), ()))
+            if len(seen) >= k:
+                idx = np.array(seen)
+                dist = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+                kth = np.partition(dist, k - 1)[k - 1]
+                # 尚未走訪的格子距離至少 ring 格；若已足夠近即可停止
+                if kth <= ring * km_per_cell:
+                    order = np.argsort(dist)[:k]
+                    return [(self.names[idx[i]], float(dist[i])) for i in order]
+        # 查詢點離網格太遠：退回全體比對
+        return self.nearest_many(np.array([lat]), np.array([lon]), k)[0]
+
+    def nearest_many(self, lats: np.ndarray, lons: np.ndarray, k: int = 1) -> List[List[Tuple[str, float]]]:
+        """Vectorized k-nearest for many points; returns one list of (name, distance_km) per point."""
+        k = max(1, min(k, len(self.names)))
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        results: List[List[Tuple[str, float]]] = []
+        for start in range(0, len(lats), self._chunk_size):
+            q_lat = lats[start:start + self._chunk_size]
+            q_lon = lons[start:start + self._chunk_size]
+            dots = _unit_vectors(q_lat, q_lon) @ self._vectors.T
+            if k < dots.shape[1]:
+                top = np.argpartition(-dots, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(dots.shape[1]), (len(q_lat), dots.shape[1]))
+            top = np.take_along_axis(top, np.argsort(-np.take_along_axis(dots, top, axis=1), axis=1), axis=1)
+            dist = haversine_km(q_lat[:, None], q_lon[:, None], self.lats[top], self.lons[top])
+            names = self.names
+            results.extend(
+                [(names[j], float(d)) for j, d in zip(row_idx, row_dist)]
+                for row_idx, row_dist in zip(top.tolist(), dist.tolist())
+            )
+        return results
+
+
+_INDEX = None
+
+
+def get_township_index() -> TownshipIndex:
+    """Index over config.TOWNSHIP_COORDS, limited to townships that have a code (i.e. a forecast)."""
+    global _INDEX
+    if _INDEX is None:
+        import config
+        from . import codes
+        coords = {name: c for name, c in getattr(config, "TOWNSHIP_COORDS", {}).items() if name in codes.TOWNSHIP_NAME_TO_CODE}
+        _INDEX = TownshipIndex(coords)
+    return _INDEX
@@ -0,0 +1,183 @@
+from typing import Dict, List, Optional, Any
+
+import numpy as np
+
+from . import codes
+
+# 每個鄉鎮一列，順序固定為 codes.TOWNSHIP_NAME_TO_CODE 的順序
+TOWNSHIP_NAMES: List[str] = list(codes.TOWNSHIP_NAME_TO_CODE.keys())
+TOWNSHIP_INDEX: Dict[str, int] = {name: i for i, name in enumerate(TOWNSHIP_NAMES)}
+COUNTY_NAMES: List[str] = list(codes.COUNTY_NAME_TO_CODE.keys())
+# 每個鄉鎮所屬縣市的索引，供分組聚合使用
+TOWNSHIP_COUNTY_INDEX = np.array(
+    [COUNTY_NAMES.index(codes.resolve_county_from_township_name(name)) for name in TOWNSHIP_NAMES],
+    dtype=np.intp,
+)
+
+NOWCAST_FRAMES = 12
+
+# AQI 等級依嚴重程度排序；陣列中存索引，-1 表示未知
+AQI_LEVELS: List[str] = [
+    "Good",
+    "Moderate",
+    "Unhealthy for Sensitive",
+    "Unhealthy",
+    "Very Unhealthy",
+    "Hazardous",
+]
+
+# 以 (min, max) 成對儲存的單值欄位
+RANGE_FIELDS = ("qpf12", "qpf6", "daily_rain")
+
+# 每個產品寫入的陣列；產品可以各自更新而不影響其他產品
+PRODUCT_ARRAYS: Dict[str, tuple] = {
+    **{field: (f"{field}_min", f"{field}_max") for field in RANGE_FIELDS},
+    "nowcast": ("nowcast_min", "nowcast_max"),
+    "aqi": ("aqi",),
+}
+
+
+def _to_float(value) -> Optional[float]:
+    if value is None or np.isnan(value):
+        return None
+    return float(value)
+
+
+def _group_reduce(ufunc, values: np.ndarray, groups: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    Reduce rows of `values` into `n_groups` buckets with a NaN-ignoring ufunc (np.fmin / np.fmax).
+    Groups whose rows are all NaN stay NaN.
+    """
+    out = np.full((n_groups,) + values.shape[1:], np.nan, dtype=values.dtype)
+    ufunc.at(out, groups, values)
+    return out
+
+
+class TownshipMetrics:
+    """
+    Image-derived metrics for every township, stored as fixed-size float32 arrays (NaN = not sampled).
+
+    County-level values are derived from these arrays with a grouped min/max reduction instead of
+    being sampled separately, so every township keeps its own readings.
+    """
+
+    def __init__(self, arrays: Optional[Dict[str, np.ndarray]] = None, products: Optional[List[str]] = None):
+        n = len(TOWNSHIP_NAMES)
+        self.arrays: Dict[str, np.ndarray] = {}
+        for field in RANGE_FIELDS:
+            self.arrays[f"{field}_min"] = np.full(n, np.nan, dtype=np.float32)
+            self.arrays[f"{field}_max"] = np.full(n, np.nan, dtype=np.float32)
+        self.arrays["nowcast_min"] = np.full((n, NOWCAST_FRAMES), np.nan, dtype=np.float32)
+        self.arrays["nowcast_max"] = np.full((n, NOWCAST_FRAMES), np.nan, dtype=np.float32)
+        self.arrays["aqi"] = np.full(n, -1, dtype=np.int8)
+        # 是否有像素座標可供取樣；沒有的鄉鎮回傳全 None
+        self.arrays["sampled"] = np.zeros(n, dtype=bool)
+        # 本次有來源圖片的產品（用來區分「沒有資料」與「數值為 0」）
+        self.products: List[str] = list(products or [])
+        if arrays:
+            for key, value in arrays.items():
+                if key in self.arrays:
+                    self.arrays[key] = np.asarray(value, dtype=self.arrays[key].dtype).reshape(self.arrays[key].shape)
+
+    def merge_products(self, other: "TownshipMetrics", products: List[str]) -> "TownshipMetrics":
+        """
+        New metrics with the arrays of `products` taken from `other` and everything else from self.
+        Used by the per-product refresh jobs to swap in one slice of the snapshot.
+        """
+        arrays = {key: value.copy() for key, value in self.arrays.items()}
+        for product in products:
+            for key in PRODUCT_ARRAYS[product]:
+                arrays[key] = other.arrays[key].copy()
+        arrays["sampled"] = self.arrays["sampled"] | other.arrays["sampled"]
+        merged_products = [p for p in PRODUCT_ARRAYS if p in self.products or (p in products and p in other.products)]
+        return TownshipMetrics(arrays, merged_products)
+
+    def mark_sampled(self, township_name: str) -> None:
+        idx = TOWNSHIP_INDEX.get(township_name)
+        if idx is not None:
+            self.arrays["sampled"][idx] = True
+
+    def set_range(self, field: str, township_name: str, result: Optional[Dict[str, float]], frame: Optional[int] = None) -> None:
+        """Store an analyzer {min, max} result for one township (and nowcast frame)."""
+        idx = TOWNSHIP_INDEX.get(township_name)
+        if idx is None or not result:
+            return
+        if frame is None:
+            self.arrays[f"{field}_min"][idx] = result["min"]
+            self.arrays[f"{field}_max"][idx] = result["max"]
+        else:
+            self.arrays[f"{field}_min"][idx, frame] = result["min"]
+            self.arrays[f"{field}_max"][idx, frame] = result["max"]
+
+    def set_aqi(self, township_name: str, level: Optional[str]) -> None:
+        idx = TOWNSHIP_INDEX.get(township_name)
+        if idx is None or level not in AQI_LEVELS:
+            return
+        self.arrays["aqi"][idx] = AQI_LEVELS.index(level)
+
+    def _record(self, values: Dict[str, np.ndarray], i: int) -> Dict[str, Any]:
+        """Build one legacy-shaped metrics dict from row `i` of `values`."""
+        if not values["sampled"][i]:
+            return {
+                "qpf12_max_mm_per_hr": None,
+                "qpf12_min_mm_per_hr": None,
+                "qpf6_max_mm_per_hr": None,
+                "qpf6_min_mm_per_hr": None,
+                "daily_rain": None,
+                "nowcast": [],
+                "aqi_level": None,
+            }
+
+        daily_min = _to_float(values["daily_rain_min"][i])
+        daily_max = _to_float(values["daily_rain_max"][i])
+        nowcast = []
+        if "nowcast" in self.products:
+            # 沒有取樣到的影格沿用舊行為，以 0.0 表示
+            nowcast = [
+                {"min": _to_float(lo) or 0.0, "max": _to_float(hi) or 0.0}
+                for lo, hi in zip(values["nowcast_min"][i], values["nowcast_max"][i])
+            ]
+        aqi_idx = int(values["aqi"][i])
+        return {
+            "qpf12_max_mm_per_hr": _to_float(values["qpf12_max"][i]),
+            "qpf12_min_mm_per_hr": _to_float(values["qpf12_min"][i]),
+            "qpf6_max_mm_per_hr": _to_float(values["qpf6_max"][i]),
+            "qpf6_min_mm_per_hr": _to_float(values["qpf6_min"][i]),
+            "daily_rain": {"min": daily_min, "max": daily_max} if daily_min is not None and daily_max is not None else None,
+            "nowcast": nowcast,
+            "aqi_level": AQI_LEVELS[aqi_idx] if aqi_idx >= 0 else None,
+        }
+
+    def township_record(self, township_name: str) -> Optional[Dict[str, Any]]:
+        idx = TOWNSHIP_INDEX.get(township_name)
+        if idx is None:
+            return None
+        return self._record(self.arrays, idx)
+
+    def county_arrays(self) -> Dict[str, np.ndarray]:
+        """Grouped reduction of township rows into one row per county (min of mins, max of maxes, worst AQI)."""
+        n_counties = len(COUNTY_NAMES)
+        groups = TOWNSHIP_COUNTY_INDEX
+        out: Dict[str, np.ndarray] = {}
+        for key, values in self.arrays.items():
+            if key == "aqi":
+                aqi = np.full(n_counties, -1, dtype=np.int8)
+                np.maximum.at(aqi, groups, values)
+                out[key] = aqi
+            elif key == "sampled":
+                sampled = np.zeros(n_counties, dtype=bool)
+                np.logical_or.at(sampled, groups, values)
+                out[key] = sampled
+            elif key.endswith("_min"):
+                out[key] = _group_reduce(np.fmin, values, groups, n_counties)
+            else:
+                out[key] = _group_reduce(np.fmax, values, groups, n_counties)
+        return out
+
+    def county_records(self) -> Dict[str, Dict[str, Any]]:
+        """County-level metrics in the shape previously cached in CACHED_IMAGE_METRICS."""
+        aggregated = self.county_arrays()
+        return {county: self._record(aggregated, i) for i, county in enumerate(COUNTY_NAMES)}
+
+    def township_records(self) -> Dict[str, Dict[str, Any]]:
+        return {name: self._record(self.arrays, i) for i, name in enumerate(TOWNSHIP_NAMES)}
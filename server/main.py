@@ -5,13 +5,19 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from dotenv import load_dotenv
 from api.weather import router as weather_router
 from api.fcm import fcm_router # 引入新的 fcm_router
+from api.metrics import metrics_router
+from api.admin import admin_router
 import asyncio
 from scheduler import jobs
 from scheduler.jobs import scheduler
+from services.delivery_queue import discord_queue
+from services.publisher import snapshot_publisher
+from core import spatial_index
+from scheduler.coordination import leader_lock, follow_leader
 
 load_dotenv()
 
@@ -23,25 +29,60 @@ app = FastAPI(
 
 @app.on_event("startup")
 async def startup_event():
+    # Spatial index for /api/weather/nearest
+    spatial_index.get_township_index()
+
+    # Serve the last persisted snapshot (marked stale) while the first run is in progress
+    jobs.load_snapshot_from_disk()
+
+    # Background delivery of Discord messages
+    discord_queue.start()
+
+    # With several uvicorn workers only the lock holder runs the pipeline; the others serve
+    # the snapshots it publishes and take over if it exits
+    if leader_lock.try_acquire():
+        await start_pipeline()
+    else:
+        print(f"Worker {os.getpid()} is a follower; serving snapshots published by the leader")
+        app.state.follower_task = asyncio.create_task(follow_leader(start_pipeline))
+    print("FastAPI application startup")
+
+async def start_pipeline():
     # Trigger the data fetching job to run immediately in the background
     print("Triggering initial data fetch job on startup...")
-    asyncio.create_task(jobs.fetch_data_job())
-    
+    await jobs.RUN_COORDINATOR.request('full')
+
     # Start the scheduler for subsequent hourly runs
     scheduler.start()
-    print("FastAPI application startup")
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    scheduler.shutdown()
+    follower_task = getattr(app.state, "follower_task", None)
+    if follower_task:
+        follower_task.cancel()
+    if scheduler.running:
+        scheduler.shutdown()
+    await jobs.RUN_COORDINATOR.shutdown()
+    await snapshot_publisher.stop()
+    leader_lock.release()
+    await discord_queue.stop()
     print("FastAPI application shutdown")
 
+@app.middleware("http")
+async def mark_stale_responses(request: Request, call_next):
+    response = await call_next(request)
+    if jobs.get_cached_weather_data().get('stale'):
+        response.headers["X-Data-Stale"] = "true"
+    return response
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Weather Forecast API"}
 
 app.include_router(weather_router, prefix="/api/weather")
 app.include_router(fcm_router) # 包含 fcm_router
+app.include_router(metrics_router)
+app.include_router(admin_router, prefix="/api/admin")
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8100, reload=True)
@@ -0,0 +1,90 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+    import msvcrt
+
+import config
+from scheduler import jobs
+
+
+class LeaderLock:
+    """
+    Non-blocking exclusive lock on a file, held for the lifetime of the process.
+
+    The OS releases it when the holder exits (even on a crash), so a waiting worker
+    can take over simply by retrying `try_acquire`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+leader_lock = LeaderLock(config.LEADER_LOCK_PATH)
+
+
+async def follow_leader(become_leader: Callable[[], Awaitable[None]], interval: Optional[float] = None) -> None:
+    """
+    Follower loop: pick up snapshots the leader publishes and take over the pipeline if the
+    leader goes away.
+    """
+    interval = interval or config.SNAPSHOT_POLL_SECONDS
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if leader_lock.try_acquire():
+                print(f"[LEADER] Worker {os.getpid()} took over the data pipeline")
+                # 接手前先讀入前任 leader 最後發佈的快照，版本號才會延續
+                await _sync_snapshot()
+                await become_leader()
+                return
+            await _sync_snapshot()
+        except Exception as e:
+            print(f"[LEADER] Follower check failed: {e}")
+
+
+async def _sync_snapshot() -> None:
+    # 檔案的讀取與解碼放在執行緒；套用快照與廣播必須回到 event loop 上執行
+    found = await asyncio.to_thread(jobs.read_newer_snapshot, jobs.SNAPSHOT_FILE_STATE['mtime_ns'])
+    if found:
+        jobs.adopt_snapshot(*found)
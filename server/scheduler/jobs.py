@@ -1,16 +1,45 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from core import data_fetcher, calculation, json_generator
+from core import data_fetcher, json_generator
 from core import image_analyzer
 from core import image_url_resolver
+from core.township_metrics import TownshipMetrics
+from core import snapshot_store, history_store
+from core import codes
+from core import class_rasters
+from core import overlays
+from core import instrumentation
+from core import alert_rules
+from scheduler import pipeline
+from scheduler.runs import RunCoordinator, RunSpec
 import config
-from services import fcm_sender, discord_sender
+from services import fcm_sender
+from services import firebase_uploader
+from services.publisher import snapshot_publisher
+from services.delivery_queue import discord_queue
+from services.snapshot_events import broadcaster
 import asyncio
 import datetime
 import os
 import json
+import time
+import hashlib
+import functools
+from apscheduler.triggers.cron import CronTrigger
+from concurrent.futures import ThreadPoolExecutor
 
 scheduler = AsyncIOScheduler()
 
+# (event loop, asyncio.Semaphore)，見 _image_semaphore
+if '_IMAGE_SEMAPHORE' not in globals():
+    _IMAGE_SEMAPHORE = None
+
+# 除錯疊圖（config.DEBUG_SAVE_*）；關閉時不做任何事
+OVERLAYS = overlays.OverlayRenderer.from_config(config)
+
+# 警示規則（config.ALERT_RULES）；保留冷卻紀錄，模組重新載入時不重複推播
+if 'ALERT_ENGINE' not in globals():
+    ALERT_ENGINE = alert_rules.AlertEngine.from_config(config)
+
 # --- Data Cache ---
 # 初始化全局變數
 if 'CACHED_WEATHER_DATA' not in globals():
@@ -19,7 +48,8 @@ if 'CACHED_WEATHER_DATA' not in globals():
         'township_weather': {},    # 鄉鎮天氣資料
         'qpf_data': {},           # 降雨強度資料
         'aqi_data': {},           # 空氣品質資料
-        'update_time': None       # 最後更新時間
+        'update_time': None,      # 最後更新時間
+        'stale': False            # 是否為啟動時從磁碟載入、尚未更新的舊資料
     }
 
 if 'CACHED_CWA_TOWNSHIP_DATA' not in globals():
@@ -31,26 +61,67 @@ if 'CACHED_TOWNSHIP_MAP' not in globals():
 if 'CACHED_IMAGE_METRICS' not in globals():
     CACHED_IMAGE_METRICS = {}
 
-# 更新時間間隔設定（6點和12點）
-UPDATE_HOURS = [6, 12]
-# --- End of Cache ---
+# 鄉鎮層級的影像指標（陣列）；CACHED_IMAGE_METRICS 為其縣市聚合結果
+if 'CACHED_TOWNSHIP_METRICS' not in globals():
+    CACHED_TOWNSHIP_METRICS = TownshipMetrics()
+
+# 每個產品的分類影像（core.class_rasters 格式），隨快照保存，供 /api/weather/raster 繪製
+if 'CACHED_RASTERS' not in globals():
+    CACHED_RASTERS = {}
+
+# 目前快照的狀態：版本號、建立時間（epoch）與來源（run / disk）
+if 'SNAPSHOT_STATE' not in globals():
+    SNAPSHOT_STATE = {
+        'version': 0,
+        'created_at': None,
+        'source': None,
+    }
+
+# 快照檔與歷史紀錄由單一背景執行緒依序寫出，不阻塞 event loop；單執行緒保證寫入順序與發佈順序相同
+if '_SNAPSHOT_WRITER' not in globals():
+    _SNAPSHOT_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot-writer")
+
+# 最近一次讀取的快照檔 mtime；follower 以此判斷 leader 是否已發佈新版本
+if 'SNAPSHOT_FILE_STATE' not in globals():
+    SNAPSHOT_FILE_STATE = {'mtime_ns': None}
+
+instrumentation.register_snapshot_age(lambda: SNAPSHOT_STATE['created_at'])
+
+# 最近一次 fetch_data_job 的各階段耗時報告
+if 'PIPELINE_STATE' not in globals():
+    PIPELINE_STATE = {'finished_at': None, 'duration': None, 'report': []}
+
+# 影像產品；各自可以單獨更新（見 refresh_image_products_job）
+IMAGE_PRODUCTS = ['qpf12', 'qpf6', 'daily_rain', 'nowcast', 'aqi']
+# 同一排程一起偵測與更新的產品
+IMAGE_PRODUCT_SLICES = {
+    'qpf': ['qpf12', 'qpf6', 'daily_rain'],
+    'nowcast': ['nowcast'],
+    'aqi': ['aqi'],
+}
 
-def _normalize_name(name: str) -> str:
-    if not isinstance(name, str):
-        return ""
-    # Normalize common variants and whitespace
-    return name.replace("台", "臺").replace(" ", "").strip()
+# 目前快照中各資料切片的來源：影像產品為圖片 URL，'cwa_county' / 'cwa_townships' 為縣市預報與探測鄉鎮的內容雜湊
+if 'SOURCE_STATE' not in globals():
+    SOURCE_STATE = {}
+
+# 是否已接續 Storage 上 manifest 的版本號（見 seed_version_from_storage）
+if 'VERSION_SEEDED' not in globals():
+    VERSION_SEEDED = False
+
+# 最近一次算出的鄉鎮像素座標，供單一產品更新沿用
+if 'PIXEL_MAPS' not in globals():
+    PIXEL_MAPS = None
+# --- End of Cache ---
 
 async def _fetch_weather_data(county_data=None):
     """Fetches both county and township level weather data."""
     if county_data is None:
         county_data = await asyncio.to_thread(data_fetcher.get_cwa_county_forecast_data)
+    township_weather, all_township_data = await _fetch_township_weather()
+    return _parse_county_weather(county_data), township_weather, all_township_data
 
-    print(f"Debug: county_data keys: {county_data.keys()}")
-    records = county_data.get('records', {})
-    locations = records.get('location', [])
-    print(f"Debug: Found {len(locations)} locations in county_data.")
-
+async def _fetch_township_weather():
+    """Fetches the township forecasts of every city concurrently."""
     cities = list(data_fetcher.CWA_TOWNSHIP_CODES.keys())
     township_data_tasks = []
     for city in cities:
@@ -71,7 +142,7 @@ async def _fetch_weather_data(county_data=None):
                 township_name = location.get('LocationName')
                 if township_name:
                     full_name = f"{city_name}{township_name}"
-                    normalized_name = _normalize_name(full_name)
+                    normalized_name = codes.normalize_name(full_name)
                     print(f"[CWA] Township fetched: {full_name} -> normalized: {normalized_name}")
                     township_weather[normalized_name] = location
 
@@ -80,7 +151,15 @@ async def _fetch_weather_data(county_data=None):
             'location': all_locations
         }
     }
-    
+    return township_weather, all_township_data
+
+def _parse_county_weather(county_data):
+    """Flattens the county forecast into {county_name: {element: value, 'T': mean temperature}}."""
+    print(f"Debug: county_data keys: {county_data.keys()}")
+    records = county_data.get('records', {})
+    locations = records.get('location', [])
+    print(f"Debug: Found {len(locations)} locations in county_data.")
+
     county_weather = {}
     if county_data and 'records' in county_data:
         for location in county_data['records'].get('location', []):
@@ -103,303 +182,673 @@ async def _fetch_weather_data(county_data=None):
                 
                 county_weather[county_name] = weather_elements
     
-    return county_weather, township_weather, all_township_data
+    return county_weather
 
 async def fetch_data_job():
     """
     Scheduled job to fetch and cache weather data.
+
+    Runs FETCH_PIPELINE: the CWA branch (county + township forecasts) and the image branch
+    (URL resolution, pixel maps, rasters, per-township sampling) run concurrently. Publishing
+    waits for both but only needs one of them, so a failed or timed-out branch leaves its
+    slice of the previous snapshot in place instead of blocking the other.
     """
     print("Running scheduled job: fetch_data_job")
-    global CACHED_WEATHER_DATA, CACHED_IMAGE_METRICS, CACHED_CWA_TOWNSHIP_DATA, CACHED_TOWNSHIP_MAP, CACHED_FINAL_JSON
-
+    # 第一次執行時接續 Storage 上 manifest 的版本號；在 run 裡做，啟動不必等待 Storage
+    if not VERSION_SEEDED:
+        await seed_version_from_storage()
+    result = await FETCH_PIPELINE.run(
+        default_timeout=config.PIPELINE_DEFAULT_STAGE_TIMEOUT,
+        timeouts=config.PIPELINE_STAGE_TIMEOUTS,
+    )
+    PIPELINE_STATE.update({
+        'finished_at': time.time(),
+        'duration': result['duration'],
+        'report': result['report'],
+    })
+    for entry in result['report']:
+        if entry['duration'] is not None:
+            instrumentation.STAGE_DURATION.observe(entry['duration'], stage=entry['name'], status=entry['status'])
+    published = 'snapshot_version' in result['outputs']
+    instrumentation.PIPELINE_RUNS.inc(job='fetch_data_job', result='published' if published else 'failed')
+    print(f"[PIPELINE] fetch_data_job finished in {result['duration']:.1f}s\n{pipeline.format_report(result['report'])}")
+    return result
+
+# --- fetch_data_job stages ---
+
+async def _stage_cwa_county():
+    return await asyncio.to_thread(data_fetcher.get_cwa_county_forecast_data)
+
+async def _stage_cwa_probe():
+    """The probe element (config.CWA_PROBE_*) fetched on its own: one township, one element."""
+    city, township = config.CWA_PROBE_TOWNSHIP
+    data = await asyncio.to_thread(data_fetcher.get_cwa_township_forecast_data, city,
+                                   {"LocationName": township, "ElementName": config.CWA_PROBE_ELEMENT})
+    locations = ((data or {}).get('records') or {}).get('location') or []
+    return _probe_element(locations[0]) if locations else None
+
+def _probe_element(location):
+    for element in (location or {}).get('WeatherElement', []):
+        if element.get('ElementName') == config.CWA_PROBE_ELEMENT:
+            return element
+    return None
+
+async def _stage_cwa_townships():
+    township_weather, all_township_data = await _fetch_township_weather()
+    if not township_weather:
+        raise RuntimeError("township_weather is empty")
+    return {'township_weather': township_weather, 'all_township_data': all_township_data}
+
+async def _stage_county_weather(county_data):
+    return _parse_county_weather(county_data or {})
+
+async def _stage_image_urls():
+    """Resolves the latest URL of every image product concurrently."""
+    if config.TESSERACT_CMD:
+        image_analyzer.configure_tesseract_cmd(config.TESSERACT_CMD)
+    image_urls = await _resolve_image_urls(IMAGE_PRODUCTS)
+    if not any(image_urls[p] for p in IMAGE_PRODUCTS):
+        raise RuntimeError("no image product URL could be resolved")
+    return image_urls
+
+async def _resolve_image_urls(products):
+    """
+    {product: latest url or None} for `products` (others are None), plus the 12 nowcast frame
+    URLs under 'nowcast_frames'. Resolution only issues HEAD requests, so it doubles as the cheap
+    "is there a new issue" probe of the per-product refresh jobs.
+    """
+    resolvers = {
+        'qpf12': lambda: image_url_resolver.resolve_latest_url(config.POP12_URL_PATTERNS),
+        'qpf6': lambda: image_url_resolver.resolve_latest_url(config.POP6_URL_PATTERNS),
+        'daily_rain': image_url_resolver.resolve_ncdr_daily_rain_url,
+        'nowcast': lambda: image_url_resolver.resolve_latest_url(config.NCDR_NOWCAST_URL_PATTERN),
+        'aqi': lambda: image_url_resolver.resolve_latest_url(config.AQI_URL_PATTERNS),
+    }
+    products = [p for p in IMAGE_PRODUCTS if p in products]
+    resolved = await asyncio.gather(*(asyncio.to_thread(resolvers[p]) for p in products), return_exceptions=True)
+    image_urls = {p: None for p in IMAGE_PRODUCTS}
+    for product, r in zip(products, resolved):
+        # 單一產品解析失敗只略過該產品
+        if isinstance(r, Exception):
+            print(f"[IMG] URL resolution failed for {product}: {r}")
+        else:
+            image_urls[product] = r
+    image_urls['nowcast_frames'] = []
+    if image_urls['nowcast']:
+        base_url = image_urls['nowcast'].rsplit('_', 1)[0]
+        image_urls['nowcast_frames'] = [f"{base_url}_f{h:02d}h.gif" for h in range(1, 13)]
+    return image_urls
+
+async def _stage_pixel_maps(image_urls):
+    """Township pixel positions for the image size actually served upstream."""
+    global PIXEL_MAPS
+    daily_rain_url, pop12_url, pop6_url = image_urls['daily_rain'], image_urls['qpf12'], image_urls['qpf6']
+
+    # 使用三錨點 + TOWNSHIP_COORDS 自動推算座標；如未提供則略過影像分析
+    township_coords = getattr(config, 'TOWNSHIP_COORDS', None)
+    if not township_coords:
+        raise RuntimeError("TOWNSHIP_COORDS not configured in config.py. Skipping image analysis.")
+
+    # 生成兩種尺寸的鄉鎮像素座標；預設優先使用 450x810
+    pixel_maps = image_analyzer.build_pixel_maps_from_township_coords(township_coords)
+    px_450_810 = pixel_maps.get("450x810", {})
+    px_315_642 = pixel_maps.get("315x642", {})
+    print(f"[IMG] Built pixel map: 450x810 towns={len(px_450_810)}")
+    print(f"[IMG] Built pixel map: 315x642 towns={len(px_315_642)}")
+
+    # 選擇使用的像素地圖：優先用每日雨量圖尺寸；若不匹配則嘗試 POP12；若仍不匹配則做線性縮放
+    active_px_map = px_450_810
+    active_base_size = (450, 810)
     try:
-        county_data = await asyncio.to_thread(data_fetcher.get_cwa_county_forecast_data)
-        weather_data = await _fetch_weather_data(county_data)
-        
-        if not weather_data or not weather_data[1]:
-            print("Failed to fetch weather data or township_weather is empty")
-            return
-        
-        county_weather, township_weather, all_township_data = weather_data
-        
-        CACHED_CWA_TOWNSHIP_DATA = all_township_data
-        CACHED_TOWNSHIP_MAP = township_weather
+        test_url = daily_rain_url or pop12_url or pop6_url
+        if test_url:
+            img = await asyncio.to_thread(image_analyzer.load_image, test_url)
+            w, h = img.width, img.height
+            print(f"[IMG] Detected image size: {w}x{h}")
+            if (w, h) == (450, 810):
+                active_px_map = px_450_810
+                active_base_size = (450, 810)
+            elif (w, h) == (315, 642):
+                active_px_map = px_315_642
+                active_base_size = (315, 642)
+            else:
+                # 做簡單等比縮放（以 450x810 為基準）
+                sx = w / 450.0
+                sy = h / 810.0
+                print(f"[IMG] Scaling pixel map from 450x810 by ({sx:.3f}, {sy:.3f})")
+                scaled = {}
+                for name, (x, y) in px_450_810.items():
+                    scaled[name] = (int(round(x * sx)), int(round(y * sy)))
+                active_px_map = scaled
+                active_base_size = (w, h)
+    except Exception as e:
+        print(f"[IMG] Image size detection failed, fallback to 450x810 map: {e}")
+
+    PIXEL_MAPS = {'active': active_px_map, 'size': active_base_size, '315x642': px_315_642}
+    return PIXEL_MAPS
+
+async def _stage_rasters(image_urls):
+    # 整張圖分類一次並保存，供 /api/weather/raster 使用
+    return await _classify_rasters({
+        "qpf12": (config.QPF_COLOR_MAP, [image_urls['qpf12']] if image_urls['qpf12'] else []),
+        "qpf6": (config.QPF_COLOR_MAP, [image_urls['qpf6']] if image_urls['qpf6'] else []),
+        "daily_rain": (config.NCDR_NOWCAST_COLOR_MAP, [image_urls['daily_rain']] if image_urls['daily_rain'] else []),
+        "nowcast": (config.NCDR_NOWCAST_COLOR_MAP, image_urls['nowcast_frames']),
+    })
+
+async def _stage_township_metrics(image_urls, pixel_maps):
+    """
+    Samples every township on every product image that has a URL; returns a TownshipMetrics.
+    Work is split into county × image units that run concurrently under _image_semaphore.
+    """
+    pop12_url, pop6_url, daily_rain_url = image_urls['qpf12'], image_urls['qpf6'], image_urls['daily_rain']
+    nowcast_base_url, nowcast_urls, aqi_url = image_urls['nowcast'], image_urls['nowcast_frames'], image_urls['aqi']
+    active_px_map = pixel_maps['active']
+
+    # 逐縣市取樣，每個鄉鎮各自保存數值；縣市 min/max 由鄉鎮陣列分組聚合而得
+    counties = list(codes.COUNTY_NAME_TO_CODE.keys())
+    township_metrics = TownshipMetrics(products=[
+        name for name, url in (
+            ("qpf12", pop12_url), ("qpf6", pop6_url), ("daily_rain", daily_rain_url),
+            ("nowcast", nowcast_base_url), ("aqi", aqi_url),
+        ) if url
+    ])
+
+    # 每個工作單位是「一個縣市 × 一張圖」；全部同時排入，由全域 semaphore 限制同時執行的數量
+    units = []
+    for county in counties:
+        # 該縣市有像素座標的鄉鎮（完整名稱），若沒有則略過
+        towns = {t: active_px_map[t] for t, c in codes.TOWNSHIP_TO_COUNTY.items() if c == county and active_px_map.get(t)}
+        if not towns:
+            print(f"[IMG] Skip county (no pixels): {county}")
+            continue
+        for tname in towns:
+            township_metrics.mark_sampled(tname)
+        if pop12_url:
+            units.append(("qpf12", None, pop12_url, config.QPF_COLOR_MAP, towns))
+        if pop6_url:
+            units.append(("qpf6", None, pop6_url, config.QPF_COLOR_MAP, towns))
+        if daily_rain_url:
+            units.append(("daily_rain", None, daily_rain_url, config.NCDR_NOWCAST_COLOR_MAP, towns))
+        if nowcast_base_url:
+            units.extend(("nowcast", frame, url, config.NCDR_NOWCAST_COLOR_MAP, towns) for frame, url in enumerate(nowcast_urls))
+        # AQI：每個鄉鎮各自取色；縣市取最差等級
+        if aqi_url:
+            units.append(("aqi", None, aqi_url, None, towns))
+
+    print(f"[IMG] Analyzing {len(units)} county/image units (concurrency {config.IMAGE_STAGE_CONCURRENCY}), "
+          f"nowcast frames={len(nowcast_urls)}")
+    results = await asyncio.gather(*(_analyze_unit(field, url, color_map, towns) for field, _, url, color_map, towns in units))
+
+    # 依工作單位的建立順序寫回，結果與完成先後無關
+    for (field, frame, _, _, _), result in zip(units, results):
+        for tname, value in result.items():
+            if field == "aqi":
+                township_metrics.set_aqi(tname, value)
+            else:
+                township_metrics.set_range(field, tname, value, frame=frame)
+
+    if OVERLAYS.enabled:
+        await asyncio.to_thread(_render_overlays, image_urls, pixel_maps)
+    return township_metrics
+
+def _image_semaphore():
+    """Process-wide limit on concurrent image analysis (shared by the full run and the refresh jobs)."""
+    global _IMAGE_SEMAPHORE
+    loop = asyncio.get_running_loop()
+    if _IMAGE_SEMAPHORE is None or _IMAGE_SEMAPHORE[0] is not loop:
+        _IMAGE_SEMAPHORE = (loop, asyncio.Semaphore(config.IMAGE_STAGE_CONCURRENCY))
+    return _IMAGE_SEMAPHORE[1]
+
+async def _analyze_unit(field, url, color_map, towns):
+    """All townships of one county on one image, in one worker thread."""
+    async with _image_semaphore():
+        if field == "aqi":
+            return await asyncio.to_thread(image_analyzer.analyze_aqi_many, url, towns)
+        return await asyncio.to_thread(image_analyzer.analyze_rain_many, url, towns, color_map)
+
+def _render_overlays(image_urls, pixel_maps):
+    """Queue one debug overlay per analyzed frame, reusing the images decoded for sampling."""
+    frames = [
+        ("POP12", image_urls['qpf12'], pixel_maps['active']),
+        ("POP6", image_urls['qpf6'], pixel_maps['active']),
+        ("DAILY_RAIN", image_urls['daily_rain'], pixel_maps['active']),
+    ]
+    # Nowcast 只輸出前兩張，座標使用 315x642 地圖
+    frames += [(f"NOWCAST_f{idx + 1:02d}", url, pixel_maps['315x642']) for idx, url in enumerate(image_urls['nowcast_frames'][:2])]
+    frames = [frame for frame in frames if frame[1]]
+    OVERLAYS.begin_run(codes.TOWNSHIP_TO_COUNTY, frames=len(frames))
+    for label, url, px_map in frames:
+        centers = {t: px_map[t] for t in codes.TOWNSHIP_TO_COUNTY if px_map.get(t)}
+        try:
+            OVERLAYS.render(image_analyzer.load_image(url), centers, label)
+        except Exception as e:
+            print(f"[OVERLAY] Skip {label}: {e}")
+
+async def _stage_publish(county_data, county_weather, cwa_townships, image_urls, township_metrics, rasters):
+    """Commits whichever branches succeeded to the caches and publishes the snapshot."""
+    if cwa_townships is None and township_metrics is None:
+        raise RuntimeError("both the CWA and the image branch failed")
+    if cwa_townships is None or county_weather is None:
+        print("[PIPELINE] CWA branch failed; keeping the previous forecast")
+        county_data = county_weather = cwa_townships = None
+    if township_metrics is None:
+        print("[PIPELINE] Image branch failed; keeping the previous image metrics")
+        image_urls = None
+    products = [p for p in IMAGE_PRODUCTS if image_urls and image_urls[p]]
+    return _commit_and_publish(county_data, county_weather, cwa_townships, image_urls, products, township_metrics, rasters)
+
+def _commit_and_publish(county_data=None, county_weather=None, cwa_townships=None,
+                        image_urls=None, products=(), township_metrics=None, rasters=None):
+    """
+    Swap the given slices into the caches and publish a new snapshot. CWA data replaces the
+    forecast; township_metrics / rasters replace only `products`. Runs without awaiting, so
+    concurrent refresh jobs cannot interleave their updates.
+    """
+    global CACHED_CWA_TOWNSHIP_DATA, CACHED_TOWNSHIP_MAP, CACHED_TOWNSHIP_METRICS, CACHED_RASTERS
+    if cwa_townships is not None:
+        CACHED_CWA_TOWNSHIP_DATA = cwa_townships['all_township_data']
+        CACHED_TOWNSHIP_MAP = cwa_townships['township_weather']
         CACHED_WEATHER_DATA.update({
                 'county_weather': county_weather,
-                'township_weather': township_weather,
+                'township_weather': cwa_townships['township_weather'],
                 'update_time': datetime.datetime.now().isoformat()
             })
-    except Exception as e:
-        print(f"Error in fetch_data_job while fetching weather data: {e}")
-        return
-    
-    try:
-        if config.TESSERACT_CMD:
-            image_analyzer.configure_tesseract_cmd(config.TESSERACT_CMD)
-
-        pop12_url = await asyncio.to_thread(image_url_resolver.resolve_latest_url, config.POP12_URL_PATTERNS)
-        pop6_url = await asyncio.to_thread(image_url_resolver.resolve_latest_url, config.POP6_URL_PATTERNS)
-        daily_rain_url = image_url_resolver.resolve_ncdr_daily_rain_url()
-        nowcast_base_url = await asyncio.to_thread(image_url_resolver.resolve_latest_url, config.NCDR_NOWCAST_URL_PATTERN)
-        aqi_url = await asyncio.to_thread(image_url_resolver.resolve_latest_url, config.AQI_URL_PATTERNS)
-
-        image_metrics = {}
-
-        # 使用三錨點 + TOWNSHIP_COORDS 自動推算座標；如未提供則略過影像分析
-        township_coords = getattr(config, 'TOWNSHIP_COORDS', None)
-        if not township_coords:
-            print("Warning: TOWNSHIP_COORDS not configured in config.py. Skipping image analysis.")
-            return
-
-        # 生成兩種尺寸的鄉鎮像素座標；預設優先使用 450x810
-        pixel_maps = image_analyzer.build_pixel_maps_from_township_coords(township_coords)
-        px_450_810 = pixel_maps.get("450x810", {})
-        px_315_642 = pixel_maps.get("315x642", {})
-        print(f"[IMG] Built pixel map: 450x810 towns={len(px_450_810)}")
-        print(f"[IMG] Built pixel map: 315x642 towns={len(px_315_642)}")
-
-        # 選擇使用的像素地圖：優先用每日雨量圖尺寸；若不匹配則嘗試 POP12；若仍不匹配則做線性縮放
-        active_px_map = px_450_810
-        active_base_size = (450, 810)
-        try:
-            test_url = daily_rain_url or pop12_url or pop6_url
-            if test_url:
-                img = await asyncio.to_thread(image_analyzer._download_image, test_url)  # type: ignore[attr-defined]
-                w, h = img.width, img.height
-                print(f"[IMG] Detected image size: {w}x{h}")
-                if (w, h) == (450, 810):
-                    active_px_map = px_450_810
-                    active_base_size = (450, 810)
-                elif (w, h) == (315, 642):
-                    active_px_map = px_315_642
-                    active_base_size = (315, 642)
-                else:
-                    # 做簡單等比縮放（以 450x810 為基準）
-                    sx = w / 450.0
-                    sy = h / 810.0
-                    print(f"[IMG] Scaling pixel map from 450x810 by ({sx:.3f}, {sy:.3f})")
-                    scaled = {}
-                    for name, (x, y) in px_450_810.items():
-                        scaled[name] = (int(round(x * sx)), int(round(y * sy)))
-                    active_px_map = scaled
-                    active_base_size = (w, h)
-        except Exception as e:
-            print(f"[IMG] Image size detection failed, fallback to 450x810 map: {e}")
-
-        # 依縣市聚合：取該縣市所有鄉鎮的 min/max 匯總
-        from core import codes as _codes
-        counties = list(_codes.COUNTY_NAME_TO_CODE.keys())
-
-        for county in counties:
-            # 該縣市的所有鄉鎮名（完整名稱）
-            town_names = [t for t in _codes.TOWNSHIP_NAME_TO_CODE.keys() if t.startswith(county)]
-            # 轉成像素座標，若缺少則略過
-            town_pixels = [active_px_map.get(t) for t in town_names if active_px_map.get(t)]
-            if not town_pixels:
-                print(f"[IMG] Skip county (no pixels): {county}")
-                image_metrics[county] = {
-                    "qpf12_max_mm_per_hr": None,
-                    "qpf12_min_mm_per_hr": None,
-                    "qpf6_max_mm_per_hr": None,
-                    "qpf6_min_mm_per_hr": None,
-                    "daily_rain": None,
-                    "nowcast": [],
-                    "aqi_level": None,
-                }
-                continue
-
-            # POP12/POP6（CWA 圖）：聚合鄉鎮 min/max
-            print(f"[IMG] County start: {county} towns_with_pixels={len(town_pixels)}")
-            pop12_min = None; pop12_max = None
-            if pop12_url:
-                print(f"[IMG] {county} POP12 analyzing @ {pop12_url}")
-                # Debug: 存圖與位置
-                if getattr(config, 'DEBUG_SAVE_SAMPLES', False):
-                    from server import config as _cfg
-                    if getattr(_cfg, 'DEBUG_SAVE_PER_TOWNSHIP', False):
-                        for tname, xy in zip(town_names, town_pixels):
-                            out_path = os.path.join(_cfg.DEBUG_SAVE_DIR, f"{tname}_POP12.png")
-                            await asyncio.to_thread(image_analyzer.save_overlay, pop12_url, [xy], 12, out_path)
-                    else:
-                        out_path = os.path.join(_cfg.DEBUG_SAVE_DIR, f"{county}_POP12.png")
-                        await asyncio.to_thread(image_analyzer.save_overlay, pop12_url, town_pixels, 12, out_path)
-                for xy in town_pixels:
-                    r = await asyncio.to_thread(image_analyzer.analyze_qpf_from_image, pop12_url, xy)
-                    if r:
-                        pop12_min = r["min"] if pop12_min is None else min(pop12_min, r["min"])
-                        pop12_max = r["max"] if pop12_max is None else max(pop12_max, r["max"])
-
-            pop6_min = None; pop6_max = None
-            if pop6_url:
-                print(f"[IMG] {county} POP6 analyzing @ {pop6_url}")
-                if getattr(config, 'DEBUG_SAVE_SAMPLES', False):
-                    from server import config as _cfg
-                    if getattr(_cfg, 'DEBUG_SAVE_PER_TOWNSHIP', False):
-                        for tname, xy in zip(town_names, town_pixels):
-                            out_path = os.path.join(_cfg.DEBUG_SAVE_DIR, f"{tname}_POP6.png")
-                            await asyncio.to_thread(image_analyzer.save_overlay, pop6_url, [xy], 12, out_path)
-                    else:
-                        out_path = os.path.join(_cfg.DEBUG_SAVE_DIR, f"{county}_POP6.png")
-                        await asyncio.to_thread(image_analyzer.save_overlay, pop6_url, town_pixels, 12, out_path)
-                for xy in town_pixels:
-                    r = await asyncio.to_thread(image_analyzer.analyze_qpf_from_image, pop6_url, xy)
-                    if r:
-                        pop6_min = r["min"] if pop6_min is None else min(pop6_min, r["min"])
-                        pop6_max = r["max"] if pop6_max is None else max(pop6_max, r["max"])
-
-            # 每日單張（NCDR）：聚合鄉鎮 min/max
-            daily_rain_data = None
-            if daily_rain_url:
-                print(f"[IMG] {county} Daily rain analyzing @ {daily_rain_url}")
-                
-                # --- MODIFIED: Unconditionally save overlay image ---
-                output_dir = "analyzed_images"
-                out_path = os.path.join(output_dir, f"{county}_daily_analyzed.png")
-                print(f"[IMG] Saving overlay for {county} to {out_path}")
-                await asyncio.to_thread(image_analyzer.save_overlay, daily_rain_url, town_pixels, 12, out_path)
-                # --- END MODIFICATION ---
-
-                daily_min = None; daily_max = None
-                for xy in town_pixels:
-                    r = await asyncio.to_thread(image_analyzer.analyze_ncdr_rain_from_image, daily_rain_url, xy)
-                    if r:
-                        daily_min = r["min"] if daily_min is None else min(daily_min, r["min"])
-                        daily_max = r["max"] if daily_max is None else max(daily_max, r["max"])
-                if daily_min is not None and daily_max is not None:
-                    daily_rain_data = {"min": daily_min, "max": daily_max}
-
-            # 12 張 Nowcast：對每張做一次聚合
-            nowcast_data = []
-            if nowcast_base_url:
-                base_url = nowcast_base_url.rsplit('_', 1)[0]
-                nowcast_urls = [f"{base_url}_f{h:02d}h.gif" for h in range(1, 13)]
-                print(f"[IMG] {county} Nowcast analyzing ({len(nowcast_urls)} frames) base={base_url}")
-                if getattr(config, 'DEBUG_SAVE_SAMPLES', False) and nowcast_urls:
-                    # --- MODIFIED: Use the correct pixel map for nowcast images (assumed to be 315x642) and fix looping bug ---
-                    nowcast_px_map = px_315_642
-                    nowcast_town_pixels = [nowcast_px_map.get(t) for t in town_names if nowcast_px_map.get(t)]
-                    town_name_to_pixel = {name: nowcast_px_map.get(name) for name in town_names}
-
-                    from server import config as _cfg
-                    if getattr(_cfg, 'DEBUG_SAVE_PER_TOWNSHIP', False):
-                        # Save samples for the first two nowcast frames
-                        for idx in [0, 1]:
-                            url = nowcast_urls[idx]
-                            for tname in town_names:
-                                xy = town_name_to_pixel.get(tname)
-                                if xy:
-                                    out_path = os.path.join(_cfg.DEBUG_SAVE_DIR, f"{tname}_NOWCAST_f{idx+1:02d}.png")
-                                    await asyncio.to_thread(image_analyzer.save_overlay, url, [xy], 12, out_path)
-                    else:
-                        out_path = os.path.join(_cfg.DEBUG_SAVE_DIR, f"{county}_NOWCAST_f01.png")
-                        await asyncio.to_thread(image_analyzer.save_overlay, nowcast_urls[0], nowcast_town_pixels, 12, out_path)
-                    # --- END MODIFICATION ---
-                for url in nowcast_urls:
-                    frame_min = None; frame_max = None
-                    for xy in town_pixels:
-                        r = await asyncio.to_thread(image_analyzer.analyze_ncdr_rain_from_image, url, xy)
-                        if r:
-                            frame_min = r["min"] if frame_min is None else min(frame_min, r["min"])
-                            frame_max = r["max"] if frame_max is None else max(frame_max, r["max"])
-                    if frame_min is None or frame_max is None:
-                        nowcast_data.append({"min": 0.0, "max": 0.0})
-                    else:
-                        nowcast_data.append({"min": frame_min, "max": frame_max})
-
-            # AQI 仍以縣市代表點取色（簡化）。如需同樣聚合可以改成所有鄉鎮再聚合
-            aqi_level = None
-            if aqi_url and town_pixels:
-                # 取第一個像素點為代表
-                x, y = town_pixels[0]
-                box_size = 10
-                sample_box = (x - box_size // 2, y - box_size // 2, x + box_size // 2, y + box_size // 2)
-                aqi_level = await asyncio.to_thread(image_analyzer.analyze_aqi_from_image, aqi_url, sample_box)
-
-            image_metrics[county] = {
-                "qpf12_max_mm_per_hr": pop12_max,
-                "qpf12_min_mm_per_hr": pop12_min,
-                "qpf6_max_mm_per_hr": pop6_max,
-                "qpf6_min_mm_per_hr": pop6_min,
-                "daily_rain": daily_rain_data,
-                "nowcast": nowcast_data,
-                "aqi_level": aqi_level,
-            }
-        
-        CACHED_IMAGE_METRICS.clear()
-        CACHED_IMAGE_METRICS.update(image_metrics)
-        
-        print(f"Image analysis complete. Metrics cached for {len(image_metrics)} counties.")
-
-    except Exception as e:
-        print(f"Error analyzing images: {e}")
+        city, township = config.CWA_PROBE_TOWNSHIP
+        probe_location = cwa_townships['township_weather'].get(codes.normalize_name(city + township))
+        SOURCE_STATE['cwa_county'] = _cwa_fingerprint((county_data or {}).get('records'))
+        SOURCE_STATE['cwa_townships'] = _cwa_fingerprint(_probe_element(probe_location))
 
-    if CACHED_CWA_TOWNSHIP_DATA:
+    if township_metrics is not None and products:
+        CACHED_TOWNSHIP_METRICS = CACHED_TOWNSHIP_METRICS.merge_products(township_metrics, list(products))
+        CACHED_IMAGE_METRICS.clear()
+        CACHED_IMAGE_METRICS.update(CACHED_TOWNSHIP_METRICS.county_records())
+        SOURCE_STATE.update({p: image_urls[p] for p in products})
+        print(f"Image analysis complete. Metrics cached for {int(CACHED_TOWNSHIP_METRICS.arrays['sampled'].sum())} townships in {len(CACHED_IMAGE_METRICS)} counties.")
+    if rasters:
+        CACHED_RASTERS = {**CACHED_RASTERS, **rasters}
+
+    if not CACHED_CWA_TOWNSHIP_DATA:
+        raise RuntimeError("CWA data fetching failed and no previous forecast is cached")
+    if cwa_townships is not None:
         print("Scheduled job finished. CWA data has been cached.")
-        CACHED_FINAL_JSON = json_generator.generate_json_output()
-        print(f"Debug: township_weather map contains {len(CACHED_WEATHER_DATA.get('township_weather') or {})} entries.")
-        
-        if CACHED_WEATHER_DATA['township_weather']:
-            print("Proceeding to generate and upload unified JSON file.")
-            unified_data = json_generator.generate_unified_json()
-        
-            if unified_data:
-                temp_dir = os.path.join(os.path.dirname(__file__), '..', 'temp')
-                os.makedirs(temp_dir, exist_ok=True)
-                local_file_path = os.path.join(temp_dir, "all_forecasts.txt")
-                destination_blob_name = f"forecasts/all_forecasts_{datetime.datetime.now().strftime('%Y%m%d%H%M')}.txt"
-
-                try:
-                    with open(local_file_path, 'w', encoding='utf-8') as f:
-                        json.dump(unified_data, f, ensure_ascii=False, indent=4)
-                    print(f"Successfully saved unified data to {local_file_path}")
-
-                    if os.getenv('FIREBASE_STORAGE_BUCKET'):
-                        upload_url = firebase_uploader.upload_file_to_storage(local_file_path, destination_blob_name)
-                        if upload_url:
-                            print("Firebase upload successful.")
-                        else:
-                            print("Firebase upload failed.")
-                    else:
-                        print("Warning: FIREBASE_STORAGE_BUCKET env var not set. Skipping Firebase upload.")
-
-                except Exception as e:
-                    print(f"Error during file generation or upload: {e}")
-                finally:
-                    if os.path.exists(local_file_path):
-                        os.remove(local_file_path)
-                        print(f"Cleaned up temporary file: {local_file_path}")
-            else:
-                print("Unified JSON generation failed, skipping file creation and upload.")
+    _publish_snapshot()
+    return SNAPSHOT_STATE['version']
 
-        await check_and_send_notifications()
+def _cwa_fingerprint(data):
+    """
+    Content hash used to tell whether CWA has issued a new forecast: of the county forecast
+    records (F-C0032-001), or of the probe element standing in for the township datasets
+    (F-D0047-*), which are issued together.
+    """
+    if not data:
+        return None
+    body = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+async def _stage_unified_upload(snapshot_version):
+    """
+    Builds the unified JSON and hands it to the background publisher; returns without waiting
+    for Storage, so notifications are not held up by the upload.
+    """
+    global CACHED_FINAL_JSON
+    print(f"Debug: township_weather map contains {len(CACHED_WEATHER_DATA.get('township_weather') or {})} entries.")
+    if CACHED_WEATHER_DATA['township_weather']:
+        unified_data = await asyncio.to_thread(json_generator.generate_unified_json)
+        CACHED_FINAL_JSON = unified_data
+
+        if not unified_data:
+            print("Unified JSON generation failed, skipping upload.")
+        elif firebase_uploader.storage_configured():
+            snapshot_publisher.submit(unified_data, snapshot_version)
+        else:
+            print("Warning: FIREBASE_STORAGE_BUCKET env var not set. Skipping Firebase upload.")
+
+async def _stage_notify(snapshot_version):
+    await check_and_send_notifications()
+
+def _build_fetch_pipeline():
+    Stage = pipeline.Stage
+    return pipeline.Pipeline([
+        # CWA branch
+        Stage('cwa_county', _stage_cwa_county, outputs=['county_data']),
+        Stage('cwa_townships', _stage_cwa_townships, outputs=['cwa_townships']),
+        Stage('county_weather', _stage_county_weather, inputs=['county_data'], outputs=['county_weather']),
+        # Image branch
+        Stage('image_urls', _stage_image_urls, outputs=['image_urls']),
+        Stage('pixel_maps', _stage_pixel_maps, inputs=['image_urls'], outputs=['pixel_maps']),
+        Stage('rasters', _stage_rasters, inputs=['image_urls'], outputs=['rasters']),
+        Stage('township_metrics', _stage_township_metrics, inputs=['image_urls', 'pixel_maps'], outputs=['township_metrics']),
+        # Join
+        Stage('publish', _stage_publish,
+              optional_inputs=['county_data', 'county_weather', 'cwa_townships', 'image_urls', 'township_metrics', 'rasters'],
+              outputs=['snapshot_version']),
+        Stage('unified_upload', _stage_unified_upload, inputs=['snapshot_version']),
+        Stage('notify', _stage_notify, inputs=['snapshot_version']),
+    ])
+
+FETCH_PIPELINE = _build_fetch_pipeline()
+
+# --- Per-product refresh jobs ---
+
+def _instrumented_refresh(func):
+    """Record duration and outcome (changed / unchanged / failed) of a refresh job."""
+    @functools.wraps(func)
+    async def wrapper(*args):
+        job = ':'.join([func.__name__, *map(str, args)])
+        started = time.perf_counter()
+        outcome = 'failed'
+        try:
+            changed = await func(*args)
+            outcome = 'changed' if changed else 'unchanged'
+            return changed
+        finally:
+            instrumentation.STAGE_DURATION.observe(time.perf_counter() - started, stage=job, status=outcome)
+            instrumentation.PIPELINE_RUNS.inc(job=job, result=outcome)
+    return wrapper
+
+@_instrumented_refresh
+async def refresh_cwa_job():
+    """
+    Fetch the county forecast and the township probe (two small requests) and publish only if
+    either changed since the last publish. The 22 township datasets are re-fetched only when the
+    probe changed; a county-only update reuses the cached township forecasts.
+    """
+    county_data, probe = await asyncio.gather(_stage_cwa_county(), _stage_cwa_probe())
+    county_fingerprint, township_fingerprint = _cwa_fingerprint((county_data or {}).get('records')), _cwa_fingerprint(probe)
+    if county_fingerprint is None or township_fingerprint is None:
+        print("[REFRESH] cwa probe failed, skipping")
+        return False
+    townships_changed = township_fingerprint != SOURCE_STATE.get('cwa_townships')
+    if not townships_changed and county_fingerprint == SOURCE_STATE.get('cwa_county'):
+        print("[REFRESH] cwa unchanged, skipping")
+        return False
+    if townships_changed or not CACHED_TOWNSHIP_MAP:
+        cwa_townships = await _stage_cwa_townships()
     else:
-        print("Scheduled job finished. CWA data fetching failed.")
+        cwa_townships = {'township_weather': CACHED_TOWNSHIP_MAP, 'all_township_data': CACHED_CWA_TOWNSHIP_DATA}
+    county_weather = await _stage_county_weather(county_data)
+    _commit_and_publish(county_data, county_weather, cwa_townships)
+    print("[REFRESH] cwa updated")
+    await _stage_unified_upload(SNAPSHOT_STATE['version'])
+    await _stage_notify(SNAPSHOT_STATE['version'])
+    return True
+
+@_instrumented_refresh
+async def refresh_image_products_job(slice_name: str):
+    """
+    Probe the latest URL of each product in the slice and re-analyze only the products whose
+    issue (URL) changed since the last publish.
+    """
+    products = IMAGE_PRODUCT_SLICES[slice_name]
+    image_urls = await _resolve_image_urls(products)
+    changed = [p for p in products if image_urls[p] and image_urls[p] != SOURCE_STATE.get(p)]
+    if not changed:
+        print(f"[REFRESH] {slice_name} unchanged, skipping")
+        return False
+    image_urls = {**image_urls, **{p: None for p in IMAGE_PRODUCTS if p not in changed}}
+    if 'nowcast' not in changed:
+        image_urls['nowcast_frames'] = []
+    pixel_maps = PIXEL_MAPS or await _stage_pixel_maps(image_urls)
+    township_metrics, rasters = await asyncio.gather(
+        _stage_township_metrics(image_urls, pixel_maps),
+        _stage_rasters(image_urls),
+    )
+    _commit_and_publish(image_urls=image_urls, products=changed, township_metrics=township_metrics, rasters=rasters)
+    print(f"[REFRESH] {slice_name} updated: {', '.join(changed)}")
+    await _stage_unified_upload(SNAPSHOT_STATE['version'])
+    await _stage_notify(SNAPSHOT_STATE['version'])
+    return True
+
+async def _classify_rasters(sources):
+    """{product: (color_map, [image urls])} -> {product: raster set}; products without urls are left out."""
+    async def classify(url, color_map):
+        try:
+            # 與取樣共用同一個 semaphore，逐格分類的下載與解碼不會無上限地佔用執行緒
+            async with _image_semaphore():
+                return await asyncio.to_thread(image_analyzer.classify_image_url, url, color_map)
+        except Exception as e:
+            print(f"[IMG] Failed to classify {url}: {e}")
+            return None
+
+    rasters = {}
+    for product, (color_map, urls) in sources.items():
+        if not urls:
+            continue
+        frames = await asyncio.gather(*(classify(url, color_map) for url in urls))
+        rasters[product] = class_rasters.make_raster_set(color_map, list(frames))
+        print(f"[IMG] Classified {product}: {sum(f is not None for f in frames)}/{len(frames)} frames")
+    return rasters
+
+def _publish_snapshot():
+    """
+    Mark the freshly computed caches as the current snapshot and persist them for warm starts.
+    Only the in-memory swap happens here; the file, the history row and the subscriber delta are
+    computed on the snapshot writer thread.
+    """
+    SNAPSHOT_STATE.update({
+        'version': SNAPSHOT_STATE['version'] + 1,
+        'created_at': time.time(),
+        'source': 'run',
+    })
+    CACHED_WEATHER_DATA['stale'] = False
+    _write_in_background(snapshot_store.save_snapshot, config.SNAPSHOT_PATH, {
+        'version': SNAPSHOT_STATE['version'],
+        'created_at': SNAPSHOT_STATE['created_at'],
+        'update_time': CACHED_WEATHER_DATA.get('update_time'),
+        'county_weather': CACHED_WEATHER_DATA.get('county_weather') or {},
+        'township_weather': CACHED_WEATHER_DATA.get('township_weather') or {},
+        'products': CACHED_TOWNSHIP_METRICS.products,
+        'arrays': CACHED_TOWNSHIP_METRICS.arrays,
+        'rasters': CACHED_RASTERS,
+        'sources': dict(SOURCE_STATE),
+    })
+    _write_in_background(history_store.append_run, config.HISTORY_DB_PATH, SNAPSHOT_STATE['created_at'],
+                         SNAPSHOT_STATE['version'], CACHED_TOWNSHIP_METRICS)
+    _write_in_background(_prepare_event, asyncio.get_running_loop(), SNAPSHOT_STATE['version'],
+                         CACHED_WEATHER_DATA.get('update_time'), _current_sources())
+    instrumentation.SNAPSHOT_VERSION.set(SNAPSHOT_STATE['version'])
+    print(f"[SNAPSHOT] Published snapshot version {SNAPSHOT_STATE['version']}")
+
+def _write_in_background(func, *args):
+    """Run a blocking write on the snapshot writer thread, after every write submitted before it."""
+    _SNAPSHOT_WRITER.submit(func, *args).add_done_callback(_log_write_failure)
+
+def _log_write_failure(future):
+    if future.exception() is not None:
+        print(f"[SNAPSHOT] Background write failed: {future.exception()}")
+
+def _prepare_event(loop, version, update_time, sources):
+    # 在 writer 執行緒組出所有鄉鎮紀錄並計算差異；推送給訂閱者必須回到 event loop
+    event = broadcaster.prepare(version, update_time, dict(json_generator.iter_township_records(*sources)))
+    loop.call_soon_threadsafe(broadcaster.notify, event)
+
+def _current_sources():
+    """The cache objects the unified records are built from, captured together."""
+    return (
+        CACHED_WEATHER_DATA.get('county_weather') or {},
+        CACHED_WEATHER_DATA.get('township_weather') or {},
+        CACHED_TOWNSHIP_METRICS,
+    )
+
+def _current_township_records():
+    """{township_code: unified-JSON record} for the data currently cached."""
+    return dict(json_generator.iter_township_records(*_current_sources()))
+
+def load_snapshot_from_disk() -> bool:
+    """
+    Warm start: load the last persisted snapshot (if recent enough) and serve it marked as stale
+    until the next fetch_data_job run replaces it.
+    """
+    doc = _read_snapshot_file()
+    if not doc:
+        return False
+    _apply_snapshot(doc, stale=True, source='disk')
+    broadcaster.set_baseline(_current_township_records())
+    print(f"[SNAPSHOT] Loaded stale snapshot version {SNAPSHOT_STATE['version']} from {config.SNAPSHOT_PATH}")
+    return True
+
+async def seed_version_from_storage() -> None:
+    """
+    First run of the leader: continue numbering after the manifest already in Storage, so a
+    restart (or a snapshot file too old to load) never publishes versions clients have already
+    seen. Runs at the start of fetch_data_job, before its first publish.
+    """
+    global VERSION_SEEDED
+    if not firebase_uploader.storage_configured():
+        VERSION_SEEDED = True
+        return
+    try:
+        remote = await asyncio.to_thread(snapshot_publisher.remote_version)
+    except Exception as e:
+        # 讀不到就在下一次完整執行時再試
+        print(f"[SNAPSHOT] Could not read the published manifest version: {e}")
+        return
+    VERSION_SEEDED = True
+    if remote > SNAPSHOT_STATE['version']:
+        SNAPSHOT_STATE['version'] = remote
+        print(f"[SNAPSHOT] Continuing after published manifest version {remote}")
+
+def read_newer_snapshot(last_mtime_ns):
+    """
+    Follower workers, run in a worker thread: (mtime_ns, snapshot document) if the snapshot file
+    changed since `last_mtime_ns`, else None. Only stats and decodes the file; the caller hands the
+    document to adopt_snapshot on the event loop. The mtime check makes the common "nothing new"
+    case a single stat() call.
+    """
+    try:
+        mtime_ns = os.stat(config.SNAPSHOT_PATH).st_mtime_ns
+    except OSError:
+        return None
+    if mtime_ns == last_mtime_ns:
+        return None
+    return mtime_ns, snapshot_store.load_snapshot(config.SNAPSHOT_PATH, config.SNAPSHOT_MAX_AGE_HOURS * 3600)
+
+def adopt_snapshot(mtime_ns, doc) -> bool:
+    """
+    Follower workers, on the event loop: adopt a snapshot read by read_newer_snapshot if the leader
+    published it after the one we are serving.
+    """
+    SNAPSHOT_FILE_STATE['mtime_ns'] = mtime_ns
+    if not doc or (doc.get('created_at') or 0) <= (SNAPSHOT_STATE['created_at'] or 0):
+        return False
+    _apply_snapshot(doc, stale=False, source='leader')
+    broadcaster.publish(SNAPSHOT_STATE['version'], CACHED_WEATHER_DATA.get('update_time'), _current_township_records())
+    print(f"[SNAPSHOT] Adopted snapshot version {SNAPSHOT_STATE['version']} published by the leader")
+    return True
+
+def _read_snapshot_file():
+    try:
+        SNAPSHOT_FILE_STATE['mtime_ns'] = os.stat(config.SNAPSHOT_PATH).st_mtime_ns
+    except OSError:
+        return None
+    return snapshot_store.load_snapshot(config.SNAPSHOT_PATH, config.SNAPSHOT_MAX_AGE_HOURS * 3600)
+
+def _apply_snapshot(doc, stale: bool, source: str):
+    """Replace the in-memory caches with a snapshot document read from disk."""
+    global CACHED_CWA_TOWNSHIP_DATA, CACHED_TOWNSHIP_MAP, CACHED_TOWNSHIP_METRICS, CACHED_RASTERS
+    township_weather = doc.get('township_weather') or {}
+    CACHED_TOWNSHIP_METRICS = TownshipMetrics(doc.get('arrays'), doc.get('products'))
+    CACHED_RASTERS = doc.get('rasters') or {}
+    SOURCE_STATE.clear()
+    SOURCE_STATE.update(doc.get('sources') or {})
+    CACHED_TOWNSHIP_MAP = township_weather
+    CACHED_CWA_TOWNSHIP_DATA = {'records': {'location': list(township_weather.values())}}
+    CACHED_WEATHER_DATA.update({
+        'county_weather': doc.get('county_weather') or {},
+        'township_weather': township_weather,
+        'update_time': doc.get('update_time'),
+        'stale': stale,
+    })
+    CACHED_IMAGE_METRICS.clear()
+    CACHED_IMAGE_METRICS.update(CACHED_TOWNSHIP_METRICS.county_records())
+    SNAPSHOT_STATE.update({
+        'version': doc.get('version') or 0,
+        'created_at': doc.get('created_at'),
+        'source': source,
+    })
+    instrumentation.SNAPSHOT_VERSION.set(SNAPSHOT_STATE['version'])
+
+def is_snapshot_expired() -> bool:
+    """A stale (disk-loaded) snapshot is refused once it exceeds SNAPSHOT_MAX_AGE_HOURS."""
+    if not CACHED_WEATHER_DATA.get('stale') or not SNAPSHOT_STATE['created_at']:
+        return False
+    return time.time() - SNAPSHOT_STATE['created_at'] > config.SNAPSHOT_MAX_AGE_HOURS * 3600
 
 async def check_and_send_notifications():
     """
-    Checks for notification conditions based on the cached CWA data.
+    Evaluates config.ALERT_RULES over every township of the current snapshot and pushes each new
+    firing to the township's FCM topic (weather_<township_code>) through the batched sender,
+    plus one summary to Discord.
     """
-    print("Checking for notification conditions...")
-    user_township = "臺北市中正區"
-    user_device_token = "DEVICE_TOKEN_HERE" 
-
-    forecast = calculation.get_forecast_for_township(user_township, CACHED_TOWNSHIP_MAP)
-
-    if forecast and forecast.get("chance_of_rain_12h"):
-        pop_value_str = forecast["chance_of_rain_12h"]
-        if pop_value_str and pop_value_str.isdigit():
-            pop_value = int(pop_value_str)
-            if pop_value > 50:
-                message = f"Weather Alert for {user_township}: Chance of rain is {pop_value}% in the next 12 hours."
-                print(message)
-                
-                discord_sender.send_to_discord(message)
+    metrics = CACHED_TOWNSHIP_METRICS
+    records = await asyncio.to_thread(json_generator.get_unified_records)
+    if not records:
+        print("[ALERT] No township records available, skipping alert rules.")
+        return
+    firings = ALERT_ENGINE.evaluate(metrics, records)
+    evaluation = ALERT_ENGINE.last_evaluation
+    selected = ALERT_ENGINE.select(firings)
+    print(f"[ALERT] {len(ALERT_ENGINE.rules)} rules over {evaluation['townships']} townships in "
+          f"{evaluation['total_ms']:.1f} ms: {len(firings)} firings, {len(selected)} new")
+    if not selected:
+        return
 
-# Schedule the data fetching job to run twice daily at 06:00 and 12:00
-scheduler.add_job(fetch_data_job, 'cron', hour='6,12', minute=20)
+    messages = [
+        fcm_sender.topic_message(firing["title"], firing["body"], firing["topic"], {
+            "rule": firing["rule"], "township_code": firing["township_code"], "value": f"{firing['value']:g}",
+        })
+        for firing in selected
+    ]
+    report = await fcm_sender.batch_sender.send(messages)
+    # 只有確實送達的推播才開始冷卻；失敗的在下次評估時重送
+    ALERT_ENGINE.mark_sent([selected[i] for i in report["delivered"]])
+    print(f"[ALERT] Sent {report['sent']}/{len(messages)} notifications in {report['calls']} FCM calls "
+          f"({report['seconds']:.2f}s)")
+    by_rule = {}
+    for firing in selected:
+        by_rule[firing["rule"]] = by_rule.get(firing["rule"], 0) + 1
+    summary = ", ".join(f"{rule} {count}" for rule, count in by_rule.items())
+    discord_queue.enqueue(f"Weather alerts: {report['sent']}/{len(selected)} township notifications sent ({summary}).")
+
+# 各資料切片依自己的更新頻率排程；完整的 fetch_data_job 只在啟動時執行
+_REFRESH_JOBS = {
+    'cwa': (refresh_cwa_job, ()),
+    'qpf': (refresh_image_products_job, ('qpf',)),
+    'nowcast': (refresh_image_products_job, ('nowcast',)),
+    'aqi': (refresh_image_products_job, ('aqi',)),
+}
+
+# 所有執行（啟動時的完整管線、排程、手動觸發）都經由 RUN_COORDINATOR：
+# 同一資料切片同時只有一個 run，執行中收到的請求合併成一次後續執行
+RUN_COORDINATOR = RunCoordinator()
+RUN_COORDINATOR.register(RunSpec('full', fetch_data_job, products=_REFRESH_JOBS, deadline=config.RUN_DEADLINES['full']))
+for _name, (_func, _args) in _REFRESH_JOBS.items():
+    RUN_COORDINATOR.register(RunSpec(_name, _func, _args, products=[_name], deadline=config.RUN_DEADLINES[_name]))
+
+REFRESH_TRIGGERS = {name: CronTrigger(**config.PRODUCT_REFRESH_SCHEDULES[name]) for name in _REFRESH_JOBS}
+for _name in _REFRESH_JOBS:
+    scheduler.add_job(RUN_COORDINATOR.request, REFRESH_TRIGGERS[_name], args=(_name,), id=f"refresh_{_name}",
+                      max_instances=1, coalesce=True, misfire_grace_time=300)
+
+def next_scheduled_run(now: datetime.datetime = None) -> datetime.datetime:
+    """Local (naive) time of the next run of any refresh job."""
+    now = now or datetime.datetime.now()
+    candidates = []
+    for trigger in REFRESH_TRIGGERS.values():
+        fire = trigger.get_next_fire_time(None, now.astimezone(trigger.timezone))
+        if fire:
+            candidates.append(fire.astimezone().replace(tzinfo=None))
+    return min(candidates) if candidates else now + datetime.timedelta(hours=1)
+
+def snapshot_key():
+    """Identifies the data currently being served; changes whenever any cache is replaced."""
+    return (SNAPSHOT_STATE['version'], CACHED_WEATHER_DATA.get('update_time'), CACHED_WEATHER_DATA.get('stale'))
 
 # Trigger reload to regenerate sample images.
 def get_cached_weather_data():
+    if is_snapshot_expired():
+        return {}
     return CACHED_WEATHER_DATA
 
 def get_county_weather(county_name: str):
@@ -414,5 +863,8 @@ def get_qpf_data(county_name: str):
 def get_aqi_data(county_name: str):
     return CACHED_WEATHER_DATA['aqi_data'].get(county_name)
 
+def get_township_image_metrics(township_name: str):
+    return CACHED_TOWNSHIP_METRICS.township_record(codes.lookup_township(township_name) or codes.normalize_name(township_name))
+
 def get_last_update_time():
     return CACHED_WEATHER_DATA['update_time']
\ No newline at end of file
@@ -0,0 +1,112 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+
+class StageSkipped(Exception):
+    """Raised for a stage whose required inputs were not produced."""
+
+
+class Stage:
+    """
+    One named step of a pipeline.
+
+    `func` receives its inputs as keyword arguments and returns the value of its single output,
+    or a dict keyed by output name when it declares several. `optional_inputs` are awaited
+    like `inputs` but arrive as None when their producer failed, so the stage still runs.
+    """
+
+    def __init__(self, name: str, func: Callable[..., Awaitable[Any]], inputs: Sequence[str] = (),
+                 outputs: Sequence[str] = (), optional_inputs: Sequence[str] = (), timeout: Optional[float] = None):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.optional_inputs = tuple(optional_inputs)
+        self.outputs = tuple(outputs)
+        self.timeout = timeout
+
+
+class Pipeline:
+    """
+    A DAG of stages wired by output names. `run` starts every stage at once; each waits only
+    for the producers of its own inputs, so independent branches overlap and a failure in
+    one branch only skips the stages that depend on it.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+        self._producers: Dict[str, Stage] = {}
+        for stage in stages:
+            for output in stage.outputs:
+                if output in self._producers:
+                    raise ValueError(f"Output '{output}' is produced by both {self._producers[output].name} and {stage.name}")
+                self._producers[output] = stage
+        for stage in stages:
+            for name in stage.inputs + stage.optional_inputs:
+                if name not in self._producers:
+                    raise ValueError(f"Stage {stage.name} needs '{name}', which no stage produces")
+
+    async def run(self, default_timeout: Optional[float] = None, timeouts: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """
+        Execute the pipeline. Returns {"outputs": {name: value}, "report": [per-stage dict]} where
+        each report entry has name, status (ok / failed / timeout / skipped), start and duration
+        in seconds relative to the start of the run, and the error message if any.
+        """
+        timeouts = timeouts or {}
+        started = time.perf_counter()
+        outputs: Dict[str, Any] = {}
+        report: Dict[str, Dict[str, Any]] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_stage(stage: Stage) -> None:
+            entry = {"name": stage.name, "status": "skipped", "start": None, "duration": None, "error": None}
+            report[stage.name] = entry
+            producers = {self._producers[name].name for name in stage.inputs + stage.optional_inputs}
+            await asyncio.gather(*(tasks[p] for p in producers), return_exceptions=True)
+            missing = [name for name in stage.inputs if name not in outputs]
+            if missing:
+                entry["error"] = f"missing inputs: {', '.join(missing)}"
+                raise StageSkipped(stage.name)
+
+            kwargs = {name: outputs[name] for name in stage.inputs}
+            kwargs.update({name: outputs.get(name) for name in stage.optional_inputs})
+            timeout = timeouts.get(stage.name, stage.timeout or default_timeout)
+            t0 = time.perf_counter()
+            entry["start"] = round(t0 - started, 3)
+            try:
+                result = await asyncio.wait_for(stage.func(**kwargs), timeout=timeout)
+            except asyncio.TimeoutError:
+                entry.update(status="timeout", error=f"exceeded {timeout}s")
+                raise
+            except Exception as e:
+                entry.update(status="failed", error=f"{type(e).__name__}: {e}")
+                raise
+            finally:
+                entry["duration"] = round(time.perf_counter() - t0, 3)
+
+            if len(stage.outputs) == 1:
+                outputs[stage.outputs[0]] = result
+            elif stage.outputs:
+                for name in stage.outputs:
+                    outputs[name] = result[name]
+            entry["status"] = "ok"
+
+        for stage in self.stages:
+            tasks[stage.name] = asyncio.ensure_future(run_stage(stage))
+        # 先全部建立再開始等待，所以 run_stage 內查 tasks 時一定找得到生產者
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        return {
+            "outputs": outputs,
+            "report": [report[stage.name] for stage in self.stages],
+            "duration": round(time.perf_counter() - started, 3),
+        }
+
+
+def format_report(report: List[Dict[str, Any]]) -> str:
+    """Human-readable timing table for the log."""
+    lines = [f"{'stage':<16} {'status':<8} {'start':>8} {'duration':>9}  error"]
+    for entry in report:
+        start = "-" if entry["start"] is None else f"{entry['start']:.2f}s"
+        duration = "-" if entry["duration"] is None else f"{entry['duration']:.2f}s"
+        lines.append(f"{entry['name']:<16} {entry['status']:<8} {start:>8} {duration:>9}  {entry['error'] or ''}")
+    return "\n".join(lines)
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+
+
+class RunSpec:
+    """A named run: the coroutine function to call, the products it writes, and its deadline."""
+
+    def __init__(self, name: str, func: Callable[..., Awaitable[Any]], args: Sequence[Any] = (),
+                 products: Sequence[str] = (), deadline: Optional[float] = None):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.products = frozenset(products)
+        self.deadline = deadline
+
+
+class RunCoordinator:
+    """
+    Serializes pipeline runs.
+
+    Two runs never execute at the same time if their product sets overlap, and each run name
+    has at most one active run. A request that arrives while its run is active (or blocked by
+    an overlapping one) is remembered as a single pending follow-up: however many requests
+    arrive, the run executes once more after the current one. A run still going past its
+    deadline is cancelled.
+    """
+
+    def __init__(self):
+        self._specs: Dict[str, RunSpec] = {}
+        self._active: Dict[str, asyncio.Task] = {}
+        self._state: Dict[str, Dict[str, Any]] = {}
+
+    def register(self, spec: RunSpec) -> None:
+        self._specs[spec.name] = spec
+        self._state[spec.name] = {
+            "name": spec.name,
+            "products": sorted(spec.products),
+            "deadline": spec.deadline,
+            "running": False,
+            "started_at": None,
+            "pending": False,
+            "requested_at": None,
+            "coalesced": 0,
+            "last": None,
+        }
+
+    def _blocked(self, spec: RunSpec) -> bool:
+        if spec.name in self._active:
+            return True
+        return any(self._specs[name].products & spec.products for name in self._active)
+
+    async def request(self, name: str) -> str:
+        """
+        Ask for a run. Returns "started", or "queued" when the request was folded into the
+        pending follow-up of an active or blocked run. (A coroutine so APScheduler runs it on the loop.)
+        """
+        spec = self._specs[name]
+        state = self._state[name]
+        if self._blocked(spec):
+            if state["pending"]:
+                state["coalesced"] += 1
+            else:
+                state.update(pending=True, requested_at=time.time())
+            return "queued"
+        self._start(spec)
+        return "started"
+
+    def _start(self, spec: RunSpec) -> None:
+        state = self._state[spec.name]
+        state.update(running=True, started_at=time.time(), pending=False, requested_at=None, coalesced=0)
+        t0 = time.perf_counter()
+        task = asyncio.ensure_future(self._execute(spec))
+        self._active[spec.name] = task
+        # 結果記錄放在 done callback：在協程開始前就被取消的 task 也要釋放
+        task.add_done_callback(lambda t: self._finished(spec, t, time.perf_counter() - t0))
+
+    @staticmethod
+    async def _execute(spec: RunSpec) -> None:
+        await asyncio.wait_for(spec.func(*spec.args), timeout=spec.deadline)
+
+    def _finished(self, spec: RunSpec, task: asyncio.Task, duration: float) -> None:
+        if task.cancelled():
+            outcome, error = "cancelled", None
+        elif isinstance(task.exception(), asyncio.TimeoutError):
+            outcome, error = "deadline", f"exceeded {spec.deadline}s"
+        elif task.exception() is not None:
+            outcome, error = "failed", f"{type(task.exception()).__name__}: {task.exception()}"
+        else:
+            outcome, error = "ok", None
+        state = self._state[spec.name]
+        state.update(running=False, last={
+            "started_at": state["started_at"],
+            "duration": round(duration, 3),
+            "outcome": outcome,
+            "error": error,
+        })
+        self._active.pop(spec.name, None)
+        if outcome != "ok":
+            print(f"[RUNS] {spec.name} {outcome} after {duration:.1f}s {error or ''}".rstrip())
+        self._start_pending()
+
+    def _start_pending(self) -> None:
+        # 依請求先後啟動已不再被阻擋的後續執行
+        pending = sorted((s for s in self._state.values() if s["pending"]), key=lambda s: s["requested_at"])
+        for state in pending:
+            spec = self._specs[state["name"]]
+            if not self._blocked(spec):
+                self._start(spec)
+
+    def cancel(self, name: str, force: bool = False) -> bool:
+        """
+        Cancel the active run of `name`. Without `force` only a run past its deadline is
+        cancelled (the deadline normally does this itself; this covers runs whose deadline
+        is None). Returns whether a run was cancelled.
+        """
+        task = self._active.get(name)
+        if task is None:
+            return False
+        state = self._state[name]
+        deadline = self._specs[name].deadline
+        overdue = deadline is not None and time.time() - state["started_at"] > deadline
+        if not (force or overdue):
+            return False
+        task.cancel()
+        return True
+
+    def is_running(self, name: str) -> bool:
+        return name in self._active
+
+    def state(self) -> Dict[str, Dict[str, Any]]:
+        """Snapshot of every run: running / started_at / pending / coalesced / last outcome."""
+        now = time.time()
+        result = {}
+        for name, state in self._state.items():
+            entry = dict(state)
+            entry["elapsed"] = round(now - state["started_at"], 1) if state["running"] else None
+            result[name] = entry
+        return result
+
+    async def shutdown(self) -> None:
+        """Cancel active runs and drop pending follow-ups."""
+        for state in self._state.values():
+            state["pending"] = False
+        tasks = list(self._active.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,198 @@
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Set, Tuple
+
+import config
+from services import discord_sender
+
+
+class DeliveryQueue:
+    """
+    In-process async queue for outbound webhook messages.
+
+    - `enqueue` never blocks: it drops duplicates of a message that is still pending
+      and rejects new work when the queue is full.
+    - A small pool of workers performs the (blocking) sends in threads.
+    - Each webhook has a "not before" time: consecutive sends are spaced by `min_interval`
+      seconds, and a 429 pushes that time out by the server's Retry-After.
+    - Workers never sleep. Messages for a webhook that is not due yet go to that webhook's
+      backlog, which a single drainer task sends in order: it waits once for the webhook's
+      deadline, then sends the next message, so a 429 costs one wait rather than one timer per
+      queued message. Messages for other webhooks keep flowing meanwhile.
+    - Failed sends (other than 429) are retried with exponential backoff via a timer that puts
+      the message back on the queue.
+    """
+
+    def __init__(self, send: Callable[[str, str], dict], default_webhook: Callable[[], str],
+                 workers: int = 2, max_size: int = 1000, min_interval: float = 0.5, max_attempts: int = 3):
+        self._send = send
+        self._default_webhook = default_webhook
+        self._num_workers = workers
+        self._max_size = max_size
+        self._min_interval = min_interval
+        self._max_attempts = max_attempts
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+        self._pending: Set[Tuple[str, str]] = set()
+        self._not_before: Dict[str, float] = {}
+        # webhook -> 等待該 webhook 解除限制後依序送出的訊息，以及負責送出的 drainer
+        self._backlog: Dict[str, Deque[Tuple[Tuple[str, str], int]]] = {}
+        self._drainers: Dict[str, asyncio.Task] = {}
+        # 重試退避中、到期後才放回佇列的訊息
+        self._timers: Set[asyncio.TimerHandle] = set()
+        self._timers_idle: Optional[asyncio.Event] = None
+        self.stats = {"enqueued": 0, "coalesced": 0, "dropped": 0, "sent": 0, "failed": 0, "rate_limited": 0}
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self._max_size)
+        self._timers_idle = asyncio.Event()
+        self._timers_idle.set()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._num_workers)]
+
+    async def stop(self) -> None:
+        tasks = self._workers + list(self._drainers.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        self._workers = []
+        self._queue = None
+        self._pending.clear()
+        self._backlog.clear()
+        self._drainers.clear()
+
+    def enqueue(self, message: str, webhook_url: Optional[str] = None) -> bool:
+        """Schedule a message for delivery; returns False if it was coalesced or dropped."""
+        self.start()
+        key = (webhook_url or self._default_webhook(), message)
+        if key in self._pending:
+            self.stats["coalesced"] += 1
+            return False
+        try:
+            self._queue.put_nowait((key, 1))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            print("[DELIVERY] Queue full, dropping message")
+            return False
+        self._pending.add(key)
+        self.stats["enqueued"] += 1
+        return True
+
+    async def join(self) -> None:
+        """Wait until every queued message has been delivered or given up on."""
+        while self._queue is not None:
+            await self._queue.join()
+            if self._drainers:
+                await asyncio.gather(*self._drainers.values(), return_exceptions=True)
+            elif self._timers:
+                await self._timers_idle.wait()
+            else:
+                return
+
+    def _park(self, key: Tuple[str, str], attempt: int, front: bool = False) -> None:
+        """Add the message to its webhook's backlog and make sure a drainer is sending it."""
+        webhook_url = key[0]
+        backlog = self._backlog.setdefault(webhook_url, deque())
+        if front:
+            backlog.appendleft((key, attempt))
+        else:
+            backlog.append((key, attempt))
+        if webhook_url not in self._drainers:
+            self._drainers[webhook_url] = asyncio.create_task(self._drain(webhook_url))
+
+    async def _drain(self, webhook_url: str) -> None:
+        backlog = self._backlog[webhook_url]
+        try:
+            while backlog:
+                # 整個 webhook 只等一次解除時間，而不是每則訊息各自排計時器
+                wait = self._not_before.get(webhook_url, 0.0) - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                key, attempt = backlog.popleft()
+                try:
+                    await self._send_once(key, attempt)
+                except Exception as e:
+                    print(f"[DELIVERY] Unexpected error: {e}")
+                    self._pending.discard(key)
+        finally:
+            if self._backlog.get(webhook_url) is backlog:
+                del self._backlog[webhook_url]
+            self._drainers.pop(webhook_url, None)
+
+    def _defer(self, key: Tuple[str, str], attempt: int, delay: float) -> None:
+        """Put the message back on the queue after `delay` seconds (retry backoff)."""
+        def requeue():
+            self._timers.discard(timer)
+            if not self._timers:
+                self._timers_idle.set()
+            if self._queue is None:
+                return
+            try:
+                self._queue.put_nowait((key, attempt))
+            except asyncio.QueueFull:
+                self.stats["dropped"] += 1
+                self._pending.discard(key)
+
+        timer = asyncio.get_running_loop().call_later(delay, requeue)
+        self._timers.add(timer)
+        self._timers_idle.clear()
+
+    async def _worker(self) -> None:
+        while True:
+            key, attempt = await self._queue.get()
+            try:
+                await self._deliver(key, attempt)
+            except Exception as e:
+                print(f"[DELIVERY] Unexpected error: {e}")
+                self._pending.discard(key)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, key: Tuple[str, str], attempt: int) -> None:
+        webhook_url = key[0]
+        # 已有積壓（或仍在限制中）的 webhook 交給它的 drainer 依序送出，維持訊息順序
+        if webhook_url in self._backlog or self._not_before.get(webhook_url, 0.0) > time.monotonic():
+            self._park(key, attempt)
+            return
+        await self._send_once(key, attempt)
+
+    async def _send_once(self, key: Tuple[str, str], attempt: int) -> None:
+        webhook_url, message = key
+        # 先佔用這個 webhook 的下一個時段，其他 worker 看到後會延後同一 webhook 的訊息
+        self._not_before[webhook_url] = time.monotonic() + self._min_interval
+        result = await asyncio.to_thread(self._send, message, webhook_url)
+        delay = self._min_interval
+        if result.get("retry_after"):
+            self.stats["rate_limited"] += 1
+            delay = max(delay, result["retry_after"])
+        # 只往後延：同時送出的另一則訊息可能剛收到 429，不能被這次的間隔覆蓋
+        self._not_before[webhook_url] = max(self._not_before.get(webhook_url, 0.0), time.monotonic() + delay)
+
+        if result.get("ok"):
+            self.stats["sent"] += 1
+            self._pending.discard(key)
+        elif result.get("retry_after"):
+            # 429 不計入重試次數；排回積壓最前面，drainer 等到 Retry-After 之後再送
+            self._park(key, attempt, front=True)
+        elif attempt < self._max_attempts:
+            # 其他錯誤最多重試 max_attempts 次，以指數退避
+            self._defer(key, attempt + 1, 2 ** attempt)
+        else:
+            self.stats["failed"] += 1
+            self._pending.discard(key)
+            print(f"[DELIVERY] Giving up on message after {attempt} attempts")
+
+
+discord_queue = DeliveryQueue(
+    send=discord_sender.deliver,
+    default_webhook=lambda: config.DISCORD_WEBHOOK_URL,
+    workers=config.DISCORD_QUEUE_WORKERS,
+    max_size=config.DISCORD_QUEUE_MAX_SIZE,
+    min_interval=config.DISCORD_MIN_INTERVAL_SECONDS,
+)
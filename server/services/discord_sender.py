@@ -1,6 +1,41 @@
 import requests
 import config
 
+def _is_configured(webhook_url: str) -> bool:
+    return bool(webhook_url) and "discord.com" in webhook_url
+
+def deliver(message: str, webhook_url: str = None) -> dict:
+    """
+    Posts one message to a Discord webhook and reports the outcome so callers can retry.
+
+    Returns:
+        {"ok": bool, "status": int | None, "retry_after": float | None}
+        `retry_after` is set (seconds) when Discord answered 429.
+    """
+    webhook_url = webhook_url or config.DISCORD_WEBHOOK_URL
+    if not _is_configured(webhook_url):
+        return {"ok": True, "status": None, "retry_after": None}
+
+    try:
+        response = requests.post(webhook_url, json={"content": message}, timeout=10)
+    except requests.exceptions.RequestException as e:
+        print(f"Error sending message to Discord: {e}")
+        return {"ok": False, "status": None, "retry_after": None}
+
+    if response.status_code == 429:
+        retry_after = response.headers.get("Retry-After")
+        try:
+            retry_after = float(retry_after) if retry_after else float(response.json().get("retry_after", 1))
+        except (ValueError, AttributeError):
+            retry_after = 1.0
+        return {"ok": False, "status": 429, "retry_after": retry_after}
+
+    if response.status_code >= 400:
+        print(f"Error sending message to Discord: HTTP {response.status_code}")
+        return {"ok": False, "status": response.status_code, "retry_after": None}
+
+    return {"ok": True, "status": response.status_code, "retry_after": None}
+
 def send_to_discord(message: str):
     """
     Sends a message to the Discord webhook URL specified in the config.
@@ -8,15 +43,9 @@ def send_to_discord(message: str):
     Args:
         message: The string message to send.
     """
-    if not config.DISCORD_WEBHOOK_URL or "discord.com" not in config.DISCORD_WEBHOOK_URL:
+    if not _is_configured(config.DISCORD_WEBHOOK_URL):
         # print("Discord webhook URL not configured or invalid. Skipping.")
         return
 
-    payload = {"content": message}
-    
-    try:
-        response = requests.post(config.DISCORD_WEBHOOK_URL, json=payload)
-        response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
+    if deliver(message)["ok"]:
         print(f"Successfully sent message to Discord.")
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending message to Discord: {e}")
@@ -0,0 +1,80 @@
+import random
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from firebase_admin import exceptions, messaging
+
+
+class FakeMessaging:
+    """
+    Local stand-in for firebase_admin.messaging (send / send_each), for offline runs and benchmarks.
+
+    Each call sleeps `latency` seconds (one round trip to FCM) plus `per_message` seconds per
+    message. Messages to a token in `invalid_tokens` fail with UnregisteredError, and a
+    `transient_rate` fraction of the others fail with UnavailableError, as FCM reports them.
+    Delivered messages are kept in `delivered`; calls and the largest concurrency seen are counted.
+    """
+
+    def __init__(self, latency: float = 0.1, per_message: float = 0.0, invalid_tokens: Iterable[str] = (),
+                 transient_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.per_message = per_message
+        self.invalid_tokens = set(invalid_tokens)
+        self.transient_rate = transient_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self.delivered: List[messaging.Message] = []
+
+    def _enter(self, n: int) -> None:
+        with self._lock:
+            self.calls += 1
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        time.sleep(self.latency + self.per_message * n)
+
+    def _exit(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def _deliver(self, message: messaging.Message) -> messaging.SendResponse:
+        if message.token is not None and message.token in self.invalid_tokens:
+            return messaging.SendResponse(None, messaging.UnregisteredError("Requested entity was not found."))
+        with self._lock:
+            transient = self._random.random() < self.transient_rate
+            if not transient:
+                self.delivered.append(message)
+                message_id = f"projects/fake/messages/{len(self.delivered)}"
+        if transient:
+            return messaging.SendResponse(None, exceptions.UnavailableError("The service is currently unavailable."))
+        return messaging.SendResponse({"name": message_id}, None)
+
+    def send(self, message: messaging.Message, dry_run: bool = False, app=None) -> str:
+        self._enter(1)
+        try:
+            response = self._deliver(message)
+        finally:
+            self._exit()
+        if response.exception is not None:
+            raise response.exception
+        return response.message_id
+
+    def send_each(self, messages: List[messaging.Message], dry_run: bool = False, app=None) -> messaging.BatchResponse:
+        if len(messages) > 500:
+            raise ValueError("messages must not contain more than 500 elements.")
+        self._enter(len(messages))
+        try:
+            return messaging.BatchResponse([self._deliver(message) for message in messages])
+        finally:
+            self._exit()
+
+    def delivered_to(self, topic: Optional[str] = None, token: Optional[str] = None) -> List[messaging.Message]:
+        with self._lock:
+            return [m for m in self.delivered if (topic is None or m.topic == topic) and (token is None or m.token == token)]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {"calls": self.calls, "delivered": len(self.delivered), "max_in_flight": self.max_in_flight}
@@ -1,6 +1,12 @@
+import asyncio
+import os
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
 import firebase_admin
-from firebase_admin import credentials, messaging
+from firebase_admin import credentials, exceptions, messaging
 import config
+from core import instrumentation
 
 # Initialize Firebase Admin SDK
 try:
@@ -32,3 +38,162 @@ def send_notification(title: str, body: str, token: str):
         print('Successfully sent message:', response)
     except Exception as e:
         print('Error sending message:', e)
+
+
+def topic_message(title: str, body: str, topic: str, data: dict = None) -> messaging.Message:
+    return messaging.Message(notification=messaging.Notification(title=title, body=body), data=data, topic=topic)
+
+
+def token_messages(tokens: Iterable[str], title: str, body: str, data: dict = None) -> List[messaging.Message]:
+    """One message per device token (what a multicast expands to), for BatchSender.send."""
+    notification = messaging.Notification(title=title, body=body)
+    return [messaging.Message(notification=notification, data=data, token=token) for token in tokens]
+
+
+# 代表 token 已失效、應從訂閱名單移除的錯誤
+_INVALID_TOKEN_ERRORS = (messaging.UnregisteredError, messaging.SenderIdMismatchError)
+# 可以稍後重送的錯誤
+_RETRYABLE_ERRORS = (exceptions.UnavailableError, exceptions.InternalError, exceptions.DeadlineExceededError,
+                     messaging.QuotaExceededError, ConnectionError, TimeoutError)
+
+
+def _is_invalid_token(message: messaging.Message, error: Exception) -> bool:
+    if message.token is None:
+        return False
+    if isinstance(error, _INVALID_TOKEN_ERRORS):
+        return True
+    # FCM 對格式錯誤的 token 回 INVALID_ARGUMENT
+    return isinstance(error, exceptions.InvalidArgumentError) and "token" in str(error).lower()
+
+
+class BatchSender:
+    """
+    Sends many FCM messages with send_each, `batch_size` (at most 500) per call.
+
+    Batches run concurrently, at most `concurrency` calls in flight. Each message's result is
+    checked: messages to tokens FCM reports as unregistered or invalid are not retried and their
+    tokens are passed to `on_invalid_tokens` (e.g. drop_tokens) once the run finishes; transient
+    errors (unavailable, quota, internal) are resent with exponential backoff up to
+    `max_attempts`, as is a whole batch whose call raised one.
+
+    The report returned by `send` lists the positions of the delivered messages under
+    "delivered", so callers can act on exactly the messages that went out (last_report omits it).
+
+    `backend` is the messaging module, or services.fake_messaging.FakeMessaging offline.
+    """
+
+    def __init__(self, backend=messaging, batch_size: int = 500, concurrency: int = 4, max_attempts: int = 3,
+                 backoff: float = 1.0, on_invalid_tokens: Optional[Callable[[List[str]], None]] = None):
+        if not 1 <= batch_size <= 500:
+            raise ValueError("batch_size must be between 1 and 500")
+        self.backend = backend
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.on_invalid_tokens = on_invalid_tokens
+        self.last_report: Optional[Dict] = None
+
+    async def send(self, messages: List[messaging.Message], dry_run: bool = False) -> Dict:
+        """Send every message; returns counts of sent / failed messages, invalid tokens and timing."""
+        started = time.perf_counter()
+        report = {"messages": len(messages), "calls": 0, "sent": 0, "failed": 0, "retried": 0,
+                  "invalid_tokens": [], "errors": {}, "delivered": []}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # 每批以訊息在 messages 中的位置表示，回報哪些訊息送達
+        batches = [list(range(i, min(i + self.batch_size, len(messages)))) for i in range(0, len(messages), self.batch_size)]
+        await asyncio.gather(*(self._send_batch(messages, batch, semaphore, report, dry_run) for batch in batches))
+        report["delivered"].sort()
+
+        if report["invalid_tokens"] and self.on_invalid_tokens is not None:
+            try:
+                await asyncio.to_thread(self.on_invalid_tokens, list(report["invalid_tokens"]))
+            except Exception as e:
+                print(f"[FCM] Failed to drop {len(report['invalid_tokens'])} invalid tokens: {e}")
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        instrumentation.NOTIFICATIONS.inc(report["sent"], result="sent")
+        instrumentation.NOTIFICATIONS.inc(report["failed"] - len(report["invalid_tokens"]), result="failed")
+        instrumentation.NOTIFICATIONS.inc(len(report["invalid_tokens"]), result="invalid_token")
+        instrumentation.NOTIFICATIONS.inc(report["retried"], result="retried")
+        self.last_report = {key: value for key, value in report.items() if key != "delivered"}
+        return report
+
+    async def _send_batch(self, messages: List[messaging.Message], batch: List[int], semaphore: asyncio.Semaphore,
+                          report: Dict, dry_run: bool) -> None:
+        for attempt in range(1, self.max_attempts + 1):
+            last_attempt = attempt == self.max_attempts
+            async with semaphore:
+                report["calls"] += 1
+                call_started = time.perf_counter()
+                try:
+                    response = await asyncio.to_thread(self.backend.send_each, [messages[i] for i in batch], dry_run)
+                except Exception as e:
+                    if isinstance(e, _RETRYABLE_ERRORS) and not last_attempt:
+                        response = None
+                    else:
+                        print(f"[FCM] Batch of {len(batch)} failed: {e}")
+                        self._count_error(report, e, len(batch))
+                        return
+                finally:
+                    instrumentation.NOTIFICATION_BATCH_DURATION.observe(time.perf_counter() - call_started)
+
+            if response is None:
+                retry = batch
+            else:
+                retry = []
+                for i, result in zip(batch, response.responses):
+                    message = messages[i]
+                    if result.success:
+                        report["sent"] += 1
+                        report["delivered"].append(i)
+                    elif _is_invalid_token(message, result.exception):
+                        report["invalid_tokens"].append(message.token)
+                        report["failed"] += 1
+                    elif isinstance(result.exception, _RETRYABLE_ERRORS) and not last_attempt:
+                        retry.append(i)
+                    else:
+                        self._count_error(report, result.exception, 1)
+            if not retry:
+                return
+            report["retried"] += len(retry)
+            batch = retry
+            await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+    @staticmethod
+    def _count_error(report: Dict, error: Exception, n: int) -> None:
+        report["failed"] += n
+        name = type(error).__name__
+        report["errors"][name] = report["errors"].get(name, 0) + n
+
+
+def drop_tokens(tokens: List[str]) -> int:
+    """Delete the fcmTokens registrations (see api/fcm.py) that use any of `tokens`; returns the count."""
+    from firebase_admin import firestore
+
+    collection = firestore.client().collection("fcmTokens")
+    removed = 0
+    # Firestore 的 in 查詢一次最多 30 個值
+    for i in range(0, len(tokens), 30):
+        for doc in collection.where("fcmToken", "in", tokens[i:i + 30]).stream():
+            doc.reference.delete()
+            removed += 1
+    print(f"[FCM] Dropped {removed} registrations with invalid tokens")
+    return removed
+
+
+def _messaging_backend():
+    # FAKE_FCM=1：不連線 FCM，改用本機的 FakeMessaging（離線測試、benchmark）
+    if os.environ.get("FAKE_FCM"):
+        from services.fake_messaging import FakeMessaging
+        return FakeMessaging(latency=float(os.environ.get("FAKE_FCM_LATENCY", "0.1")))
+    return messaging
+
+
+batch_sender = BatchSender(
+    backend=_messaging_backend(),
+    batch_size=config.FCM_BATCH_SIZE,
+    concurrency=config.FCM_BATCH_CONCURRENCY,
+    max_attempts=config.FCM_MAX_ATTEMPTS,
+    backoff=config.FCM_RETRY_BACKOFF_SECONDS,
+    on_invalid_tokens=None if os.environ.get("FAKE_FCM") else drop_tokens,
+)
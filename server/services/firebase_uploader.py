@@ -58,3 +58,42 @@ def upload_file_to_storage(local_file_path: str, destination_blob_name: str) ->
         print(f"Error uploading file to Firebase Storage: {e}")
         return ""
 
+
+def storage_configured() -> bool:
+    """True when uploads have somewhere to go: a Firebase bucket or LOCAL_STORAGE_DIR."""
+    return bool(os.getenv('LOCAL_STORAGE_DIR') or os.getenv('FIREBASE_STORAGE_BUCKET'))
+
+def get_bucket():
+    """
+    The bucket uploads go to. With LOCAL_STORAGE_DIR set, a directory-backed stand-in
+    (services.local_storage) is used instead of Firebase Storage, e.g. for offline testing.
+    """
+    local_dir = os.getenv('LOCAL_STORAGE_DIR')
+    if local_dir:
+        from services.local_storage import get_local_bucket
+        return get_local_bucket(local_dir)
+    if not initialize_firebase():
+        return None
+    return storage.bucket()
+
+def upload_bytes(data: bytes, destination_blob_name: str, content_type: str = "application/json; charset=utf-8",
+                 content_encoding: str = None, cache_control: str = None) -> str:
+    """
+    Uploads an in-memory payload and returns its public URL ("" on failure).
+
+    With content_encoding="gzip" the bytes must already be gzip-compressed; Storage serves them
+    with Content-Encoding: gzip (and decompresses for clients that do not accept it).
+    """
+    try:
+        bucket = get_bucket()
+        if bucket is None:
+            return ""
+        blob = bucket.blob(destination_blob_name)
+        blob.content_encoding = content_encoding
+        blob.cache_control = cache_control
+        blob.upload_from_string(data, content_type=content_type)
+        blob.make_public()
+        return blob.public_url
+    except Exception as e:
+        print(f"Error uploading {destination_blob_name} to Firebase Storage: {e}")
+        return ""
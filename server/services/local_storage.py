@@ -0,0 +1,124 @@
+import gzip
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+
+class LocalBlob:
+    """
+    File-backed stand-in for google.cloud.storage.Blob (the subset the uploader uses).
+    Object bytes live at <root>/<name>; content type/encoding and cache control in a
+    sidecar file under <root>/.meta/.
+    """
+
+    def __init__(self, bucket: "LocalBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+        self.content_type: Optional[str] = None
+        self.content_encoding: Optional[str] = None
+        self.cache_control: Optional[str] = None
+        self.metadata: Dict[str, str] = {}
+
+    @property
+    def _path(self) -> Path:
+        return self.bucket.root / self.name
+
+    @property
+    def _meta_path(self) -> Path:
+        return self.bucket.root / ".meta" / f"{self.name}.json"
+
+    @property
+    def public_url(self) -> str:
+        return self._path.resolve().as_uri()
+
+    @property
+    def size(self) -> Optional[int]:
+        return self._path.stat().st_size if self._path.exists() else None
+
+    def exists(self) -> bool:
+        return self._path.exists()
+
+    def upload_from_string(self, data, content_type: Optional[str] = None) -> None:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if content_type:
+            self.content_type = content_type
+        meta = {
+            "content_type": self.content_type,
+            "content_encoding": self.content_encoding,
+            "cache_control": self.cache_control,
+            "metadata": self.metadata,
+        }
+        with self.bucket.lock:
+            for path, body in ((self._path, data), (self._meta_path, json.dumps(meta).encode("utf-8"))):
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_name(path.name + ".tmp")
+                tmp.write_bytes(body)
+                os.replace(tmp, path)
+            self.bucket.uploads += 1
+            self.bucket.bytes_uploaded += len(data)
+
+    def upload_from_filename(self, filename: str, content_type: Optional[str] = None) -> None:
+        self.upload_from_string(Path(filename).read_bytes(), content_type=content_type)
+
+    def reload(self) -> None:
+        meta = json.loads(self._meta_path.read_text(encoding="utf-8")) if self._meta_path.exists() else {}
+        self.content_type = meta.get("content_type")
+        self.content_encoding = meta.get("content_encoding")
+        self.cache_control = meta.get("cache_control")
+        self.metadata = meta.get("metadata") or {}
+
+    def download_as_bytes(self, raw_download: bool = False) -> bytes:
+        """Like GCS: gzip-encoded objects are decompressed unless raw_download is set."""
+        self.reload()
+        data = self._path.read_bytes()
+        if self.content_encoding == "gzip" and not raw_download:
+            return gzip.decompress(data)
+        return data
+
+    def make_public(self) -> None:
+        pass
+
+    def delete(self) -> None:
+        for path in (self._path, self._meta_path):
+            if path.exists():
+                path.unlink()
+
+
+class LocalBucket:
+    """Directory standing in for the Firebase Storage bucket, for offline runs and tests."""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.name = f"local:{self.root}"
+        self.lock = threading.Lock()
+        self.uploads = 0
+        self.bytes_uploaded = 0
+
+    def blob(self, name: str) -> LocalBlob:
+        return LocalBlob(self, name)
+
+    def get_blob(self, name: str) -> Optional[LocalBlob]:
+        blob = LocalBlob(self, name)
+        if not blob.exists():
+            return None
+        blob.reload()
+        return blob
+
+    def list_blobs(self, prefix: str = "") -> Iterator[LocalBlob]:
+        if not self.root.exists():
+            return
+        for path in sorted(self.root.rglob("*")):
+            name = path.relative_to(self.root).as_posix()
+            if path.is_file() and not name.startswith(".meta/") and not name.endswith(".tmp") and name.startswith(prefix):
+                yield self.get_blob(name)
+
+
+_BUCKETS: Dict[str, LocalBucket] = {}
+
+
+def get_local_bucket(root: str) -> LocalBucket:
+    """One LocalBucket per directory, so upload counters are shared within the process."""
+    return _BUCKETS.setdefault(root, LocalBucket(root))
@@ -0,0 +1,345 @@
+import asyncio
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import config
+from core import instrumentation, snapshot_binary
+from core.snapshot_diff import diff_records
+from services import firebase_uploader
+
+_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+MANIFEST_BLOB = "forecasts/manifest.json"
+SHARD_INDEX_BLOB = "forecasts/shards/index.json"
+MANIFEST_FORMAT = 1
+# 基準檔與 patch 內容不會再變；manifest 每次都要重新取得
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MANIFEST_CACHE_CONTROL = "no-cache, max-age=0"
+
+
+def encode_gzip_json(doc: Dict[str, Any], level: int = 6) -> Dict[str, Any]:
+    """
+    Compact JSON streamed straight into a gzip buffer (the uncompressed text is never held
+    as one string). Returns {"body": gzip bytes, "raw_bytes": uncompressed size}.
+    """
+    buffer = io.BytesIO()
+    raw = 0
+    # mtime=0：內容相同時壓縮結果也相同
+    with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=level, mtime=0) as gz:
+        for chunk in _ENCODER.iterencode(doc):
+            data = chunk.encode("utf-8")
+            raw += len(data)
+            gz.write(data)
+    return {"body": buffer.getvalue(), "raw_bytes": raw}
+
+
+def shard_towns(towns: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """{township_code: record} -> {county_code: {township_code: record}} (county code = prefix before '-')."""
+    shards: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for code, record in towns.items():
+        shards.setdefault(code.split("-", 1)[0], {})[code] = record
+    return shards
+
+
+def content_hash(towns: Dict[str, Dict[str, Any]]) -> str:
+    """
+    First 16 hex digits of the sha256 of a shard's canonical JSON. update_time is not part of
+    it, so a shard whose records did not change keeps its hash (and its blob).
+    """
+    body = json.dumps(towns, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return hashlib.sha256(body).hexdigest()[:16]
+
+
+def apply_patch(towns: Dict[str, Dict[str, Any]], patch: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Reference client update: apply one patch document to {township_code: record}.
+    A township mapped to null is removed; otherwise its listed fields are replaced.
+    """
+    result = dict(towns)
+    for code, changed in patch["towns"].items():
+        if changed is None:
+            result.pop(code, None)
+        else:
+            result[code] = {**result.get(code, {}), **changed}
+    return result
+
+
+class SnapshotPublisher:
+    """
+    Uploads published snapshots to Storage in the background.
+
+    `submit` returns immediately. One worker task uploads; if several snapshots are submitted
+    while it is busy only the newest is uploaded next, so uploads happen in order and a slow
+    Storage never backs up work or delays notifications.
+
+    Each snapshot is diffed against the last one that was successfully published. Normally only
+    a patch (changed townships and fields) is uploaded; a full baseline is uploaded first, every
+    `baseline_every` patches, and whenever the patch would not be much smaller than the full
+    document. `forecasts/manifest.json` (written last) lists the current baseline and the chain
+    of patches since it:
+
+        {"format": 1, "version": 12, "update_time": ...,
+         "baseline": {"version": 9, "path": ..., "bytes": ...},
+         "patches": [{"from": 9, "to": 10, "path": ..., "bytes": ...}, ...]}
+
+    A client at version v applies the patches with from >= v; one that is older than the
+    baseline (or new) downloads the baseline and then every patch. A snapshot whose townships
+    did not change since the last publish uploads nothing, so the manifest version stays put.
+    After a restart the leader continues from the manifest's version (`remote_version`), so
+    versions never go backwards for clients.
+
+    Clients that only need one area use the per-county shards instead: `forecasts/shards/index.json`
+    maps each county code to a content-addressed shard (`<county>_<hash>.json`) with its sha256.
+    Shards are encoded and uploaded in parallel; a shard whose hash is unchanged since the last
+    upload is skipped, and the index is written after the changed shards.
+
+    Every snapshot is also uploaded in the binary encoding (core.snapshot_binary) as
+    `forecasts/bin/all_forecasts_v<version>.bin`; the manifest's "binary" entry points at the
+    latest one that uploaded successfully.
+    """
+
+    def __init__(self, gzip_level: int = 6, baseline_every: int = 24, baseline_ratio: float = 0.5, shard_workers: int = 8):
+        self.gzip_level = gzip_level
+        self.shard_workers = shard_workers
+        self.baseline_every = baseline_every
+        self.baseline_ratio = baseline_ratio
+        self._latest: Optional[Dict[str, Any]] = None
+        self._worker: Optional[asyncio.Task] = None
+        # 最後一次成功發布的內容，用來計算下一個 patch
+        self._published_towns: Optional[Dict[str, Dict[str, Any]]] = None
+        self._published_version: Optional[int] = None
+        self._baseline: Optional[Dict[str, Any]] = None
+        self._patches: List[Dict[str, Any]] = []
+        # 各縣市分片最後成功上傳的 {hash, path, bytes, townships}
+        self._shards: Dict[str, Dict[str, Any]] = {}
+        self._binary: Optional[Dict[str, Any]] = None
+        self.last_report: Optional[Dict[str, Any]] = None
+        self.stats = {"submitted": 0, "superseded": 0, "uploaded": 0, "failed": 0,
+                      "baselines": 0, "patches": 0, "unchanged": 0, "bytes_uploaded": 0, "bytes_saved": 0,
+                      "shards_uploaded": 0, "shards_skipped": 0}
+
+    def submit(self, doc: Dict[str, Any], version: int) -> None:
+        if self._latest is not None:
+            self.stats["superseded"] += 1
+        self._latest = {"doc": doc, "version": version}
+        self.stats["submitted"] += 1
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._drain())
+
+    async def _drain(self) -> None:
+        while self._latest is not None:
+            item, self._latest = self._latest, None
+            try:
+                report = await asyncio.to_thread(self.publish, item["doc"], item["version"])
+            except Exception as e:
+                report = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.stats["uploaded" if report.get("ok") else "failed"] += 1
+            self.last_report = report
+            if not report.get("ok"):
+                print(f"[PUBLISH] Upload failed: {report.get('error')}")
+
+    def _upload(self, body: bytes, blob_name: str, cache_control: str) -> str:
+        return firebase_uploader.upload_bytes(body, blob_name, content_encoding="gzip", cache_control=cache_control)
+
+    def publish(self, doc: Dict[str, Any], version: int) -> Dict[str, Any]:
+        """Upload one unified document as a patch or a baseline, then the manifest (blocking)."""
+        started = time.perf_counter()
+        towns = doc.get("towns") or {}
+        full = encode_gzip_json(doc, self.gzip_level)
+        full_bytes = len(full["body"])
+
+        patch = None
+        if self._published_towns is not None and self._published_version is not None \
+                and version > self._published_version and len(self._patches) < self.baseline_every:
+            patch_doc = {
+                "from": self._published_version,
+                "to": version,
+                "update_time": doc.get("update_time"),
+                "towns": diff_records(self._published_towns, towns),
+            }
+            if not patch_doc["towns"]:
+                # 沒有任何鄉鎮變動：不上傳 patch，也不推進 manifest 版本
+                self.stats["unchanged"] += 1
+                print(f"[PUBLISH] v{version} unchanged since v{self._published_version}, nothing uploaded")
+                return {"ok": True, "kind": "unchanged", "version": self._published_version, "changed_townships": 0,
+                        "uploaded_bytes": 0, "seconds": round(time.perf_counter() - started, 3)}
+            patch = encode_gzip_json(patch_doc, self.gzip_level)
+            if len(patch["body"]) > full_bytes * self.baseline_ratio:
+                patch = None
+
+        stamp = datetime.datetime.now().strftime('%Y%m%d%H%M')
+        if patch is None:
+            kind = "baseline"
+            blob_name = f"forecasts/all_forecasts_{stamp}_v{version}.txt"
+            body = full["body"]
+            baseline = {"version": version, "path": blob_name, "bytes": len(body), "update_time": doc.get("update_time")}
+            patches: List[Dict[str, Any]] = []
+        else:
+            kind = "patch"
+            blob_name = f"forecasts/patches/patch_{self._published_version}_{version}.json"
+            body = patch["body"]
+            baseline = self._baseline
+            patches = self._patches + [{"from": self._published_version, "to": version, "path": blob_name, "bytes": len(body)}]
+
+        if not self._upload(body, blob_name, IMMUTABLE_CACHE_CONTROL):
+            return {"ok": False, "kind": kind, "blob": blob_name, "error": "upload failed"}
+        binary = self.publish_binary(doc, version)
+        manifest = encode_gzip_json({
+            "format": MANIFEST_FORMAT,
+            "version": version,
+            "update_time": doc.get("update_time"),
+            "baseline": baseline,
+            "patches": patches,
+            "binary": self._binary,
+        }, self.gzip_level)["body"]
+        if not self._upload(manifest, MANIFEST_BLOB, MANIFEST_CACHE_CONTROL):
+            return {"ok": False, "kind": kind, "blob": MANIFEST_BLOB, "error": "manifest upload failed"}
+
+        self._published_towns, self._published_version = towns, version
+        self._baseline, self._patches = baseline, patches
+        uploaded = len(body) + len(manifest)
+        # 與過去每次上傳完整檔相比省下的量（patch 與 manifest 都算在上傳量內）
+        saved = max(0, full_bytes - uploaded) if kind == "patch" else 0
+        self.stats["baselines" if kind == "baseline" else "patches"] += 1
+        self.stats["bytes_uploaded"] += uploaded
+        self.stats["bytes_saved"] += saved
+        instrumentation.PUBLISH_BYTES.inc(len(body), kind=kind)
+        instrumentation.PUBLISH_BYTES.inc(len(manifest), kind="manifest")
+        instrumentation.PUBLISH_BYTES_SAVED.inc(saved)
+
+        report = {
+            "ok": True,
+            "kind": kind,
+            "version": version,
+            "blob": blob_name,
+            "changed_townships": len(patch_doc["towns"]) if kind == "patch" else len(towns),
+            "raw_bytes": full["raw_bytes"],
+            "full_bytes": full_bytes,
+            "uploaded_bytes": uploaded,
+            "saved_bytes": saved,
+            "seconds": round(time.perf_counter() - started, 3),
+            "binary": binary,
+        }
+        if kind == "patch":
+            print(f"[PUBLISH] v{version} patch from v{self._patches[-1]['from']}: {report['changed_townships']} townships changed, "
+                  f"uploaded {uploaded} bytes instead of {full_bytes} (saved {saved} bytes) in {report['seconds']:.2f}s")
+        else:
+            print(f"[PUBLISH] v{version} baseline {blob_name}: {report['raw_bytes']} -> {full_bytes} bytes gzip in {report['seconds']:.2f}s")
+
+        report["shards"] = self.publish_shards(doc, version, full_bytes)
+        return report
+
+    def remote_version(self) -> int:
+        """Version of the manifest currently in Storage (0 if there is none); blocking."""
+        bucket = firebase_uploader.get_bucket()
+        blob = bucket.get_blob(MANIFEST_BLOB) if bucket is not None else None
+        if blob is None:
+            return 0
+        body = blob.download_as_bytes()
+        # 依 Storage 是否解壓縮，收到的可能仍是 gzip
+        if body[:2] == b"\x1f\x8b":
+            body = gzip.decompress(body)
+        return int(json.loads(body).get("version") or 0)
+
+    def publish_binary(self, doc: Dict[str, Any], version: int) -> Dict[str, Any]:
+        """Upload the binary encoding of one snapshot (blocking); a failure leaves the previous one listed."""
+        path = f"forecasts/bin/all_forecasts_v{version}.bin"
+        raw = snapshot_binary.encode_snapshot(doc)
+        body = gzip.compress(raw, compresslevel=self.gzip_level, mtime=0)
+        if not firebase_uploader.upload_bytes(body, path, content_type=snapshot_binary.MEDIA_TYPE,
+                                              content_encoding="gzip", cache_control=IMMUTABLE_CACHE_CONTROL):
+            return {"ok": False, "error": "binary upload failed"}
+        self._binary = {
+            "version": version,
+            "path": path,
+            "format": f"{snapshot_binary.BINARY_FORMAT}/{snapshot_binary.BINARY_FORMAT_VERSION}",
+            "bytes": len(body),
+        }
+        self.stats["bytes_uploaded"] += len(body)
+        instrumentation.PUBLISH_BYTES.inc(len(body), kind="binary")
+        return {"ok": True, "path": path, "raw_bytes": len(raw), "bytes": len(body)}
+
+    def publish_shards(self, doc: Dict[str, Any], version: int, full_bytes: int = 0) -> Dict[str, Any]:
+        """Upload the changed per-county shards in parallel, then the shard index (blocking)."""
+        shards = shard_towns(doc.get("towns") or {})
+        hashes = {county: content_hash(towns) for county, towns in shards.items()}
+        changed = [county for county in shards if self._shards.get(county, {}).get("hash") != hashes[county]]
+        removed = [county for county in self._shards if county not in shards]
+
+        def upload(county: str):
+            digest = hashes[county]
+            path = f"forecasts/shards/{county}_{digest}.json"
+            body = encode_gzip_json({"county": county, "hash": digest, "towns": shards[county]}, self.gzip_level)["body"]
+            if not self._upload(body, path, IMMUTABLE_CACHE_CONTROL):
+                return county, None
+            return county, {"hash": digest, "path": path, "bytes": len(body), "townships": len(shards[county])}
+
+        uploaded = 0
+        if changed:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.shard_workers, len(changed))), thread_name_prefix="shard") as pool:
+                results = list(pool.map(upload, changed))
+            failed = [county for county, entry in results if entry is None]
+            for county, entry in results:
+                if entry is not None:
+                    self._shards[county] = entry
+                    uploaded += entry["bytes"]
+            if failed:
+                # 不更新 index：舊 index 指向的分片仍然存在且一致
+                return {"ok": False, "error": f"shard upload failed: {', '.join(failed)}"}
+        for county in removed:
+            self._shards.pop(county, None)
+
+        index_bytes = 0
+        if changed or removed:
+            index = encode_gzip_json({
+                "format": MANIFEST_FORMAT,
+                "version": version,
+                "update_time": doc.get("update_time"),
+                "shards": self._shards,
+            }, self.gzip_level)["body"]
+            if not self._upload(index, SHARD_INDEX_BLOB, MANIFEST_CACHE_CONTROL):
+                return {"ok": False, "error": "shard index upload failed"}
+            index_bytes = len(index)
+
+        self.stats["shards_uploaded"] += len(changed)
+        self.stats["shards_skipped"] += len(shards) - len(changed)
+        instrumentation.PUBLISH_BYTES.inc(uploaded, kind="shard")
+        instrumentation.PUBLISH_BYTES.inc(index_bytes, kind="shard_index")
+        sizes = sorted(entry["bytes"] for entry in self._shards.values())
+        median_share = sizes[len(sizes) // 2] / full_bytes if sizes and full_bytes else None
+        report = {
+            "ok": True,
+            "uploaded": len(changed),
+            "skipped": len(shards) - len(changed),
+            "uploaded_bytes": uploaded + index_bytes,
+            "median_shard_share": round(median_share, 4) if median_share is not None else None,
+        }
+        share = f"; the median county is {median_share:.1%} of the full document" if median_share is not None else ""
+        print(f"[PUBLISH] v{version} shards: {len(changed)} uploaded, {report['skipped']} unchanged{share}")
+        return report
+
+    async def join(self) -> None:
+        """Wait for the submitted snapshots to be uploaded."""
+        while self._worker is not None and not self._worker.done():
+            await asyncio.shield(self._worker)
+
+    async def stop(self) -> None:
+        self._latest = None
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+
+snapshot_publisher = SnapshotPublisher(
+    gzip_level=config.PUBLISH_GZIP_LEVEL,
+    baseline_every=config.PUBLISH_BASELINE_EVERY,
+    baseline_ratio=config.PUBLISH_BASELINE_RATIO,
+    shard_workers=config.PUBLISH_SHARD_WORKERS,
+)
@@ -0,0 +1,102 @@
+import asyncio
+import json
+from typing import Any, Dict, Optional, Set
+
+from core.snapshot_diff import diff_records
+
+
+class Subscription:
+    """One connected SSE/WebSocket client: an optional filter and a small bounded inbox."""
+
+    __slots__ = ("county_codes", "township_codes", "queue")
+
+    def __init__(self, county_codes: Optional[Set[str]], township_codes: Optional[Set[str]], max_pending: int):
+        self.county_codes = county_codes or None
+        self.township_codes = township_codes or None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+
+    def push(self, event: Dict[str, Any]) -> None:
+        # 慢速用戶端只保留最新事件；版本號單調遞增，舊事件可以丟棄
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(event)
+
+
+class SnapshotBroadcaster:
+    """
+    Fans out "snapshot version N available" events, each carrying the per-county delta of
+    township records against the previously published snapshot.
+    """
+
+    def __init__(self, max_pending: int = 4):
+        self._max_pending = max_pending
+        self._subscribers: Set[Subscription] = set()
+        self._records: Dict[str, Dict[str, Any]] = {}
+
+    def subscribe(self, county_codes: Optional[Set[str]] = None, township_codes: Optional[Set[str]] = None) -> Subscription:
+        sub = Subscription(county_codes, township_codes, self._max_pending)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        self._subscribers.discard(sub)
+
+    def set_baseline(self, records: Dict[str, Dict[str, Any]]) -> None:
+        """Remember the records of a snapshot without notifying anyone (e.g. after a warm start)."""
+        self._records = records
+
+    def publish(self, version: int, update_time: Optional[str], records: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Diff `records` ({township_code: record}) against the last snapshot and notify subscribers."""
+        event = self.prepare(version, update_time, records)
+        self.notify(event)
+        return event
+
+    def prepare(self, version: int, update_time: Optional[str], records: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        The event for `records` (per-county delta against the last snapshot), which becomes the new
+        baseline. Does not touch subscribers, so it may run off the event loop; pass the result to notify.
+        """
+        changes = diff_records(self._records, records)
+        self._records = records
+
+        counties: Dict[str, Dict[str, Any]] = {}
+        for township_code, changed in changes.items():
+            county_code = township_code.split("-", 1)[0]
+            counties.setdefault(county_code, {})[township_code] = changed
+        return {"version": version, "update_time": update_time, "counties": counties}
+
+    def notify(self, event: Dict[str, Any]) -> None:
+        """Push an event from prepare to every subscriber (event loop only)."""
+        for sub in list(self._subscribers):
+            sub.push(self.filter_event(event, sub))
+
+    @staticmethod
+    def filter_event(event: Dict[str, Any], sub: Subscription) -> Dict[str, Any]:
+        if sub.county_codes is None and sub.township_codes is None:
+            return event
+        counties = {}
+        for county_code, townships in event["counties"].items():
+            if sub.county_codes and county_code in sub.county_codes:
+                counties[county_code] = townships
+            elif sub.township_codes:
+                picked = {code: v for code, v in townships.items() if code in sub.township_codes}
+                if picked:
+                    counties[county_code] = picked
+        return {**event, "counties": counties}
+
+
+def parse_filter(value: str, known: Dict[str, str]) -> Optional[Set[str]]:
+    """Comma-separated codes -> set of known codes (unknown ones are ignored)."""
+    picked = {c.strip() for c in value.split(",") if c.strip() in known}
+    return picked or None
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    data = json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+    return f"id: {event['version']}\nevent: snapshot\ndata: {data}\n\n"
+
+
+broadcaster = SnapshotBroadcaster()